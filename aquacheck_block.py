@@ -1,79 +1,243 @@
 from nio.block.base import Block
+from nio.command import command
+from nio.modules.scheduler import Job
 from nio.signal.base import Signal
 from nio.util.discovery import discoverable
-from nio.properties import StringProperty, BoolProperty, IntProperty
+from nio.util.logging import get_nio_logger
+from nio.properties import StringProperty, BoolProperty, IntProperty, \
+    SelectProperty, FloatProperty, ListProperty, PropertyHolder, \
+    ObjectProperty
 from nio.properties import VersionProperty
+from concurrent.futures import Future
+from datetime import timedelta
 from enum import Enum
+from functools import partial
+from threading import Condition, Lock, Thread
+import asyncio
+import io
 import time
 import sched
 import bisect
+import heapq
 import re
+import select
 import serial
 import tenacity
+from .metrics import metrics
 
 #/* ================== Based on Arduino SDI-12 Code =========================
 #*/
 
-def debugThis(msg):
-  if True:
-    print(msg)
-  else:
-    pass
+# Logger of the SDI-12 classes. Messages are formatted only if they are
+#  logged, so debug messages cost next to nothing on the bus hot path.
+_logger = get_nio_logger("SDI12")
 
+class OverflowPolicy(Enum):
+  DROP_OLDEST = 'drop_oldest'   # discard the oldest bytes to make room
+  DROP_NEWEST = 'drop_newest'   # discard the incoming bytes that don't fit
+  RAISE = 'raise'               # raise CirBufferOverflow, nothing stored
+
+class CirBufferOverflow(BufferError):
+  pass
+
+# Fixed capacity byte ring buffer. Data lives in one preallocated bytearray
+#  and is copied in and out in at most two slices, so reads and writes of
+#  any length cost no per-byte work. Single byte reads return a bytes object
+#  of length 1, and -1 is returned when the requested data is not there.
 class CirBuffer:
-  def __init__(self,size):
+  def __init__(self, size, overflow=OverflowPolicy.DROP_NEWEST):
     self._maxsize = size
+    self._overflowPolicy = overflow
     self._bufferOverflow = False
-    self.data = []
+    self.overflowCount = 0        # number of bytes dropped on overflow
+    self._buf = bytearray(size)
+    self._view = memoryview(self._buf)
+    self._head = 0                # index of the oldest byte
+    self._count = 0               # number of bytes stored
+
+  def __len__(self):
+    return self._count
 
-  def append(self,x):
-    if len(self.data)+1 > self._maxsize:
+  # Store bytes, returns how many of them were stored
+  def write(self, data):
+    data = memoryview(data)
+    n = len(data)
+    free = self._maxsize - self._count
+    if n > free:
+      if self._overflowPolicy == OverflowPolicy.RAISE:
+        raise CirBufferOverflow(
+          "{} bytes do not fit in {} free".format(n, free))
       self._bufferOverflow = True
+      self.overflowCount += n - free
+      if self._overflowPolicy == OverflowPolicy.DROP_OLDEST:
+        if n >= self._maxsize:
+          data = data[n-self._maxsize:]
+          n = self._maxsize
+        self._discard(n - free)
+      else:
+        data = data[:free]
+        n = free
+    tail = (self._head + self._count) % self._maxsize
+    first = min(n, self._maxsize - tail)
+    self._view[tail:tail+first] = data[:first]
+    self._view[0:n-first] = data[first:n]
+    self._count += n
+    return n
+
+  def append(self, x):
+    if len(x) == 1 and self._count < self._maxsize:
+      self._buf[(self._head + self._count) % self._maxsize] = x[0]
+      self._count += 1
     else:
-      self.data.append(x)
+      self.write(x)
 
-  def read(self):
+  # Read the next byte, or up to n bytes if n is given
+  def read(self, n=None):
     self._bufferOverflow = False
-    try:
-      return self.data.pop(0)
-    except:
-      return -1
+    if n is None:
+      if not self._count:
+        return -1
+      value = self._buf[self._head]
+      self._discard(1)
+      return bytes((value,))
+    return self._take(min(n, self._count))
 
+  # Read up to and including the next newline
   def readline(self):
+    return self.read_until(b'\n')
+
+  # Read up to and including the next terminator
+  def read_until(self, terminator):
     self._bufferOverflow = False
-    try:
-      i = self.data.index(b'\n')+1
-      returnValue = self.data[0:i]
-      self.data = self.data[i:]
-      return returnValue
-    except:
+    i = self._find(terminator)
+    if i < 0:
       return -1
+    return self._take(i + len(terminator))
 
   def flush(self):
-    self.data = []
+    self._head = 0
+    self._count = 0
     self._bufferOverflow = False
 
   def peek(self):
-    try:
-      return self.data[0]
-    except:
+    if not self._count:
       return -1
+    return bytes(self._buf[self._head:self._head+1])
 
   def available(self):
     if(self._bufferOverflow):
       return -1
     else:
-      return len(self.data)
+      return self._count
 
+  # Read everything
   def get(self):
-    datacopy = self.data.copy()
-    self.data = []
-    return datacopy
+    self._bufferOverflow = False
+    return self._take(self._count)
+
+  def _take(self, n):
+    end = self._head + n
+    if end <= self._maxsize:
+      value = bytes(self._view[self._head:end])
+    else:
+      value = bytes(self._view[self._head:]) + \
+              bytes(self._view[:end-self._maxsize])
+    self._discard(n)
+    return value
+
+  def _discard(self, n):
+    self._count -= n
+    self._head = (self._head + n) % self._maxsize if self._count else 0
+
+  # Offset of terminator from the oldest byte, -1 if not found
+  def _find(self, terminator):
+    end = self._head + self._count
+    if end <= self._maxsize:
+      i = self._buf.find(terminator, self._head, end)
+      return i - self._head if i >= 0 else -1
+    i = self._buf.find(terminator, self._head)
+    if i >= 0:
+      return i - self._head
+    # The data wraps, look across the end of the buffer then in the start
+    firstLen = self._maxsize - self._head
+    k = len(terminator) - 1
+    if k:
+      edge = bytes(self._view[self._maxsize-k:]) + bytes(self._view[:k])
+      i = edge.find(terminator)
+      if i >= 0:
+        return firstLen - k + i
+    i = self._buf.find(terminator, 0, end - self._maxsize)
+    return firstLen + i if i >= 0 else -1
+
+# ==================== SDI-12 responses ===============================
+
+class SDI12ResponseError(ValueError):
+  pass
+
+class SDI12CRCError(SDI12ResponseError):
+  pass
+
+class SDI12NoResponse(SDI12ResponseError):
+  pass
+
+def _crcTable():
+  table = []
+  for byte in range(256):
+    crc = byte
+    for _ in range(8):
+      crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    table.append(crc)
+  return table
+
+_CRC_TABLE = _crcTable()
+
+# The CRC-16 of a response as the three characters SDI-12 sends it in,
+#  computed over everything from the address up to the CRC
+def sdi12CRC(data):
+  crc = 0
+  for byte in data.encode():
+    crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+  return (chr(0x40 | crc >> 12) + chr(0x40 | (crc >> 6) & 0x3F) +
+          chr(0x40 | crc & 0x3F))
+
+_DATA_VALUE = re.compile(r'[+-](?:[0-9]+\.?[0-9]*|\.[0-9]+)')
+
+# Splits a data response 'a<values>[CRC]<CR><LF>' into its values, each a
+#  string starting with its sign, so any number of values of any width is
+#  handled. Bytes before the address, e.g. a break read as a null, are
+#  skipped. With crc the CRC is checked and removed. An empty list means the
+#  sensor has no (more) data. Raises SDI12CRCError if the CRC does not match
+#  and SDI12ResponseError if the response is incomplete or garbled.
+def parseDataResponse(response, address, crc=False):
+  start = response.find(address)
+  end = response.rfind('\r\n')
+  if start < 0 or end < start:
+    raise SDI12ResponseError("Incomplete response: {!r}".format(response))
+  if crc:
+    if end - start < 4:
+      raise SDI12ResponseError("No CRC in response: {!r}".format(response))
+    end -= 3
+    if sdi12CRC(response[start:end]) != response[end:end+3]:
+      raise SDI12CRCError("Bad CRC in response: {!r}".format(response))
+  body = response[start+1:end]
+  values = _DATA_VALUE.findall(body)
+  if sum(map(len, values)) != len(body):
+    raise SDI12ResponseError("Garbled response: {!r}".format(response))
+  return values
 
 # Class for the SDI-12 object. 
 class SDI12:
-  _BUFFER_SIZE = 64           # max RX buffer size    
+  _BUFFER_SIZE = 96           # max RX buffer size, the longest response,
+                              #  an aDn! or aRn! with 75 characters of
+                              #  values, address, CRC and <CR><LF>, is 81
   SPACING = 830               # bit timing in microseconds
+  RESPONSE_TIMEOUT = 1        # seconds to wait for a reply to a command, the
+                              #  spec allows 15 ms but the command echo is
+                              #  buffered in the UART so allow more
+  INTER_CHAR_TIMEOUT = 0.05   # seconds allowed between characters of a
+                              #  response, the spec allows 1.66 ms plus
+                              #  driver latency
+  ECHO_SLACK = 2              # stray bytes allowed before the command echo
 
   class SDIState(Enum):
     DISABLED = 0              # value for "DISABLED" state
@@ -88,7 +252,7 @@ class SDI12:
     self._rxBuffer = CirBuffer(self._BUFFER_SIZE)  # Buff for incoming
     self._sendMarking = sendMarking
     self.state = self.SDIState.DISABLED
-    if isinstance(uartPort, serial.Serial):
+    if isinstance(uartPort, serial.SerialBase):
       self.uart = uartPort
     else:
       self.uart = serial.Serial(port=None, baudrate=1200,
@@ -138,52 +302,188 @@ class SDI12:
     self.setState(self.SDIState.DISABLED)
 
 # ========== Waking up, and talking to, the sensors. ================== 
+#
+#  The exchanges with the sensors are written once, as generators of the
+#  steps they take. Whenever one has to wait it yields a tuple of the name
+#  of the method waiting and its arguments, and is sent the result. run()
+#  carries the steps out; SDI12 blocks the calling thread, AsyncSDI12
+#  awaits them on an event loop. The methods below are thin wrappers that
+#  run the steps, returning results here and coroutines in AsyncSDI12.
+
+  # Runs the steps of an exchange and returns what they return. An error
+  #  raised while waiting is raised in the steps.
+  def run(self, steps):
+    advance, value = steps.send, None
+    while True:
+      try:
+        wait = advance(value)
+      except StopIteration as done:
+        return done.value
+      try:
+        advance, value = steps.send, getattr(self, wait[0])(*wait[1:])
+      except Exception as err:
+        advance, value = steps.throw, err
 
   # This function wakes up the entire sensor bus
   def wakeSensors(self):
+    return self.run(self._wakeSensors())
+
+  def _wakeSensors(self):
     self.setState(self.SDIState.TRANSMITTING) 
     if self._sendMarking:
       self.uart.baudrate = 600
       self.uart.write(b'\x00')
+      yield ("_drain",)             # Let the marking out before switching
       self.uart.baudrate = 1200
+    self.uart.reset_input_buffer()  # Drop stale input and the echo of the
+                                    #  marking, which is garbage at 1200 baud
 
   # This function sends out the characters of the String cmd, one by one
   def sendCommand(self, cmd):
-    self.wakeSensors()              # Wake up sensors
+    return self.run(self._sendCommand(cmd))
+
+  def _sendCommand(self, cmd):
+    yield from self._wakeSensors()  # Wake up sensors
+    start = metrics.start()
     self.uart.write(cmd.encode())   # This sends the command as byte array, 
                                     #  since RX is connected to TX we will see
-                                    #  command echoed in input buffer
-    self.uart.reset_input_buffer()  # Needed, not exactly sure why
-    self.listen(1, cmd=cmd)         # 16.7ms is the max time for a response to
-                                    #  be received after a command is sent.    
-                                    #  However Command gets buffered in the
-                                    #  UART so this timing doesn't work
-                                    #  perfectly
+                                    #  command echoed in input buffer, it is
+                                    #  stripped by listen
+    complete = yield from self._listen(self.RESPONSE_TIMEOUT, cmd)
+    self._commandDone(cmd, start, complete)
+
+  # Counts a command and the time until its response, by command letter
+  def _commandDone(self, cmd, start, complete):
+    if start is None:
+      return
+    metrics.count("sdi12.bytes_out", len(cmd))
+    if not complete:
+      metrics.count("sdi12.timeouts")
+    metrics.observe_since("sdi12.round_trip." + (cmd[1:2] or "a"), start)
 
   # This command reads the UART RX buffer for response
+  #
+  #  Reads whatever the driver has buffered in one call and stops as soon as
+  #  a <CR><LF> terminated response has arrived. Waits up to 'listenTimeout'
+  #  seconds for the response to start, then up to INTER_CHAR_TIMEOUT
+  #  between characters. If cmd is given its echo is stripped from the
+  #  start of the data in the same pass. Returns True if a complete response
+  #  was received.
   def listen(self, listenTimeout, cmd=''):
+    return self.run(self._listen(listenTimeout, cmd))
+
+  def _listen(self, listenTimeout, cmd=''):
     self.setState(self.SDIState.LISTENING)
-    self.uart.timeout = (listenTimeout)   # Listen for upto 'listenTimeout'
-                                          #  seconds after each char for a 
-                                          #  subsequent char
-    dataRaw = [self.uart.read()]
-    while dataRaw[-1] is not b'':
-      self._rxBuffer.append(dataRaw[-1])
-      dataRaw.append(self.uart.read())
-    else:
-      dataRaw.pop()
-
-    #Here we subtract the cmd from the response, if applicable
-    # TODO: If multiple commands are executed before the buffer is depleted
-    #  then the command will not be subtracted from the response
-    if cmd is not '':
-      rxdata = self._rxBuffer.get()
-      for x in range(0,2):
-        if b''.join(rxdata[x:len(cmd)+x]) == cmd.encode():
-          rxdata = rxdata[len(cmd)+x:]
+    echo = cmd.encode()
+    data = bytearray()
+    start = -1                    # start of the response once echo is gone
+    deadline = time.monotonic() + listenTimeout
+    complete = False
+    while True:
+      remaining = deadline - time.monotonic()
+      waiting = self.uart.in_waiting
+      if waiting:
+        chunk = self.uart.read(waiting)
+      elif remaining > 0:
+        chunk = yield ("_readSome", remaining)
+      else:
+        break
+      if not chunk:
+        break
+      data += chunk
+      if start < 0:
+        start = self._echoEnd(data, echo)
+      if start >= 0 and len(data) > start:
+        # The response has started, sensors must keep characters coming
+        complete = data.find(b'\r\n', start) >= 0
+        if complete:
           break
-      for datum in rxdata:
-        self._rxBuffer.append(datum)
+        deadline = time.monotonic() + self.INTER_CHAR_TIMEOUT
+    if start < 0:
+      start = self._echoEnd(data, echo, final=True)
+    self._rxBuffer.write(data[start:])
+    metrics.count("sdi12.bytes_in", len(data))
+    return complete
+
+  # Offset past the echo of the command at the start of data, allowing for
+  #  a couple of stray bytes before it. Returns -1 while data is too short
+  #  to tell, unless final, and 0 if data does not start with the echo.
+  def _echoEnd(self, data, echo, final=False):
+    if not echo:
+      return 0
+    i = data.find(echo, 0, len(echo) + self.ECHO_SLACK)
+    if i >= 0:
+      return i + len(echo)
+    if not final and len(data) < len(echo) + self.ECHO_SLACK:
+      return -1
+    return 0
+
+  # Sleeps until data arrives and reads it, b'' if none came within timeout
+  #  seconds. Ports with a file descriptor are waited on with select, other
+  #  ports in the driver by setting their timeout.
+  def _readSome(self, timeout):
+    fd = self._fileno()
+    if fd is None:
+      self._setTimeout(timeout)
+      return self.uart.read(1)
+    if not select.select([fd], [], [], timeout)[0]:
+      return b''
+    return self.uart.read(self.uart.in_waiting or 1)
+
+  def _drain(self):
+    self.uart.flush()
+
+  def _sleep(self, seconds):
+    time.sleep(seconds)
+
+  # The file descriptor of the port, None if it has none
+  def _fileno(self):
+    try:
+      return self.uart.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+      return None
+
+  def _setTimeout(self, timeout):
+    # Changing the timeout reconfigures the port, avoid doing it needlessly
+    if self.uart.timeout is None or abs(self.uart.timeout - timeout) > 0.005:
+      self.uart.timeout = timeout
+
+  # Waits for the next <CR><LF> terminated response, returns it as a string
+  #  or None if none came within timeout seconds
+  def readResponse(self, timeout=RESPONSE_TIMEOUT):
+    return self.run(self._readResponse(timeout))
+
+  def _readResponse(self, timeout):
+    line = self.readUntil(b'\r\n')
+    if line == -1:
+      yield from self._listen(timeout)
+      line = self.readUntil(b'\r\n')
+    return line.decode() if line != -1 else None
+
+  # Waits for the service request 'a<CR><LF>' a sensor sends when a
+  #  measurement is ready, sleeping until data arrives. Anything else
+  #  received meanwhile is discarded. Returns the seconds waited, or None if
+  #  no service request came within timeout seconds.
+  def waitForServiceRequest(self, address, timeout):
+    return self.run(self._waitForServiceRequest(address, timeout))
+
+  def _waitForServiceRequest(self, address, timeout):
+    start = time.monotonic()
+    request = (str(address) + '\r\n').encode()
+    while True:
+      remaining = start + timeout - time.monotonic()
+      if remaining <= 0:
+        metrics.count("sdi12.service_request_timeouts")
+        return None
+      yield from self._listen(remaining)
+      line = self.readUntil(b'\r\n')
+      while line != -1:
+        # Allow for stray bytes, e.g. a break read as a null, before it
+        if line.endswith(request):
+          waited = time.monotonic() - start
+          metrics.observe("sdi12.service_request", waited)
+          return waited
+        line = self.readUntil(b'\r\n')
 
 # ============ Reading from the SDI-12 object buffer.  ================
 
@@ -200,9 +500,18 @@ class SDI12:
   def flush(self):
     self._rxBuffer.flush()
 
-  # Reads in the next character from the buffer (and moves the index ahead)
-  def read(self):
-    return self._rxBuffer.read()
+  # Reads in the next character from the buffer (and moves the index ahead),
+  #  or up to n characters as bytes if n is given
+  def read(self, n=None):
+    return self._rxBuffer.read(n)
+
+  # Reads up to and including the next terminator, -1 if there is none
+  def readUntil(self, terminator=b'\r\n'):
+    return self._rxBuffer.read_until(terminator)
+
+  # Reads everything in the buffer as a string
+  def readString(self):
+    return self._rxBuffer.get().decode()
 
 # ============= Using more than one SDI-12 object.  ===================
 
@@ -219,15 +528,97 @@ class SDI12:
     return self._activeObject
 
 
+# SDI-12 object driven by an asyncio event loop. It runs the same steps as
+#  SDI12, but instead of sleeping in the serial driver, waiting for data
+#  registers the port's file descriptor with the loop's reader, so one
+#  thread can drive any number of buses. Ports without a file descriptor,
+#  like loop://, are polled every POLL_INTERVAL seconds. Talking to the
+#  sensors and listening are coroutines, reading the buffer is the same as
+#  in SDI12.
+class AsyncSDI12(SDI12):
+  POLL_INTERVAL = 0.005
+
+  # As SDI12.run, awaiting the waits
+  async def run(self, steps):
+    advance, value = steps.send, None
+    while True:
+      try:
+        wait = advance(value)
+      except StopIteration as done:
+        return done.value
+      try:
+        advance, value = steps.send, await getattr(self, wait[0])(*wait[1:])
+      except Exception as err:
+        advance, value = steps.throw, err
+
+  async def _readSome(self, timeout):
+    if not await self._readable(timeout):
+      return b''
+    return self.uart.read(self.uart.in_waiting or 1)
+
+  # The marking is let out in an executor
+  async def _drain(self):
+    await asyncio.get_running_loop().run_in_executor(None, self.uart.flush)
+
+  async def _sleep(self, seconds):
+    await asyncio.sleep(seconds)
+
+  # Waits until the port has data, returns False on timeout
+  async def _readable(self, timeout):
+    fd = self._fileno()
+    loop = asyncio.get_running_loop()
+    if fd is None:
+      deadline = loop.time() + timeout
+      while not self.uart.in_waiting:
+        remaining = deadline - loop.time()
+        if remaining <= 0:
+          return False
+        await asyncio.sleep(min(remaining, self.POLL_INTERVAL))
+      return True
+    ready = loop.create_future()
+    loop.add_reader(fd, lambda: ready.done() or ready.set_result(True))
+    try:
+      return await asyncio.wait_for(ready, timeout)
+    except asyncio.TimeoutError:
+      return False
+    finally:
+      loop.remove_reader(fd)
+
 # /* ========== AquaCheck Soil Moisture Probe =========
 #  * Mike Killian, 2017
-#  *
-#  *  TODO: More robust retries, move error logging to n.io.
 #  */
 
 
+# How probes are read: M/D measurements, continuous measurements (aR!) or
+#  continuous where the probe supports it
+class ReadMode(Enum):
+  MEASUREMENT = 'measurement'
+  CONTINUOUS = 'continuous'
+  AUTO = 'auto'
+
+# How SDI12AquaCheck retries the commands of a poll. Each command is tried
+#  up to 'attempts' times when its response is garbled or fails its CRC,
+#  but only 'silentAttempts' times when the probe does not answer at all,
+#  as a dead probe would cost a full response timeout every time. Attempts
+#  are spaced by an exponential backoff starting at 'backoff' seconds, up
+#  to 'backoffMax'. With a 'deadline' no attempt is started once a poll
+#  has run that many seconds. After 'breakerFailures' failed polls in a row
+#  a probe is skipped until 'breakerCooldown' seconds have passed, then
+#  polled once more to find out whether it has recovered.
+class RetryPolicy:
+  def __init__(self, attempts=2, silentAttempts=2, backoff=0, backoffMax=1,
+               deadline=None, breakerFailures=0, breakerCooldown=60):
+    self.attempts = attempts
+    self.silentAttempts = silentAttempts
+    self.backoff = backoff
+    self.backoffMax = backoffMax
+    self.deadline = deadline
+    self.breakerFailures = breakerFailures    # 0 never skips probes
+    self.breakerCooldown = breakerCooldown
+
 class SDI12AquaCheck:
   RETRIES = 2   # Number of retries before giving up on data from the probe
+  transport = SDI12   # Class driving the bus
 # /*
 #  *  Constructor:
 #  * 
@@ -236,19 +627,39 @@ class SDI12AquaCheck:
 #  *    rs485       - using hardware rs485?
 #  */ 
   def __init__(self, dataBus, sendMarking=True, rs485=False):
-    self.dataBus = serial.Serial(port=None, baudrate=1200,
-                                 bytesize=serial.SEVENBITS, 
-                                 parity=serial.PARITY_EVEN, 
-                                 stopbits=serial.STOPBITS_ONE, 
-                                 timeout=3.5)
-    self.dataBus.port    = dataBus
+    if isinstance(dataBus, serial.SerialBase):
+      self.dataBus = dataBus
+    else:
+      self.dataBus = serial.Serial(port=None, baudrate=1200,
+                                   bytesize=serial.SEVENBITS, 
+                                   parity=serial.PARITY_EVEN, 
+                                   stopbits=serial.STOPBITS_ONE, 
+                                   timeout=3.5)
+      self.dataBus.port  = dataBus
     if rs485:
       self.dataBus.rs485_mode = serial.rs485.RS485Settings()
     self.moistureRaw     = ""     # Raw response of probe with all sensors
     self.moistureData    = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
     self.temperatureRaw  = ""
     self.temperatureData = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-    self.aquaCheckSDI12  = SDI12(self.dataBus, sendMarking=sendMarking)
+    # Seconds the last measurement was advertised to take and actually took
+    #  until the service request, None if none came
+    self.measurementTiming = {"advertised": None, "actual": None}
+    self.busData         = {}     # Values of each address from pollBus
+    self.setTiming       = {}     # Seconds each reading type took in the
+                                  #  last acquire, per address
+    self.crc             = False  # Whether the last poll asked for CRCs
+    self.identification  = {}     # aI! response of each address
+    self.continuous      = {}     # Whether each address supports aR!
+    self.retryPolicy     = RetryPolicy(attempts=self.RETRIES,
+                                       silentAttempts=self.RETRIES)
+    self.breakers        = {}     # [failed polls in a row, time skipping
+                                  #  started or None] of each address
+    self._deadline       = None   # time.monotonic() the poll must end by
+    self._polling        = False  # Whether a poll has started, the calls
+                                  #  it makes do not start their own
+    self.aquaCheckSDI12  = self.transport(self.dataBus,
+                                          sendMarking=sendMarking)
     self.aquaCheckSDI12.begin()
 
 # /* 
@@ -256,6 +667,8 @@ class SDI12AquaCheck:
 #  *
 #  *    readingType - 0 for moisture readings, 1 for temperature readings
 #  *    address     - address of sensor to read from, default is '0'
+#  *    crc         - ask for data with a CRC (aMC!), re-requesting only the
+#  *                  data sets that fail the check
 #  *
 #  *  The AquaCheck Moisture Probe is polled for either Moisture or 
 #  *  Temperature readings depending on readingType. The address allows for
@@ -274,10 +687,14 @@ class SDI12AquaCheck:
 #  *    5 - Sensor set 1 failed in some way
 #  *    
 #  */
-  def pollProbe(self, readingType, address = '0'):
+  def pollProbe(self, readingType, address = '0', crc=False):
+    return self._run(self._pollProbe(readingType, address, crc))
+
+  def _pollProbe(self, readingType, address, crc):
     sdiCommand = ""
     self.sdiResponse   = ""
-    self.dataResponse  = ["","","","","",""]
+    self.crc           = crc
+    self.measurementTiming = {"advertised": None, "actual": None}
     self.sdiAddress      = -1  # Address of the sensor responding
     self.sdiTimeToCheck  = -1  # Time to wait before requesting data
     self.sdiMeasurements = -1  # Number of measurements expected
@@ -287,44 +704,53 @@ class SDI12AquaCheck:
     if(readingType == 0):
       self.moistureRaw = ""
       self.moistureData = [0.0]*6
-      sdiCommand = str(address) + "M0!"
+      sdiCommand = str(address) + ("MC0!" if crc else "M0!")
     elif(readingType == 1):
       self.temperatureRaw = ""
       self.temperatureData = [0.0]*6
-      sdiCommand = str(address) + "M1!"
+      sdiCommand = str(address) + ("MC1!" if crc else "M1!")
     else:
       return -1
 
     try:
-      self._issueCommand(sdiCommand)
+      yield from self._retry(self._issueCommand, sdiCommand)
     except tenacity.RetryError:
-      debugThis("Error issuing command")
-      debugThis(self._issueCommand.retry.statistics)
+      _logger.debug("Error issuing command")
       return -1
 
     try:
-      self._gatherData(readingType)
+      yield from self._gatherData(readingType)
     except tenacity.RetryError:
-      debugThis("Error gathering data")
-      debugThis(self._gatherFirstData.retry.statistics)
-      debugThis(self._gatherSecondData.retry.statistics)
-      debugThis(self._issueFirstData.retry.statistics)
-      debugThis(self._issueSecondData.retry.statistics)
+      _logger.debug("Error gathering data")
       return -1
 
     self.aquaCheckSDI12.flush()
 
     return 0
 
-  @tenacity.retry(stop=tenacity.stop_after_attempt(RETRIES))
   def _issueCommand(self, sdiCommand):
     self.sdiResponse = "" 
-    self.aquaCheckSDI12.sendCommand(sdiCommand)
+    yield from self.aquaCheckSDI12._sendCommand(sdiCommand)
 
-    while(self.aquaCheckSDI12.available()):
-      self.sdiResponse += self.aquaCheckSDI12.read().decode()
+    self.sdiResponse += self.aquaCheckSDI12.readString()
+    self._parseCommandResponse()
 
-    # break response into corrisponding components
+    # Wait for interrupt to notify us data is ready, sleeping until data
+    #  arrives. With no service request data is asked for once the
+    #  advertised time has passed.
+    actual = 0
+    if self.sdiTimeToCheck > 0:
+      actual = yield from self.aquaCheckSDI12._waitForServiceRequest(
+        self.sdiAddress, self._budget(self.sdiTimeToCheck))
+    self.measurementTiming = {"advertised": self.sdiTimeToCheck,
+                              "actual": actual}
+    _logger.debug("Measurement took %ss of %ss advertised", actual,
+                  self.sdiTimeToCheck)
+
+  # Breaks the response to aM! into its components
+  def _parseCommandResponse(self):
+    if not self.sdiResponse:
+      raise SDI12NoResponse("No response to measurement command")
     try:
       if (len(self.sdiResponse) >= 7 and 
               self.sdiResponse[-2] == '\r' and 
@@ -333,147 +759,797 @@ class SDI12AquaCheck:
         self.sdiTimeToCheck = int(self.sdiResponse[-6:-3])
         self.sdiAddress = self.sdiResponse[-7]
       else:
-        debugThis("_issueCommand did not get a good response: "
-                  "{}".format(self.sdiResponse))
+        _logger.debug("_issueCommand did not get a good response: %r",
+                      self.sdiResponse)
         raise tenacity.TryAgain  
     except Exception as err:
-      debugThis("_issueCommand failed somehow: {}".format(err))
+      _logger.debug("_issueCommand failed somehow: %s", err)
       raise tenacity.TryAgain  
 
-    # Wait for interrupt to notify us data is ready
-    timestamp = time.perf_counter()
-    while(time.perf_counter() - timestamp <= self.sdiTimeToCheck):
-      self.sdiResponse = ""
-      self.aquaCheckSDI12.listen(0.1)
-      while(self.aquaCheckSDI12.available()):
-        self.sdiResponse += self.aquaCheckSDI12.read().decode()
+  # Collects all the values of the measurement, however many data sets they
+  #  are spread over
+  def _gatherData(self, readingType):
+    values = yield from self._collectData(self.sdiAddress,
+                                          self.sdiMeasurements, self.crc)
+    self._storeData(readingType, self.sdiAddress, values)
+    self.aquaCheckSDI12.flush()
+
+  def _storeData(self, readingType, address, values):
+    raw = address + "".join(values)
+    data = [float(value) for value in values]
+    if(readingType == 0):  # 0 for Moisture, 1 for Temperature
+      self.moistureRaw = raw
+      self.moistureData = data
+    elif(readingType == 1):
+      self.temperatureRaw = raw
+      self.temperatureData = data
+
+# /*
+#  *  readProbe(readingType, address, mode, crc) - samples the AquaCheck
+#  *    sensor the quickest way it supports
+#  *
+#  *    mode        - ReadMode.MEASUREMENT always measures with pollProbe,
+#  *                  ReadMode.CONTINUOUS reads continuous measurements
+#  *                  (aR0!/aR1!, aRC0!/aRC1! with crc) and ReadMode.AUTO
+#  *                  reads continuous measurements if the probe supports
+#  *                  them, falling back to pollProbe
+#  *
+#  *  Continuous measurements come back in the response to the command, with
+#  *  no measurement wait, service request or data commands. Data is stored
+#  *  and errors returned as in pollProbe.
+#  */
+  def readProbe(self, readingType, address='0', mode=ReadMode.MEASUREMENT,
+                crc=False):
+    return self._run(self._readProbe(readingType, str(address), mode, crc))
+
+  def _readProbe(self, readingType, address, mode, crc):
+    if readingType not in (0, 1):
+      return -1
+    if (yield from self._useContinuous(address, mode)):
+      try:
+        values = yield from self._retry(self._readContinuous, address,
+                                        readingType, crc)
+      except tenacity.RetryError:
+        _logger.debug("Error reading continuous measurement")
+        values = []
+      if values:
+        self._storeData(readingType, address, values)
+        self.measurementTiming = {"advertised": 0, "actual": 0}
+        return 0
+      if mode == ReadMode.CONTINUOUS:
+        return -1
+    return (yield from self._pollProbe(readingType, address, crc))
+
+  # Returns the identification of the probe at address (aI!) without the
+  #  address, or None if it does not answer
+  def identify(self, address='0'):
+    return self._run(self._identify(str(address)))
+
+  def _identify(self, address):
+    self.aquaCheckSDI12.flush()
+    yield from self.aquaCheckSDI12._sendCommand(address + "I!")
+    response = self.aquaCheckSDI12.readString()
+    start = response.find(address)
+    if start < 0 or not response.endswith('\r\n'):
+      return None
+    self.identification[address] = response[start+1:-2]
+    return self.identification[address]
+
+  # Whether the probe at address answers continuous measurements, found out
+  #  once per address by asking for one
+  def supportsContinuous(self, address='0'):
+    return self._run(self._supportsContinuous(str(address)))
+
+  def _supportsContinuous(self, address):
+    if (yield from self._useContinuous(address, ReadMode.AUTO)) and \
+        address not in self.continuous:
       try:
-        if (self.sdiResponse[0] == self.sdiAddress and 
-            self.sdiResponse[1] == '\r' and 
-            self.sdiResponse[2] == '\n'):
-          break  # Upon receipt of a service request drop out of for loop
-      except IndexError:
+        yield from self._retry(self._readContinuous, address, 0)
+      except tenacity.RetryError:
         pass
+    return self.continuous.get(address, False)
 
-  def _gatherData(self, readingType):
-    try:
-      self._issueFirstData()
-    except:
-      debugThis("_gatherData failed, returned: {}".format(self.sdiResponse))
+  # Continuous measurements came with SDI-12 1.3, older probes are not asked
+  #  for them in AUTO mode
+  def _useContinuous(self, address, mode):
+    if mode != ReadMode.AUTO:
+      return mode == ReadMode.CONTINUOUS
+    if address not in self.continuous:
+      identification = yield from self._identify(address)
+      if not identification or not identification[:2].isdigit() or \
+          int(identification[:2]) < 13:
+        self.continuous[address] = False
+    return self.continuous.get(address, True)
+
+  # Returns the values, or an empty list if the probe answered just its
+  #  address, which is how probes without continuous measurements answer.
+  #  The answer is remembered in continuous.
+  def _readContinuous(self, address, readingType, crc=False):
+    self.aquaCheckSDI12.flush()
+    yield from self.aquaCheckSDI12._sendCommand("{}{}{}!".format(
+      address, "RC" if crc else "R", readingType))
+    self.sdiResponse = self.aquaCheckSDI12.readString()
+    if not self.sdiResponse:
+      raise SDI12NoResponse("No response to continuous measurement")
     try:
-      self._issueSecondData()
-    except:
-      debugThis("_gatherData failed, returned: {}".format(self.sdiResponse))
+      values = parseDataResponse(self.sdiResponse, address, crc)
+    except SDI12ResponseError as err:
+      _logger.debug("_readContinuous failed: %s", err)
+      raise tenacity.TryAgain
+    self.continuous[address] = bool(values)
+    return values
+
+
+# /*
+#  *  pollBus(readingType, addresses) - samples every probe on the bus
+#  *
+#  *    readingType - 0 for moisture readings, 1 for temperature readings
+#  *    addresses   - addresses of the sensors to read from
+#  *    crc         - ask for data with a CRC (aCC!)
+#  *    mode        - ReadMode as in readProbe
+#  *
+#  *  Starts a concurrent measurement (aC0! or aC1!) on every address, one
+#  *  after the other, noting when each one will be ready. Sensors measure
+#  *  in parallel and only abort when addressed again, so their data is then
+#  *  gathered with aD0!, aD1!... in order of readiness. A sweep takes about
+#  *  as long as the slowest probe instead of the sum of all of them.
+#  *  Probes read with continuous measurements are read first.
+#  *  Returns a dict of the values of each address, None for the addresses
+#  *  that failed, which is also kept in busData. Returns -1 for an unknown
+#  *  readingType. Commands are retried following retryPolicy, whose
+#  *  deadline applies to the whole sweep, and probes whose circuit breaker
+#  *  is open are skipped.
+#  */
+  _concurrentResponse = re.compile(r'(.)(\d{3})(\d{1,2})\r\n$')
+
+  def pollBus(self, readingType, addresses, crc=False,
+              mode=ReadMode.MEASUREMENT):
+    return self._run(self._pollBus(readingType, addresses, crc, mode))
 
+  def _pollBus(self, readingType, addresses, crc, mode):
+    if readingType not in (0, 1):
+      return -1
+    sets = yield from self._pollSets([readingType], addresses, crc, mode)
+    self.busData = {address: values[readingType]
+                    for address, values in sets.items()}
+    return self.busData
+
+# /*
+#  *  acquire(readingTypes, addresses) - samples several reading types of
+#  *    every probe in one pass
+#  *
+#  *    readingTypes - reading types to collect, e.g. [0, 1] for moisture
+#  *                   and temperature
+#  *    addresses    - addresses of the sensors to read from
+#  *    crc, mode    - as in pollBus
+#  *    retryPolicy  - RetryPolicy to use from now on, if given
+#  *
+#  *  A probe aborts its measurement when it is addressed again, so a single
+#  *  probe is read one reading type after the other with readProbe. With
+#  *  several probes each one starts its next reading type as soon as the
+#  *  data of the previous one is collected, while the others are still
+#  *  measuring. Returns a dict of the values of each reading type of each
+#  *  address, None where they failed, and keeps the advertised and the
+#  *  actual seconds each one took in setTiming in the same layout. Returns
+#  *  -1 for an unknown reading type. Retries and skipped probes are as in
+#  *  pollBus.
+#  */
+  def acquire(self, readingTypes, addresses, crc=False,
+              mode=ReadMode.MEASUREMENT, retryPolicy=None):
+    return self.aquaCheckSDI12.run(self._acquire(readingTypes, addresses, crc,
+                                                 mode, retryPolicy))
+
+  def _acquire(self, readingTypes, addresses, crc, mode, retryPolicy):
+    if any(readingType not in (0, 1) for readingType in readingTypes):
+      return -1
+    if retryPolicy is not None:
+      self.retryPolicy = retryPolicy
+    addresses = [str(address) for address in addresses]
+    start = metrics.start()
     try:
-      if(readingType == 0):  # 0 for Moisture, 1 for Temperature
-        self.moistureRaw = self.sdiAddress
-        for i in range(0,6):
-          self.moistureData[i] = float(self.dataResponse[i])
-          self.moistureRaw += "+{}".format(self.dataResponse[i])
-      elif(readingType == 1):
-        self.temperatureRaw = self.sdiAddress
-        for i in range(0,6):
-          self.temperatureData[i] = float(self.dataResponse[i])
-          self.temperatureRaw += "+{}".format(self.dataResponse[i])
-      else:
-        return -1
-    except Exception as err:
-      debugThis("Error assigning values, {}".format(err))
-      self.moistureData = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-      self.moistureRaw  = ''
-      self.temperatureData = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-      self.temperatureRaw  = ''
+      if len(addresses) != 1:
+        return (yield from self._poll(
+          self._pollSets(readingTypes, addresses, crc, mode)))
+      return (yield from self._poll(
+        self._acquireProbe(readingTypes, addresses[0], crc, mode)))
+    finally:
+      metrics.observe_since("sdi12.poll", start)
 
+  def _acquireProbe(self, readingTypes, address, crc, mode):
+    results = {address: dict.fromkeys(readingTypes)}
+    self.setTiming = {address: {}}
+    if not self._breakerAllows(address):
+      _logger.debug("Skipping probe %s", address)
+      metrics.count("sdi12.breaker_skips")
+      return results
+    for readingType in readingTypes:
+      start = time.monotonic()
+      values = None
+      if (yield from self._readProbe(readingType, address, mode, crc)) == 0:
+        values = self.moistureData if readingType == 0 \
+          else self.temperatureData
+      results[address][readingType] = values
+      self.setTiming[address][readingType] = {
+        "advertised": self.measurementTiming["advertised"],
+        "actual": time.monotonic() - start}
+    self._breakerRecord(address, results[address])
+    return results
+
+  def _pollSets(self, readingTypes, addresses, crc, mode):
+    results = {}
+    self.setTiming = {}
+    ready = []      # heap of (time data is ready, address, value count,
+                    #  index of the reading type, time it was started)
+    self.aquaCheckSDI12.flush()
+    for address in addresses:
+      address = str(address)
+      results[address] = dict.fromkeys(readingTypes)
+      self.setTiming[address] = {}
+      if self._breakerAllows(address):
+        yield from self._startSet(address, readingTypes, 0, crc, mode,
+                                  results, ready)
+      else:
+        _logger.debug("Skipping probe %s", address)
+        metrics.count("sdi12.breaker_skips")
+    while ready:
+      readyAt, address, count, index, start = heapq.heappop(ready)
+      if self._deadline is not None and readyAt > self._deadline:
+        _logger.debug("Data from %s not ready before the deadline", address)
+        continue
+      delay = readyAt - time.monotonic()
+      if delay > 0:
+        yield ("_sleep", delay)
+      readingType = readingTypes[index]
+      try:
+        values = yield from self._collectData(address, count, crc)
+        results[address][readingType] = [float(value) for value in values]
+      except tenacity.RetryError:
+        _logger.debug("No data from %s", address)
+      self.setTiming[address][readingType]["actual"] = \
+        time.monotonic() - start
+      yield from self._startSet(address, readingTypes, index + 1, crc, mode,
+                                results, ready)
     self.aquaCheckSDI12.flush()
+    for address in addresses:
+      if self.setTiming[str(address)]:
+        self._breakerRecord(str(address), results[str(address)])
+    return results
+
+  # Starts the measurement of the reading type at index, or of the next one
+  #  that needs measuring. Continuous measurements are stored right away.
+  def _startSet(self, address, readingTypes, index, crc, mode, results,
+                ready):
+    continuous = yield from self._useContinuous(address, mode)
+    for index in range(index, len(readingTypes)):
+      readingType = readingTypes[index]
+      start = time.monotonic()
+      timing = self.setTiming[address][readingType] = {
+        "advertised": 0, "actual": None}
+      if continuous:
+        try:
+          values = yield from self._retry(self._readContinuous, address,
+                                          readingType, crc)
+        except tenacity.RetryError:
+          _logger.debug("No continuous measurement from %s", address)
+          values = []
+        if values:
+          results[address][readingType] = [float(value) for value in values]
+          timing["actual"] = time.monotonic() - start
+        if values or mode == ReadMode.CONTINUOUS:
+          continue
+      try:
+        wait, count = yield from self._retry(self._startConcurrent, address,
+                                             readingType, crc)
+      except tenacity.RetryError:
+        _logger.debug("No concurrent measurement from %s", address)
+        continue
+      timing["advertised"] = wait
+      heapq.heappush(ready, (start + wait, address, count, index, start))
+      return
 
-  @tenacity.retry(stop=tenacity.stop_after_attempt(RETRIES))
-  def _issueFirstData(self):
+  # Returns the seconds until the data is ready and the number of values
+  def _startConcurrent(self, address, readingType, crc=False):
     self.aquaCheckSDI12.flush()
-    self.aquaCheckSDI12.sendCommand("0D0!")  # ask for data from set 0
-    self.sdiResponse = ""
+    yield from self.aquaCheckSDI12._sendCommand("{}{}{}!".format(
+      address, "CC" if crc else "C", readingType))
+    response = self.aquaCheckSDI12.readString()
+    if not response:
+      raise SDI12NoResponse("No response to concurrent measurement")
+    # atttnn<CR><LF>: seconds until the data is ready and number of values
+    match = self._concurrentResponse.search(response)
+    if match is None or match.group(1) != address:
+      _logger.debug("_startConcurrent bad response: %r", response)
+      raise tenacity.TryAgain
+    return int(match.group(2)), int(match.group(3))
 
-    while(self.aquaCheckSDI12.available()):  # build a string of the response
-      self.sdiResponse += self.aquaCheckSDI12.read().decode()
+  # Asks for data sets until count values have been received, returns the
+  #  values as sent
+  def _collectData(self, address, count, crc=False):
+    values = []
+    for dataSet in range(10):
+      if len(values) >= count:
+        break
+      values += yield from self._retry(self._issueData, address, dataSet, crc)
+    if len(values) < count:
+      _logger.debug("_collectData got %s of %s values from %s", len(values),
+                    count, address)
+    return values
 
+  # Asks for one data set. It is retried on its own if it is garbled or
+  #  fails its CRC, the measurement is not started over.
+  def _issueData(self, address, dataSet, crc=False):
+    self.aquaCheckSDI12.flush()
+    yield from self.aquaCheckSDI12._sendCommand(
+      "{}D{}!".format(address, dataSet))
+    self.sdiResponse = self.aquaCheckSDI12.readString()
+    if not self.sdiResponse:
+      raise SDI12NoResponse("No response to data command")
     try:
-      if (len(self.sdiResponse) > 3):
-        self.dataResponse[0] = self.sdiResponse[2:10]
-        self.dataResponse[1] = self.sdiResponse[11:19]
-        self.dataResponse[2] = self.sdiResponse[20:28]
-        if ((self.sdiResponse[-2] != '\r' and self.sdiResponse[-1] != '\n') or
-             self.dataResponse[0][0] == '\0' or 
-             self.dataResponse[1][0] == '\0' or 
-             self.dataResponse[2][0] == '\0'):
-          debugThis("_issueFirstData bad response: {}".format(self.sdiResponse))
-          raise tenacity.TryAgain
-      elif (self.sdiResponse[0] == self.sdiAddress and 
-            self.sdiResponse[1] == '\r' and 
-            self.sdiResponse[2] == '\n'):
-        debugThis("_issueFirstData null response")
-        raise tenacity.TryAgain                   
-      else:
-        debugThis("_isseFirstData no response")
-        raise tenacity.TryAgain  
-    except Exception as err:
-      debugThis("_issueFirstData failed somehow: {}".format(err))
+      values = parseDataResponse(self.sdiResponse, address, crc)
+    except SDI12ResponseError as err:
+      _logger.debug("_issueData failed: %s", err)
       raise tenacity.TryAgain
+    if not values:
+      _logger.debug("_issueData null response")
+      raise tenacity.TryAgain
+    return values
 
-  @tenacity.retry(stop=tenacity.stop_after_attempt(RETRIES))
-  def _issueSecondData(self):
-    self.aquaCheckSDI12.flush()
-    self.aquaCheckSDI12.sendCommand("0D1!")  # ask for data from set 1 
-    self.sdiResponse = ""
+  # Runs the steps fn(*args) until they succeed or retryPolicy gives up,
+  #  which raises tenacity.RetryError. Attempts are spaced by the backoff,
+  #  which is slept through the transport. Nothing is sent once the
+  #  deadline has passed.
+  def _retry(self, fn, *args):
+    self._checkDeadline()
+    attempt = 1
+    while True:
+      try:
+        return (yield from fn(*args))
+      except Exception as err:
+        if self._stop(attempt, err):
+          raise tenacity.RetryError(None) from err
+      delay = self._backoff(attempt)
+      if delay > 0:
+        yield ("_sleep", delay)
+      attempt += 1
+
+  # Seconds to wait after the given attempt, doubling from backoff up to
+  #  backoffMax
+  def _backoff(self, attempt):
+    policy = self.retryPolicy
+    if not policy.backoff:
+      return 0
+    return min(policy.backoff * 2 ** (attempt - 1), policy.backoffMax)
+
+  # A probe that does not answer at all gets silentAttempts, one that
+  #  answers badly gets attempts. No attempt is made past the deadline.
+  def _stop(self, attempt, err):
+    policy = self.retryPolicy
+    attempts = policy.attempts
+    if isinstance(err, SDI12NoResponse):
+      attempts = policy.silentAttempts
+    if attempt >= attempts or self._deadline is not None and \
+        time.monotonic() + self._backoff(attempt) >= self._deadline:
+      metrics.count("sdi12.failures")
+      return True
+    metrics.count("sdi12.retries")
+    return False
+
+  def _checkDeadline(self):
+    if self._deadline is not None and time.monotonic() >= self._deadline:
+      _logger.debug("Poll deadline passed")
+      raise tenacity.RetryError(None)
 
-    while(self.aquaCheckSDI12.available()):  # build a string of the response
-      self.sdiResponse += self.aquaCheckSDI12.read().decode()
+  # Runs steps on the transport of the bus as a poll, see _poll
+  def _run(self, steps):
+    return self.aquaCheckSDI12.run(self._poll(steps))
 
+  # Runs steps under the deadline of a poll of their own, unless they are
+  #  part of a poll already running
+  def _poll(self, steps):
+    started = self._startPoll()
     try:
-      if (len(self.sdiResponse) > 3):
-        self.dataResponse[3] = self.sdiResponse[2:10]
-        self.dataResponse[4] = self.sdiResponse[11:19]
-        self.dataResponse[5] = self.sdiResponse[20:28]
-        if ((self.sdiResponse[-2] != '\r' and self.sdiResponse[-1] != '\n') or
-             self.dataResponse[3][0] == '\0' or 
-             self.dataResponse[4][0] == '\0' or 
-             self.dataResponse[5][0] == '\0'):
-          raise tenacity.TryAgain
-      elif (self.sdiResponse[0] == self.sdiAddress and 
-            self.sdiResponse[1] == '\r' and 
-            self.sdiResponse[2] == '\n'):
-        raise tenacity.TryAgain                     
+      return (yield from steps)
+    finally:
+      self._endPoll(started)
+
+  # Starts the deadline of a poll, unless one is already running. Returns
+  #  whether it started one, which the caller ends with _endPoll.
+  def _startPoll(self):
+    if self._polling:
+      return False
+    self._polling = True
+    self._deadline = None
+    if self.retryPolicy.deadline:
+      self._deadline = time.monotonic() + self.retryPolicy.deadline
+    return True
+
+  def _endPoll(self, started):
+    if started:
+      self._polling = False
+      self._deadline = None
+
+  # Returns timeout, cut down to the time left before the deadline
+  def _budget(self, timeout):
+    if self._deadline is None:
+      return timeout
+    return max(0, min(timeout, self._deadline - time.monotonic()))
+
+  # /*
+  #  *  The circuit breaker of each address. Once breakerFailures polls in a
+  #  *  row got no data at all the probe is skipped; after breakerCooldown
+  #  *  seconds a single poll is let through, closing the breaker if it gets
+  #  *  data and skipping the probe for another cooldown if it does not.
+  #  */
+  def _breakerAllows(self, address):
+    breaker = self.breakers.get(address)
+    if not self.retryPolicy.breakerFailures or breaker is None or \
+        breaker[1] is None:
+      return True
+    if time.monotonic() - breaker[1] < self.retryPolicy.breakerCooldown:
+      return False
+    breaker[1] = None   # half open, this poll decides
+    breaker[0] = self.retryPolicy.breakerFailures - 1
+    return True
+
+  def _breakerRecord(self, address, values):
+    if any(values.values()):
+      self.breakers.pop(address, None)
+      return
+    breaker = self.breakers.setdefault(address, [0, None])
+    breaker[0] += 1
+    if self.retryPolicy.breakerFailures and \
+        breaker[0] >= self.retryPolicy.breakerFailures:
+      _logger.debug("Probe %s failed %s polls, skipping it", address,
+                    breaker[0])
+      breaker[1] = time.monotonic()
+
+# /*
+#  *  AsyncSDI12AquaCheck - SDI12AquaCheck on an asyncio event loop
+#  *
+#  *  Runs the same steps as SDI12AquaCheck through an AsyncSDI12, so
+#  *  pollProbe, readProbe, identify, supportsContinuous, pollBus and
+#  *  acquire are coroutines with the same arguments, results and stored
+#  *  data. Polls of probes on different buses can run concurrently on one
+#  *  loop:
+#  *
+#  *    await asyncio.gather(*(probe.pollProbe(0) for probe in probes))
+#  */
+class AsyncSDI12AquaCheck(SDI12AquaCheck):
+  transport = AsyncSDI12
+
+
+# /* ========== Sharing an SDI-12 bus =========
+#  *
+#  *  An SDI12Bus owns the SDI12AquaCheck, and so the UART, of a port for the
+#  *  whole process. Blocks never talk to the probes directly, they hand the
+#  *  bus transactions: functions called with the SDI12AquaCheck on the
+#  *  bus's own thread, one at a time. Queued transactions run lowest
+#  *  priority value first, then earliest deadline, then in order of
+#  *  arrival. One still queued when its deadline passes is dropped and its
+#  *  future raises SDI12DeadlineExpired. Blocks get the bus of a port with
+#  *  shared(), the settings of the first one to ask are used, and hold it
+#  *  until release(); the port is closed when no block holds it.
+#  */
+
+class SDI12DeadlineExpired(TimeoutError):
+  pass
+
+class SDI12Bus:
+  _buses = {}                 # shared bus of each port
+  _busesLock = Lock()
+
+  def __init__(self, port, sendMarking=True, rs485=False):
+    self.port = port
+    self.probe = SDI12AquaCheck(port, sendMarking=sendMarking, rs485=rs485)
+    self._queue = []          # heap of (priority, deadline, arrival order,
+                              #  time queued, transaction, future)
+    self._queueChanged = Condition()
+    self._arrivals = 0
+    self._refs = 0
+    self._closed = False
+    self.completed = 0        # transactions run without error
+    self.failed = 0           # transactions that raised
+    self.expired = 0          # transactions dropped at their deadline
+    self._waitTotal = 0.0     # seconds spent queued by those taken off
+    self._waitMax = 0.0
+    self._thread = Thread(target=self._run, daemon=True,
+                          name="SDI12Bus-{}".format(port))
+    self._thread.start()
+
+  # Returns the bus of a port with a reference taken
+  @classmethod
+  def shared(cls, port, sendMarking=True, rs485=False):
+    with cls._busesLock:
+      bus = cls._buses.get(port)
+      if bus is None:
+        bus = cls._buses[port] = cls(port, sendMarking, rs485)
+      bus._refs += 1
+      return bus
+
+  # Drops a reference, closing the bus once none are left
+  def release(self):
+    with self._busesLock:
+      self._refs -= 1
+      if self._refs > 0:
+        return
+      if self._buses.get(self.port) is self:
+        del self._buses[self.port]
+    self.close()
+
+  def close(self):
+    with self._queueChanged:
+      self._closed = True
+      self._queueChanged.notify()
+    self._thread.join()
+    self.probe.aquaCheckSDI12.end()
+
+  # Queues transaction(probe), returns a Future of its result. deadline is
+  #  the most seconds it may wait for the bus, None for no limit.
+  def submit(self, transaction, priority=0, deadline=None):
+    future = Future()
+    queued = time.monotonic()
+    expires = queued + deadline if deadline is not None else float('inf')
+    with self._queueChanged:
+      if self._closed:
+        raise RuntimeError("SDI-12 bus {} is closed".format(self.port))
+      heapq.heappush(self._queue, (priority, expires, self._arrivals,
+                                   queued, transaction, future))
+      self._arrivals += 1
+      self._queueChanged.notify()
+    return future
+
+  # Queues a transaction and waits for its result
+  def run(self, transaction, priority=0, deadline=None):
+    return self.submit(transaction, priority, deadline).result()
+
+  # Queue depth, transaction counts and seconds transactions waited
+  def stats(self):
+    with self._queueChanged:
+      taken = self.completed + self.failed + self.expired
+      return {
+        "depth": len(self._queue),
+        "completed": self.completed,
+        "failed": self.failed,
+        "expired": self.expired,
+        "wait_mean": self._waitTotal / taken if taken else None,
+        "wait_max": self._waitMax if taken else None,
+      }
+
+  def _run(self):
+    while True:
+      with self._queueChanged:
+        while not self._queue and not self._closed:
+          self._queueChanged.wait()
+        if self._closed:
+          break
+        _, expires, _, queued, transaction, future = \
+          heapq.heappop(self._queue)
+        started = time.monotonic()
+        metrics.observe("sdi12.bus_wait", started - queued)
+        self._waitTotal += started - queued
+        self._waitMax = max(self._waitMax, started - queued)
+        if started > expires:
+          self.expired += 1
+          future.set_exception(SDI12DeadlineExpired(
+            "Waited {:.3f}s for SDI-12 bus {}".format(started - queued,
+                                                       self.port)))
+          continue
+      if not future.set_running_or_notify_cancel():
+        continue
+      try:
+        result = transaction(self.probe)
+      except Exception as err:
+        self.failed += 1
+        future.set_exception(err)
       else:
-        raise tenacity.TryAgain                   
-    except:
-      raise tenacity.TryAgain
+        self.completed += 1
+        future.set_result(result)
+    # Nothing left to run what is still queued
+    for entry in self._queue:
+      entry[-1].set_exception(
+        RuntimeError("SDI-12 bus {} is closed".format(self.port)))
+    self._queue = []
+
+
+class BusConfig(PropertyHolder):
+    port = StringProperty(title='UART Port', default='/dev/ttymxc4')
+    addresses = StringProperty(title='Probe Addresses', default='0')
+
+
+class RetryConfig(PropertyHolder):
+    attempts = IntProperty(title='Attempts per Command', default=2)
+    silentAttempts = IntProperty(
+        title='Attempts per Command without Response', default=2)
+    backoff = FloatProperty(
+        title='First Backoff (seconds, 0: retry at once)', default=0)
+    backoffMax = FloatProperty(title='Max Backoff (seconds)', default=1)
+    pollDeadline = FloatProperty(
+        title='Max Poll Duration (seconds, 0: no limit)', default=0)
+    breakerFailures = IntProperty(
+        title='Failed Polls before Skipping a Probe (0: never)', default=0)
+    breakerCooldown = FloatProperty(
+        title='Seconds to Skip a Failing Probe', default=60)
 
 
 @discoverable
+@command("stats")
 class AquaCheck(Block):
 
     signalName = StringProperty(title='Signal Name', default='default')
+    temperatureName = StringProperty(title='Temperature Signal Name',
+                                     default='temperature')
     portNumber = StringProperty(title='UART Port', default='/dev/ttymxc4')
+    addresses = StringProperty(title='Probe Addresses', default='0')
+    buses = ListProperty(BusConfig, title='Buses (instead of UART Port)',
+                         default=[])
+    readMoisture = BoolProperty(default=True, title='Read Moisture')
+    readTemperature = BoolProperty(default=False, title='Read Temperature')
+    readMode = SelectProperty(ReadMode, title='Read Mode',
+                              default=ReadMode.MEASUREMENT)
+    pollInterval = FloatProperty(
+        default=0, title='Background Poll Interval (seconds, 0: none)')
+    maxAge = FloatProperty(
+        default=0,
+        title='Max Age of Cached Readings (seconds, 0: any when polling)')
+    priority = IntProperty(default=0, title='Bus Priority (lowest first)')
+    deadline = FloatProperty(
+        default=0, title='Max Wait for the Bus (seconds, 0: no limit)')
+    retry = ObjectProperty(RetryConfig, title='Retries',
+                           default=RetryConfig())
     sendMarking = BoolProperty(default=False, title='Send Marking')
     rs485 = BoolProperty(default=False, title='Hardware RS485 Port')
-    version = VersionProperty('0.0.1')
+    version = VersionProperty('0.7.0')
+
+    def __init__(self):
+        super().__init__()
+        self._buses = []        # (port, SDI12Bus, addresses) polled
+        self._poll_lock = Lock()
+        self._reading = None    # (time.monotonic() of the poll, results)
+        self._job = None
 
     def configure(self,context):
         super().configure(context)
-        self.logger.debug("Got here with {}".format(self.portNumber()))
-        self.AQ = SDI12AquaCheck(self.portNumber(), 
-                                 sendMarking=self.sendMarking(), 
-                                 rs485=self.rs485())
+        buses = [(bus.port(), bus.addresses()) for bus in self.buses()] or \
+            [(self.portNumber(), self.addresses())]
+        self.logger.debug("Got here with %s", buses)
+        # Blocks on the same port share its bus and take turns on it
+        for port, addresses in buses:
+            bus = SDI12Bus.shared(port, sendMarking=self.sendMarking(),
+                                  rs485=self.rs485())
+            self._buses.append(
+                (port, bus, addresses.replace(',', ' ').split() or ['0']))
+        retry = self.retry()
+        self._retryPolicy = RetryPolicy(
+            attempts=retry.attempts(),
+            silentAttempts=retry.silentAttempts(),
+            backoff=retry.backoff(),
+            backoffMax=retry.backoffMax(),
+            deadline=retry.pollDeadline() or None,
+            breakerFailures=retry.breakerFailures(),
+            breakerCooldown=retry.breakerCooldown())
+        # Signal attribute of each reading type to collect
+        self._sets = {}
+        if self.readMoisture():
+            self._sets[0] = self.signalName()
+        if self.readTemperature():
+            self._sets[1] = self.temperatureName()
+
+    def start(self):
+        super().start()
+        if self.pollInterval() > 0:
+            self._job = Job(self._poll,
+                            timedelta(seconds=self.pollInterval()), True)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        for _, bus, _ in self._buses:
+            bus.release()
+        self._buses = []
+        super().stop()
 
     def process_signals(self, signals):
-        for signal in signals:
-            if self.AQ.pollProbe(0) == 0:
-                #TODO: Add polling for temperature
-                value = self.AQ.moistureData
-                results = {self.signalName():value}
-                self.logger.debug("Got results: {}".format(results))
-                try:
-                    self.notify_signals([Signal(results)])
-                except:
-                    self.logger.exception("Signal is not valid:"
-                                          " {}".format(results))
+        results = self._latest()
+        if results is None:
+            return
+        try:
+            self.notify_signals([Signal(results) for _ in signals])
+        except:
+            self.logger.exception("Signal is not valid:"
+                                  " {}".format(results))
+
+    def stats(self):
+        """Return the queue depth and wait times of each bus."""
+        return {port: bus.stats() for port, bus, _ in self._buses}
+
+    def _latest(self):
+        """Return the cached results, polling if they are too old.
+
+        With a background poll interval and no max age any cached reading
+        is used, the job keeps it fresh; without one a max age of 0 polls
+        for every signal. Callers arriving while a poll is running wait for
+        it and share its results instead of polling again.
+
+        """
+        requested = time.monotonic()
+        reading = self._reading
+        maxAge = self.maxAge()
+        if reading is not None and (
+                requested - reading[0] <= maxAge or
+                maxAge <= 0 and self.pollInterval() > 0):
+            return reading[1]
+        with self._poll_lock:
+            reading = self._reading
+            if reading is not None and reading[0] >= requested:
+                return reading[1]
+            return self._acquire()
+
+    def _poll(self):
+        with self._poll_lock:
+            self._acquire()
+
+    def _acquire(self):
+        """Poll the probes and cache the results, None if there are none.
+
+        Every bus is polled at the same time on its own thread. With a
+        list of buses the results of each are keyed by port, with a
+        `status` of `ok`, `no data`, `busy` or the error that occurred.
+
+        """
+        deadline = self.deadline() or None
+        polls = [(port, addresses,
+                  bus.submit(partial(self._transaction, addresses=addresses),
+                             self.priority(), deadline))
+                 for port, bus, addresses in self._buses]
+        results = {}
+        for port, addresses, poll in polls:
+            try:
+                results[port] = self._bus_results(addresses, *poll.result())
+                status = 'ok' if results[port] is not None else 'no data'
+            except SDI12DeadlineExpired:
+                self.logger.warning(
+                    "No reading, SDI-12 bus {} is busy".format(port))
+                status = 'busy'
+            except Exception as err:
+                self.logger.exception(
+                    "Polling SDI-12 bus {} failed".format(port))
+                status = str(err)
+            if self.buses():
+                results[port] = dict(results.get(port) or {}, status=status)
+        if not self.buses():
+            results = results.get(self._buses[0][0])
+            if results is None:
+                return None
+        results['timestamp'] = time.time()
+        self.logger.debug("Got results: %s", results)
+        self._reading = (time.monotonic(), results)
+        return results
+
+    def _bus_results(self, addresses, data, setTiming):
+        if all(values is None for readings in data.values()
+               for values in readings.values()):
+            return None
+        if len(addresses) == 1:
+            # A single probe's values are not keyed by address
+            data = data[addresses[0]]
+            timing = setTiming[addresses[0]]
+        else:
+            data = {readingType: {address: data[address][readingType]
+                                  for address in data}
+                    for readingType in self._sets}
+            timing = {readingType:
+                      {address: setTiming[address].get(readingType)
+                       for address in setTiming}
+                      for readingType in self._sets}
+        results = {name: data[readingType]
+                   for readingType, name in self._sets.items()}
+        results['timing'] = {name: timing[readingType]
+                             for readingType, name in self._sets.items()}
+        return results
 
+    def _transaction(self, probe, addresses):
+        data = probe.acquire(list(self._sets), addresses,
+                             mode=self.readMode(),
+                             retryPolicy=self._retryPolicy)
+        return data, probe.setTiming
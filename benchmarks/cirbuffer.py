@@ -0,0 +1,93 @@
+"""Compare the byte ring buffer behind SDI12 with the list based one it
+replaced, on the access pattern of an SDI-12 data response.
+
+    python -m dart_6ul.benchmarks.cirbuffer
+
+"""
+import time
+from ..aquacheck_block import CirBuffer
+
+RESPONSES = 20000
+RESPONSE = b"0+0.123+4.567+8.901+2.345+6.789+0.123\r\n"
+
+
+class ListCirBuffer:
+
+    """The list of 1-byte bytes objects CirBuffer used to be."""
+
+    def __init__(self, size):
+        self._maxsize = size
+        self._bufferOverflow = False
+        self.data = []
+
+    def append(self, x):
+        if len(self.data)+1 > self._maxsize:
+            self._bufferOverflow = True
+        else:
+            self.data.append(x)
+
+    def read(self):
+        self._bufferOverflow = False
+        try:
+            return self.data.pop(0)
+        except:
+            return -1
+
+    def available(self):
+        if(self._bufferOverflow):
+            return -1
+        else:
+            return len(self.data)
+
+
+def list_buffer():
+    buf = ListCirBuffer(64)
+    chars = [RESPONSE[i:i+1] for i in range(len(RESPONSE))]
+    for _ in range(RESPONSES):
+        for char in chars:
+            buf.append(char)
+        response = ""
+        while buf.available():
+            response += buf.read().decode()
+
+
+def ring_buffer_bytewise():
+    buf = CirBuffer(64)
+    chars = [RESPONSE[i:i+1] for i in range(len(RESPONSE))]
+    for _ in range(RESPONSES):
+        for char in chars:
+            buf.append(char)
+        response = ""
+        while buf.available():
+            response += buf.read().decode()
+
+
+def ring_buffer_bytes_in():
+    """Bytes arriving one at a time, the response taken in one read."""
+    buf = CirBuffer(64)
+    chars = [RESPONSE[i:i+1] for i in range(len(RESPONSE))]
+    for _ in range(RESPONSES):
+        for char in chars:
+            buf.append(char)
+        response = buf.read_until(b"\r\n").decode()
+
+
+def ring_buffer_bulk():
+    buf = CirBuffer(64)
+    for _ in range(RESPONSES):
+        buf.write(RESPONSE)
+        response = buf.read_until(b"\r\n").decode()
+
+
+def run():
+    print("{:<28}{:>16}".format("implementation", "responses/s"))
+    for func in (list_buffer, ring_buffer_bytewise, ring_buffer_bytes_in,
+                 ring_buffer_bulk):
+        start = time.perf_counter()
+        func()
+        rate = RESPONSES / (time.perf_counter() - start)
+        print("{:<28}{:>16.0f}".format(func.__name__, rate))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,63 @@
+"""Measure edge-to-callback latency and idle CPU use of GPIOEdgeMonitor.
+
+Edges are injected into the mock gpiochip from the tests, whose event
+queues are real pipes, so the monitor wakes up through epoll the same way
+it does on hardware. Run from the directory containing this block package:
+
+    python -m dart_6ul.benchmarks.gpio_interrupts
+
+"""
+import logging
+import time
+from threading import Event
+from ..gpio_backends import CdevBackend
+from ..gpio_device import GPIODevice, GPIOManager
+from ..tests.fake_gpio import MockGPIOChips
+
+EDGES = 2000
+PINS = 16
+IDLE_SECONDS = 2
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run():
+    logger = logging.getLogger("gpio_interrupts")
+    chips = MockGPIOChips()
+    gpio = GPIODevice(logger, GPIOManager(
+        logger, CdevBackend(logger, syscalls=chips)))
+    latencies = []
+    received = Event()
+
+    def callback(pin, value, timestamp):
+        latencies.append(time.monotonic() - timestamp)
+        received.set()
+
+    for pin in range(PINS):
+        gpio.interrupt(callback, pin, "both")
+
+    # One edge at a time so each latency is that of an idle monitor
+    for i in range(EDGES):
+        received.clear()
+        chips.inject_edge(i % PINS, i & 1)
+        received.wait(1)
+
+    cpu = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu) / IDLE_SECONDS
+    gpio.close()
+
+    micros = [latency * 1e6 for latency in latencies]
+    print("edges: {} on {} pins".format(len(micros), PINS))
+    print("edge-to-callback latency (us): p50 {:.0f}, p90 {:.0f}, "
+          "p99 {:.0f}, max {:.0f}".format(
+              percentile(micros, 0.5), percentile(micros, 0.9),
+              percentile(micros, 0.99), max(micros)))
+    print("idle CPU use: {:.2f}%".format(idle_cpu * 100))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,55 @@
+"""Compare GPIODevice throughput with and without the pin-handle pool.
+
+Runs against the fake sysfs tree from the tests, so the numbers show the
+cost of opening, configuring and closing a pin on every call relative to
+re-using an open handle, not absolute hardware rates. Run from the
+directory containing this block package:
+
+    python -m dart_6ul.benchmarks.gpio_pool
+
+"""
+import logging
+import time
+from unittest.mock import patch
+from .. import gpio_backends
+from ..gpio_backends import SysfsBackend
+from ..gpio_device import GPIODevice, GPIOManager
+from ..tests.fake_gpio import FakeSysfs
+
+OPERATIONS = 5000
+PINS = 8
+
+
+def ops_per_second(func, operations=OPERATIONS):
+    start = time.perf_counter()
+    for i in range(operations):
+        func(i)
+    return operations / (time.perf_counter() - start)
+
+
+def run():
+    logger = logging.getLogger("gpio_pool")
+    results = []
+    with FakeSysfs() as sysfs:
+        with patch.object(gpio_backends, "GPIO", sysfs.GPIO, create=True):
+            for label, max_handles in (("open/close per op", 0),
+                                       ("pooled", 32)):
+                backend = SysfsBackend(logger, max_handles=max_handles)
+                gpio = GPIODevice(logger, GPIOManager(logger, backend))
+                reads = ops_per_second(lambda i: gpio.read(i % PINS))
+                # Alternate the level of each pin so that no write is
+                # skipped as redundant
+                writes = ops_per_second(
+                    lambda i: gpio.write(PINS + i % PINS, (i // PINS) & 1))
+                gpio.close()
+                results.append((label, reads, writes))
+    print("{:<20}{:>14}{:>14}".format("mode", "reads/s", "writes/s"))
+    for label, reads, writes in results:
+        print("{:<20}{:>14.0f}{:>14.0f}".format(label, reads, writes))
+    base, pooled = results[0], results[1]
+    print("speedup: reads x{:.1f}, writes x{:.1f}".format(
+        pooled[1] / base[1], pooled[2] / base[2]))
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,299 @@
+"""Measure GPIO throughput and latency on the stand-in devices, and compare
+the results with an earlier run to catch regressions.
+
+Covers single pin reads and writes, batched reads and writes of several
+pins, several threads contending for the same pin or using their own, and
+the latency from an edge to the signal built for it by the interrupt
+callback. Reads and writes run on both the fake sysfs tree and the mock
+gpiochips from the tests, so the numbers show the cost of the code paths,
+not hardware rates.
+
+Every benchmark runs once to warm up, then `--repeats` short runs with the
+garbage collector off. The runs of all benchmarks on a backend take turns,
+so a slow patch of the machine slows them alike rather than one benchmark
+of one run. The median run is reported with its uncertainty, the half width
+of a box plot notch, 1.57 times the spread of the middle half of the runs
+over the square root of their number. Pinning the process to one CPU with
+`--cpu` and fixing the hash seed, which changes the layout of dicts and
+with it the speed of a whole run, make runs steadier. Run from the
+directory containing this block package:
+
+    PYTHONHASHSEED=0 python -m dart_6ul.benchmarks.gpio_suite --cpu 0 \
+        --save before.json
+    ... change the code ...
+    PYTHONHASHSEED=0 python -m dart_6ul.benchmarks.gpio_suite --cpu 0 \
+        --baseline before.json
+
+With a baseline, results worse by more than `--threshold` percent, and by
+more than the uncertainties of both results added up, so that their notches
+do not overlap, are flagged and the exit status is 1. Compare results from
+the same machine and Python only. On a busy or shared machine whole runs
+still drift by more than the uncertainties show, so rerun before trusting a
+regression found there.
+
+"""
+import argparse
+import gc
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import time
+from functools import partial
+from threading import Barrier, Event, Thread
+from nio.signal.base import Signal
+from ..gpio_device import GPIODevice, GPIOManager
+from ..tests.fake_gpio import FakeGPIOEnvironment
+
+OPERATIONS = 5000
+BATCH_SIZES = (8, 32)
+THREADS = 4
+EDGES = 1000
+# Enough handles for every pin used, so that no benchmark measures the
+# pool closing handles
+MAX_HANDLES = 128
+# Memory backed, so that disk caching does not change the sysfs results
+SYSFS_PARENT = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timed(operations, func):
+    """Return operations per second of running func."""
+    start = time.perf_counter()
+    func()
+    return operations / (time.perf_counter() - start)
+
+
+def reads(gpio):
+    def run():
+        for i in range(OPERATIONS):
+            gpio.read(i % 8)
+    return timed(OPERATIONS, run)
+
+
+def writes(gpio):
+    def run():
+        # Alternate levels so that no write is skipped
+        for i in range(OPERATIONS):
+            gpio.write(64 + i % 8, (i >> 3) & 1)
+    return timed(OPERATIONS, run)
+
+
+def read_many(size):
+    def bench(gpio):
+        pins = list(range(size))
+        calls = OPERATIONS // size
+
+        def run():
+            for _ in range(calls):
+                gpio.read_many(pins)
+        return timed(calls * size, run)
+    return bench
+
+
+def write_many(size):
+    def bench(gpio):
+        calls = OPERATIONS // size
+        levels = [{64 + pin: bool(i & 1) for pin in range(size)}
+                  for i in range(2)]
+
+        def run():
+            for i in range(calls):
+                gpio.write_many(levels[i & 1])
+        return timed(calls * size, run)
+    return bench
+
+
+def contention(same_pin):
+    def bench(gpio):
+        per_thread = OPERATIONS // THREADS
+        barrier = Barrier(THREADS + 1)
+
+        def worker(index):
+            pin = 0 if same_pin else index
+            barrier.wait()
+            for _ in range(per_thread):
+                gpio.read(pin)
+
+        threads = [Thread(target=worker, args=(index,))
+                   for index in range(THREADS)]
+        for thread in threads:
+            thread.start()
+
+        def run():
+            barrier.wait()
+            for thread in threads:
+                thread.join()
+        return timed(per_thread * THREADS, run)
+    return bench
+
+
+def edge_latencies(env, gpio):
+    """Return the seconds from each injected edge to its signal."""
+    latencies = []
+    received = Event()
+
+    def callback(pin, value, timestamp):
+        # What GPIOInterrupts builds for each edge
+        Signal({"pin": pin, "value": value, "timestamp": timestamp})
+        latencies.append(time.monotonic() - timestamp)
+        received.set()
+
+    gpio.interrupt(callback, 100, "both")
+    # One edge at a time so each latency is that of an idle monitor
+    for i in range(EDGES):
+        received.clear()
+        env.chips.inject_edge(100, i & 1)
+        received.wait(1)
+    gpio.remove_interrupt(100)
+    return latencies
+
+
+def edge_to_signal(fraction):
+    def bench(gpio, env):
+        return percentile(edge_latencies(env, gpio), fraction) * 1e6
+    return bench
+
+
+# name, unit and function of the device, higher results are better
+THROUGHPUT = [
+    ("read", "ops/s", reads),
+    ("write", "ops/s", writes),
+] + [
+    ("read_many x{}".format(size), "pins/s", read_many(size))
+    for size in BATCH_SIZES
+] + [
+    ("write_many x{}".format(size), "pins/s", write_many(size))
+    for size in BATCH_SIZES
+] + [
+    ("{} threads, same pin".format(THREADS), "ops/s", contention(True)),
+    ("{} threads, own pins".format(THREADS), "ops/s", contention(False)),
+]
+# name, unit and function of the device and environment, lower results
+# are better
+LATENCY = [
+    ("edge to signal p50", "us", edge_to_signal(0.5)),
+    ("edge to signal p99", "us", edge_to_signal(0.99)),
+]
+
+
+def run_once(func):
+    gc.collect()
+    gc.disable()
+    try:
+        return func()
+    finally:
+        gc.enable()
+
+
+def summarize(results):
+    """Return the median of the runs and its relative uncertainty."""
+    results = sorted(results)
+    median = statistics.median(results)
+    spread = percentile(results, 0.75) - percentile(results, 0.25)
+    error = 1.57 * spread / math.sqrt(len(results))
+    return median, error / median if median else 0
+
+
+def measure(benchmarks, repeats):
+    """Return the median and uncertainty of each benchmark's runs.
+
+    Args:
+        benchmarks (list): functions returning the result of one run
+        repeats (int): runs of each benchmark, taking turns
+
+    """
+    for func in benchmarks:
+        func()
+    results = [[] for _ in benchmarks]
+    for _ in range(repeats):
+        for func, runs in zip(benchmarks, results):
+            runs.append(run_once(func))
+    return [summarize(runs) for runs in results]
+
+
+def run_benchmarks(repeats):
+    """Return the backend, name, unit, whether higher is better, median
+    and uncertainty of each benchmark.
+    """
+    logger = logging.getLogger("gpio_suite")
+    results = []
+    for backend, cdev in (("sysfs", False), ("cdev", True)):
+        with FakeGPIOEnvironment(cdev=cdev,
+                                 sysfs_parent=SYSFS_PARENT) as env:
+            options = {} if cdev else {"max_handles": MAX_HANDLES}
+            gpio = GPIODevice(logger, GPIOManager(
+                logger, env.backend(logger, **options)))
+            benchmarks = [(name, unit, True, partial(func, gpio))
+                          for name, unit, func in THROUGHPUT]
+            if cdev:
+                benchmarks += [(name, unit, False, partial(func, gpio, env))
+                               for name, unit, func in LATENCY]
+            summaries = measure([benchmark[3] for benchmark in benchmarks],
+                                repeats)
+            for (name, unit, higher_better, _), (median, error) in \
+                    zip(benchmarks, summaries):
+                results.append((backend, name, unit, higher_better, median,
+                                error))
+            gpio.close()
+    return results
+
+
+def report(results, baseline, threshold):
+    """Print the results and return how many regressed from the baseline."""
+    regressions = 0
+    print("{:<34}{:>14} {:<7}{:>8}{:>10}".format(
+        "benchmark", "median", "unit", "+/-",
+        "change" if baseline else ""))
+    for backend, name, unit, higher_better, median, error in results:
+        key = "{} {}".format(backend, name)
+        line = "{:<34}{:>14.1f} {:<7}{:>7.1f}%".format(
+            key, median, unit, error * 100)
+        before = baseline.get(key)
+        if before:
+            change = (median - before["median"]) / before["median"] * 100
+            line += "{:>+9.1f}%".format(change)
+            worse = -change if higher_better else change
+            if worse > max(threshold, (error + before["error"]) * 100):
+                line += "  REGRESSION"
+                regressions += 1
+        print(line)
+    return regressions
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeats", type=int, default=15)
+    parser.add_argument("--cpu", type=int,
+                        help="CPU to pin the process to")
+    parser.add_argument("--save", help="file to save the results to")
+    parser.add_argument("--baseline",
+                        help="results saved by an earlier run")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="percent worse than the baseline to flag")
+    args = parser.parse_args(argv)
+    if args.cpu is not None:
+        os.sched_setaffinity(0, {args.cpu})
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    results = run_benchmarks(args.repeats)
+    regressions = report(results, baseline, args.threshold)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"{} {}".format(backend, name):
+                       {"median": median, "error": error}
+                       for backend, name, _, _, median, error in results},
+                      f, indent=2, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,55 @@
+"""Show how the time to poll every probe grows with the number of buses,
+polling the buses one after the other and all at once.
+
+Each bus is a stand-in serial port from the tests with two probes taking a
+second to measure, so the numbers show how polls overlap, not hardware
+timing. Run from the directory containing this block package:
+
+    python -m dart_6ul.benchmarks.sdi12_buses
+
+"""
+import time
+from ..aquacheck_block import SDI12Bus
+from ..tests.fake_sdi12 import FakeSDI12Port, FakeSDI12Sensor
+
+BUSES = 4
+ADDRESSES = ["0", "1"]
+
+
+def poll(probe):
+    return probe.acquire([0], ADDRESSES)
+
+
+def make_buses(count):
+    return [SDI12Bus(FakeSDI12Port([
+        FakeSDI12Sensor(address, [30.5, 31.0, 29.8], measurement_time=1)
+        for address in ADDRESSES])) for _ in range(count)]
+
+
+def one_at_a_time(buses):
+    for bus in buses:
+        bus.run(poll)
+
+
+def all_at_once(buses):
+    for future in [bus.submit(poll) for bus in buses]:
+        future.result()
+
+
+def run():
+    print("{:<8}{:>18}{:>18}".format("buses", "one at a time (s)",
+                                     "all at once (s)"))
+    for count in range(1, BUSES + 1):
+        buses = make_buses(count)
+        times = []
+        for func in (one_at_a_time, all_at_once):
+            start = time.perf_counter()
+            func(buses)
+            times.append(time.perf_counter() - start)
+        for bus in buses:
+            bus.close()
+        print("{:<8}{:>18.2f}{:>18.2f}".format(count, *times))
+
+
+if __name__ == "__main__":
+    run()
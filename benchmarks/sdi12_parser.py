@@ -0,0 +1,44 @@
+"""Compare the SDI-12 data response parser with the fixed slicing it
+replaced, with and without CRC checks.
+
+    python -m dart_6ul.benchmarks.sdi12_parser
+
+"""
+import time
+from ..aquacheck_block import parseDataResponse, sdi12CRC
+
+RESPONSES = 100000
+RESPONSE = "0+12.34567+13.23456+14.56789\r\n"
+CRC_RESPONSE = RESPONSE[:-2] + sdi12CRC(RESPONSE[:-2]) + "\r\n"
+
+
+def fixed_slicing():
+    """Three 8 character values, the only layout it understood."""
+    for _ in range(RESPONSES):
+        values = [RESPONSE[2:10], RESPONSE[11:19], RESPONSE[20:28]]
+        values = [float(value) for value in values]
+
+
+def parser():
+    for _ in range(RESPONSES):
+        values = [float(value) for value in
+                  parseDataResponse(RESPONSE, "0")]
+
+
+def parser_crc():
+    for _ in range(RESPONSES):
+        values = [float(value) for value in
+                  parseDataResponse(CRC_RESPONSE, "0", crc=True)]
+
+
+def run():
+    print("{:<28}{:>16}".format("implementation", "responses/s"))
+    for func in (fixed_slicing, parser, parser_crc):
+        start = time.perf_counter()
+        func()
+        rate = RESPONSES / (time.perf_counter() - start)
+        print("{:<28}{:>16.0f}".format(func.__name__, rate))
+
+
+if __name__ == "__main__":
+    run()
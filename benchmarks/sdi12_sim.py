@@ -0,0 +1,101 @@
+"""Measure poll latency and bus throughput of the SDI-12 stack against
+simulated sensors on a clean bus and on noisy ones.
+
+Each scenario polls three probes for moisture and temperature with CRCs,
+the transaction an `AquaCheck` block hands its bus, behind a pseudo
+terminal so the serial driver is in the path, and behind a `loop://` port.
+Random delays, drops and CRC errors are seeded, so runs are comparable.
+Run from the directory containing this block package:
+
+    python -m dart_6ul.benchmarks.sdi12_sim
+
+"""
+import time
+from ..aquacheck_block import RetryPolicy, SDI12Bus
+from ..metrics import metrics
+from ..tests.fake_sdi12 import FakeSDI12Port, FakeSDI12Pty, FakeSDI12Sensor
+
+POLLS = 30
+ADDRESSES = ["0", "1", "2"]
+READING_TYPES = [0, 1]
+POLICY = RetryPolicy(attempts=3, silentAttempts=2)
+
+# name, SDI12Line options, FakeSDI12Sensor options
+SCENARIOS = [
+    ("clean", {}, {}),
+    ("no echo", {"echo": False}, {}),
+    ("jitter 50ms", {"jitter": 0.05}, {}),
+    ("1% bytes dropped", {"drop_rate": 0.01}, {}),
+    ("10% CRC errors", {}, {"crc_error_rate": 0.1}),
+]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def poll(probe):
+    return probe.acquire(READING_TYPES, ADDRESSES, crc=True,
+                         retryPolicy=POLICY)
+
+
+def make_sensors(options):
+    return [FakeSDI12Sensor(address, [30.5, 31.0, 29.8, 12.25],
+                            seed=index, **options)
+            for index, address in enumerate(ADDRESSES)]
+
+
+def run_scenario(transport, line_options, sensor_options):
+    sensors = make_sensors(sensor_options)
+    if transport == "pty":
+        line = FakeSDI12Pty(sensors, seed=1, **line_options)
+        bus = SDI12Bus(line.port, sendMarking=False)
+    else:
+        line = FakeSDI12Port(sensors, seed=1, **line_options)
+        bus = SDI12Bus(line, sendMarking=False)
+    metrics.snapshot(reset=True)
+    latencies = []
+    values = failed = 0
+    start = time.perf_counter()
+    for _ in range(POLLS):
+        polled = time.perf_counter()
+        results = bus.run(poll)
+        latencies.append(time.perf_counter() - polled)
+        for readings in results.values():
+            for reading in readings.values():
+                if reading is None:
+                    failed += 1
+                else:
+                    values += len(reading)
+    elapsed = time.perf_counter() - start
+    bus.close()
+    if transport == "pty":
+        line.close()
+    counters = metrics.snapshot()["counters"]
+    millis = [latency * 1000 for latency in latencies]
+    return (percentile(millis, 0.5), percentile(millis, 0.9),
+            percentile(millis, 0.99), max(millis), POLLS / elapsed,
+            values / elapsed, failed, counters.get("sdi12.retries", 0),
+            counters.get("sdi12.timeouts", 0))
+
+
+def run():
+    metrics.enable()
+    print("{} polls of {} probes, {} readings each\n".format(
+        POLLS, len(ADDRESSES), len(READING_TYPES)))
+    print("{:<20}{:<6}{:>8}{:>8}{:>8}{:>8}{:>9}{:>10}{:>8}{:>9}{:>10}"
+          .format("scenario", "port", "p50 ms", "p90 ms", "p99 ms",
+                  "max ms", "polls/s", "values/s", "failed", "retries",
+                  "timeouts"))
+    for name, line_options, sensor_options in SCENARIOS:
+        for transport in ("pty", "loop"):
+            print("{:<20}{:<6}{:>8.1f}{:>8.1f}{:>8.1f}{:>8.1f}{:>9.2f}"
+                  "{:>10.1f}{:>8}{:>9}{:>10}".format(
+                      name, transport, *run_scenario(
+                          transport, line_options, sensor_options)))
+    metrics.disable()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,688 @@
+import ctypes
+import fcntl
+import os
+import select
+import struct
+import time
+from collections import OrderedDict
+from threading import Event, Lock, Thread
+
+
+try:
+    from periphery import GPIO
+except ImportError:
+    # Let the block code load without periphery, e.g. to run the tests
+    # against the stand-in GPIO environment. SysfsBackend needs it.
+    GPIO = None
+
+
+class GPIOBackend():
+
+    """Interface to the kernel used by `GPIODevice`.
+
+    Backends are called with the manager's pin locks held for every pin
+    they are given, but may be called concurrently for different pins.
+
+    """
+
+    def read(self, pin):
+        """Return the level of an input pin as a bool."""
+        raise NotImplementedError
+
+    def write(self, pin, value):
+        """Drive an output pin to a level."""
+        raise NotImplementedError
+
+    def read_many(self, pins):
+        """Return a dict of pin to level for several input pins."""
+        return {pin: self.read(pin) for pin in pins}
+
+    def write_many(self, values):
+        """Drive several output pins from a dict of pin to level."""
+        for pin, value in values.items():
+            self.write(pin, value)
+
+    def open_edge(self, pin, edge):
+        """Configure a pin as an input reporting edges.
+
+        Args:
+            pin (int): the pin to watch
+            edge (str): "rising", "falling" or "both"
+
+        Return:
+            an edge source with a file descriptor `fd` to wait on for the
+            `events` epoll mask, `read_events()` returning a list of
+            `(timestamp, value)` tuples, `count_into(counter, slot)`
+            calling `counter.add(slot, timestamp)` for each edge and
+            `close()`
+
+        """
+        raise NotImplementedError
+
+    def release(self, pin):
+        """Give up any hold on a pin so it can be opened elsewhere."""
+        pass
+
+    def close(self):
+        """Release every pin."""
+        pass
+
+
+class _PinHandle():
+
+    """An open GPIO pin along with its cached direction."""
+
+    __slots__ = ("gpio", "direction", "last_used", "users")
+
+    def __init__(self, gpio, direction):
+        self.gpio = gpio
+        self.direction = direction
+        self.last_used = time.monotonic()
+        self.users = 0
+
+
+class GPIOPinPool():
+
+    """Keep GPIO pins open between operations.
+
+    Opening a pin exports it, opens its sysfs files and sets its direction,
+    which costs far more than the read or write itself. The pool opens each
+    pin once and hands the same handle back on later calls. Handles are kept
+    in least-recently-used order so that the oldest ones are closed first
+    when the pool is full or a handle has been idle for too long. Handles
+    that have been acquired and not yet given back with `done` are never
+    closed by eviction.
+
+    While any handle is open, a thread closes the handles idle for longer
+    than `idle_timeout`, so pins are let go even if the pool is not used
+    again. The thread exits once the pool is empty.
+
+    Args:
+        logger: logger used to report failures closing a pin
+        max_handles (int): most pins held open at once, 0 disables pooling
+        idle_timeout (float): seconds a handle may go unused before it is
+            closed, None keeps handles open until the pool is closed
+
+    """
+
+    def __init__(self, logger, max_handles=32, idle_timeout=60.0):
+        self.logger = logger
+        self.max_handles = max_handles
+        self.idle_timeout = idle_timeout
+        self._handles = OrderedDict()
+        self._lock = Lock()
+        self._stop = Event()
+        self._reaper = None
+
+    def __len__(self):
+        return len(self._handles)
+
+    def __contains__(self, pin):
+        return pin in self._handles
+
+    def acquire(self, pin, direction):
+        """Return an open handle for a pin.
+
+        Every call must be matched by a call to `done` once the caller has
+        finished with the handle.
+
+        Args:
+            pin (int): the pin to open
+            direction (str): direction to open a new pin with
+
+        Return:
+            _PinHandle: open handle, its direction may differ from
+                `direction` when it was already open
+
+        """
+        with self._lock:
+            handle = self._handles.get(pin)
+            if handle is None:
+                handle = _PinHandle(GPIO(pin, direction), direction)
+                self._handles[pin] = handle
+                self._start_reaper()
+            else:
+                self._handles.move_to_end(pin)
+            handle.users += 1
+            return handle
+
+    def done(self, pin, handle, failed=False):
+        """Give back a handle returned by `acquire`.
+
+        Args:
+            pin (int): the pin the handle belongs to
+            handle (_PinHandle): the handle to give back
+            failed (bool): close the handle, it may be in a bad state
+
+        """
+        with self._lock:
+            handle.users -= 1
+            handle.last_used = time.monotonic()
+            if (failed or self.max_handles <= 0) and handle.users == 0 and \
+                    self._handles.get(pin) is handle:
+                del self._handles[pin]
+                self._close_handle(pin, handle)
+            self._evict(handle.last_used)
+
+    def release(self, pin):
+        """Close the handle of a pin if one is open and not in use."""
+        with self._lock:
+            handle = self._handles.get(pin)
+            if handle is not None and handle.users == 0:
+                del self._handles[pin]
+                self._close_handle(pin, handle)
+
+    def evict_idle(self):
+        """Close every handle idle for longer than `idle_timeout`."""
+        with self._lock:
+            self._evict(time.monotonic())
+
+    def close(self):
+        """Close all open handles."""
+        with self._lock:
+            self._stop.set()
+            self._stop = Event()
+            self._reaper = None
+            while self._handles:
+                pin, handle = self._handles.popitem(last=False)
+                self._close_handle(pin, handle)
+
+    def _start_reaper(self):
+        if self._reaper is not None or self.idle_timeout is None or \
+                self.max_handles <= 0:
+            return
+        self._reaper = Thread(target=self._reap, args=(self._stop,),
+                              name="GPIOPinPool", daemon=True)
+        self._reaper.start()
+
+    def _reap(self, stop):
+        while True:
+            idle_timeout = self.idle_timeout
+            # Wake up often enough to close a handle soon after it expires
+            if idle_timeout is not None and \
+                    stop.wait(max(idle_timeout / 2, 0.1)):
+                return
+            with self._lock:
+                if stop.is_set():
+                    return
+                if idle_timeout is not None:
+                    self._evict(time.monotonic())
+                if not self._handles or self.idle_timeout is None:
+                    self._reaper = None
+                    return
+
+    def _evict(self, now):
+        excess = len(self._handles) - max(self.max_handles, 0)
+        for pin, handle in list(self._handles.items()):
+            idle = self.idle_timeout is not None and \
+                now - handle.last_used > self.idle_timeout
+            if excess <= 0 and not idle:
+                break
+            if handle.users == 0:
+                del self._handles[pin]
+                self._close_handle(pin, handle)
+                excess -= 1
+
+    def _close_handle(self, pin, handle):
+        try:
+            handle.gpio.close()
+        except:
+            self.logger.warning(
+                "Failed to close GPIO pin {}".format(pin), exc_info=True)
+
+
+class SysfsBackend(GPIOBackend):
+
+    """GPIO through the sysfs interface, one `periphery.GPIO` per pin.
+
+    Args:
+        logger: logger used by the pin pool
+        max_handles (int): most pins held open at once
+        idle_timeout (float): seconds before an unused pin is closed
+
+    """
+
+    def __init__(self, logger, max_handles=32, idle_timeout=60.0):
+        if GPIO is None:
+            raise RuntimeError(
+                "The sysfs GPIO backend needs python-periphery")
+        self.pool = GPIOPinPool(logger, max_handles, idle_timeout)
+
+    def read(self, pin):
+        handle = self.pool.acquire(pin, "in")
+        failed = True
+        try:
+            if handle.direction != "in":
+                handle.gpio.direction = "in"
+                handle.direction = "in"
+            value = handle.gpio.read()
+            failed = False
+        finally:
+            self.pool.done(pin, handle, failed)
+        return bool(value)
+
+    def write(self, pin, value):
+        handle = self.pool.acquire(pin, "preserve")
+        failed = True
+        try:
+            if handle.direction == "out":
+                handle.gpio.write(bool(value))
+            else:
+                # Setting "high"/"low" switches the pin to an output
+                # and drives the level in one step, without a glitch.
+                handle.gpio.direction = "high" if value else "low"
+                handle.direction = "out"
+            failed = False
+        finally:
+            self.pool.done(pin, handle, failed)
+
+    def open_edge(self, pin, edge):
+        self.pool.release(pin)
+        return _SysfsEdgeSource(GPIO(pin, "in"), edge)
+
+    def release(self, pin):
+        self.pool.release(pin)
+
+    def close(self):
+        self.pool.close()
+
+
+class _SysfsEdgeSource():
+
+    """Edges of a sysfs pin, reported as a priority event on its value file.
+
+    sysfs gives no time of the edge, events are stamped with `time.time()`
+    when they are read.
+
+    """
+
+    events = select.EPOLLPRI | select.EPOLLERR
+
+    def __init__(self, gpio, edge):
+        self.gpio = gpio
+        try:
+            gpio.edge = edge
+            # The value file is reported as changed until it is first read
+            gpio.read()
+        except:
+            gpio.close()
+            raise
+        self.fd = gpio.fd
+        self._buf = bytearray(2)
+
+    def read_events(self):
+        return [(time.time(), self.gpio.read())]
+
+    def count_into(self, counter, slot):
+        # Clear the event without allocating a value
+        os.lseek(self.fd, 0, os.SEEK_SET)
+        os.readv(self.fd, (self._buf,))
+        counter.add(slot, time.time())
+
+    def close(self):
+        try:
+            # Leave the pin usable for anything else
+            self.gpio.edge = "none"
+        finally:
+            self.gpio.close()
+
+
+# Linux GPIO character device ABI (v1), see include/uapi/linux/gpio.h
+GPIOHANDLES_MAX = 64
+GPIOHANDLE_REQUEST_INPUT = 1 << 0
+GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+GPIOEVENT_REQUEST_RISING_EDGE = 1 << 0
+GPIOEVENT_REQUEST_FALLING_EDGE = 1 << 1
+GPIOEVENT_REQUEST_BOTH_EDGES = \
+    GPIOEVENT_REQUEST_RISING_EDGE | GPIOEVENT_REQUEST_FALLING_EDGE
+GPIOEVENT_EVENT_RISING_EDGE = 0x01
+GPIOEVENT_EVENT_FALLING_EDGE = 0x02
+
+
+class gpiohandle_request(ctypes.Structure):
+    _fields_ = [
+        ("lineoffsets", ctypes.c_uint32 * GPIOHANDLES_MAX),
+        ("flags", ctypes.c_uint32),
+        ("default_values", ctypes.c_uint8 * GPIOHANDLES_MAX),
+        ("consumer_label", ctypes.c_char * 32),
+        ("lines", ctypes.c_uint32),
+        ("fd", ctypes.c_int),
+    ]
+
+
+class gpiohandle_data(ctypes.Structure):
+    _fields_ = [
+        ("values", ctypes.c_uint8 * GPIOHANDLES_MAX),
+    ]
+
+
+class gpioevent_request(ctypes.Structure):
+    _fields_ = [
+        ("lineoffset", ctypes.c_uint32),
+        ("handleflags", ctypes.c_uint32),
+        ("eventflags", ctypes.c_uint32),
+        ("consumer_label", ctypes.c_char * 32),
+        ("fd", ctypes.c_int),
+    ]
+
+
+# struct gpioevent_data: __u64 timestamp (ns), __u32 id, padded to 8 bytes
+gpioevent_data = struct.Struct("=QI4x")
+
+EDGE_FLAGS = {
+    "rising": GPIOEVENT_REQUEST_RISING_EDGE,
+    "falling": GPIOEVENT_REQUEST_FALLING_EDGE,
+    "both": GPIOEVENT_REQUEST_BOTH_EDGES,
+}
+
+
+def _IOWR(type, nr, struct):
+    return (3 << 30) | (ctypes.sizeof(struct) << 16) | (type << 8) | nr
+
+
+GPIO_GET_LINEHANDLE_IOCTL = _IOWR(0xB4, 0x03, gpiohandle_request)
+GPIO_GET_LINEEVENT_IOCTL = _IOWR(0xB4, 0x04, gpioevent_request)
+GPIOHANDLE_GET_LINE_VALUES_IOCTL = _IOWR(0xB4, 0x08, gpiohandle_data)
+GPIOHANDLE_SET_LINE_VALUES_IOCTL = _IOWR(0xB4, 0x09, gpiohandle_data)
+
+
+class Syscalls():
+
+    """System calls used by `CdevBackend`, replaced by a mock in tests."""
+
+    open = staticmethod(os.open)
+    close = staticmethod(os.close)
+    read = staticmethod(os.read)
+    readv = staticmethod(os.readv)
+    ioctl = staticmethod(fcntl.ioctl)
+
+
+class _LineRequest():
+
+    """Lines of a chip requested together in one direction."""
+
+    __slots__ = ("fd", "offsets", "index")
+
+    def __init__(self, fd, offsets):
+        self.fd = fd
+        self.offsets = offsets
+        self.index = {offset: i for i, offset in enumerate(offsets)}
+
+
+class _Chip():
+
+    __slots__ = ("fd", "inputs", "outputs", "levels", "events")
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.inputs = None
+        self.outputs = None
+        self.levels = {}
+        # offset -> fd of the event request watching the line
+        self.events = {}
+
+
+class CdevBackend(GPIOBackend):
+
+    """GPIO through the `/dev/gpiochipN` character devices.
+
+    All input lines of a chip in use are held in one line request and all
+    output lines in another, so any number of lines of a chip are read or
+    written with a single ioctl. Requests are widened as new lines are
+    used; a line moving between input and output is taken out of the
+    request for its old direction first. Lines watched for edges are held
+    by their event request and read through it.
+
+    Pins are numbered as in sysfs, pin `n` being line `n % lines_per_chip`
+    of chip `n // lines_per_chip`, which matches the 32 line GPIO banks of
+    the i.MX6UL.
+
+    Args:
+        logger: logger used to report failures releasing lines
+        path (str): format of the chip device paths
+        lines_per_chip (int): number of lines of each chip
+        syscalls: provider of `open`, `close` and `ioctl`
+
+    """
+
+    def __init__(self, logger, path="/dev/gpiochip{}", lines_per_chip=32,
+                 syscalls=Syscalls):
+        self.logger = logger
+        self.path = path
+        self.lines_per_chip = lines_per_chip
+        self._sys = syscalls
+        self._chips = {}
+        self._lock = Lock()
+
+    @classmethod
+    def available(cls, path="/dev/gpiochip{}"):
+        """Return whether the first chip device exists."""
+        return os.path.exists(path.format(0))
+
+    def read(self, pin):
+        return self.read_many((pin,))[pin]
+
+    def write(self, pin, value):
+        self.write_many({pin: value})
+
+    def read_many(self, pins):
+        result = {}
+        with self._lock:
+            for chip_number, offsets in self._group(pins).items():
+                chip = self._chip(chip_number)
+                base = chip_number * self.lines_per_chip
+                # A line can only be held by one request, watched lines
+                # are read through their event request
+                watched = [offset for offset in offsets
+                           if offset in chip.events]
+                for offset in watched:
+                    data = gpiohandle_data()
+                    self._sys.ioctl(chip.events[offset],
+                                    GPIOHANDLE_GET_LINE_VALUES_IOCTL,
+                                    data, True)
+                    result[base + offset] = bool(data.values[0])
+                offsets = [offset for offset in offsets
+                           if offset not in chip.events]
+                if not offsets:
+                    continue
+                request = self._request(chip, GPIOHANDLE_REQUEST_INPUT,
+                                        offsets)
+                data = gpiohandle_data()
+                self._sys.ioctl(request.fd, GPIOHANDLE_GET_LINE_VALUES_IOCTL,
+                                data, True)
+                for offset in offsets:
+                    result[base + offset] = \
+                        bool(data.values[request.index[offset]])
+        return result
+
+    def write_many(self, values):
+        with self._lock:
+            for chip_number, offsets in self._group(values).items():
+                chip = self._chip(chip_number)
+                base = chip_number * self.lines_per_chip
+                for offset in offsets:
+                    chip.levels[offset] = 1 if values[base + offset] else 0
+                request = self._request(chip, GPIOHANDLE_REQUEST_OUTPUT,
+                                        offsets)
+                data = gpiohandle_data()
+                for i, offset in enumerate(request.offsets):
+                    data.values[i] = chip.levels[offset]
+                self._sys.ioctl(request.fd, GPIOHANDLE_SET_LINE_VALUES_IOCTL,
+                                data, True)
+
+    def open_edge(self, pin, edge):
+        with self._lock:
+            chip_number, offset = divmod(pin, self.lines_per_chip)
+            chip = self._chip(chip_number)
+            self._drop_line(chip, offset)
+            req = gpioevent_request()
+            req.lineoffset = offset
+            req.handleflags = GPIOHANDLE_REQUEST_INPUT
+            req.eventflags = EDGE_FLAGS[edge]
+            req.consumer_label = b"nio"
+            self._sys.ioctl(chip.fd, GPIO_GET_LINEEVENT_IOCTL, req, True)
+            chip.events[offset] = req.fd
+            return _CdevEdgeSource(req.fd, self._sys, lambda: self._unwatch(
+                chip_number, offset, req.fd))
+
+    def release(self, pin):
+        with self._lock:
+            chip_number, offset = divmod(pin, self.lines_per_chip)
+            chip = self._chips.get(chip_number)
+            if chip is not None:
+                self._drop_line(chip, offset)
+
+    def _unwatch(self, chip_number, offset, fd):
+        with self._lock:
+            chip = self._chips.get(chip_number)
+            if chip is not None and chip.events.get(offset) == fd:
+                del chip.events[offset]
+
+    def close(self):
+        with self._lock:
+            for chip in self._chips.values():
+                for request in (chip.inputs, chip.outputs):
+                    if request is not None:
+                        self._close_fd(request.fd)
+                self._close_fd(chip.fd)
+            self._chips.clear()
+
+    def _group(self, pins):
+        chips = {}
+        for pin in pins:
+            chip_number, offset = divmod(pin, self.lines_per_chip)
+            chips.setdefault(chip_number, []).append(offset)
+        return chips
+
+    def _chip(self, chip_number):
+        chip = self._chips.get(chip_number)
+        if chip is None:
+            fd = self._sys.open(self.path.format(chip_number),
+                                os.O_RDONLY | os.O_CLOEXEC)
+            chip = self._chips[chip_number] = _Chip(fd)
+        return chip
+
+    def _request(self, chip, flags, offsets):
+        """Return a request in direction `flags` holding all `offsets`."""
+        inputs = flags == GPIOHANDLE_REQUEST_INPUT
+        current = chip.inputs if inputs else chip.outputs
+        if current is not None and \
+                all(offset in current.index for offset in offsets):
+            return current
+        # Lines can only be held by one request, take them out of the
+        # request for the other direction and close the current one
+        # before asking for the wider set.
+        for offset in offsets:
+            self._drop_line(chip, offset,
+                            GPIOHANDLE_REQUEST_OUTPUT if inputs else
+                            GPIOHANDLE_REQUEST_INPUT)
+        if current is None:
+            request = self._new_request(chip, flags, sorted(set(offsets)))
+            self._set_request(chip, flags, request)
+            return request
+        # Make sure the new lines are free, e.g. not held elsewhere, before
+        # giving up the ones already held
+        added = sorted(set(offsets).difference(current.index))
+        self._close_fd(self._new_request(chip, flags, added).fd)
+        self._set_request(chip, flags, None)
+        self._close_fd(current.fd)
+        try:
+            request = self._new_request(
+                chip, flags, sorted(set(offsets).union(current.offsets)))
+        except:
+            try:
+                self._set_request(chip, flags, self._new_request(
+                    chip, flags, current.offsets))
+            except:
+                self.logger.warning(
+                    "Failed to request GPIO lines {} again".format(
+                        current.offsets), exc_info=True)
+            raise
+        self._set_request(chip, flags, request)
+        return request
+
+    def _drop_line(self, chip, offset, flags=None):
+        for direction in (GPIOHANDLE_REQUEST_INPUT,
+                          GPIOHANDLE_REQUEST_OUTPUT):
+            if flags is not None and direction != flags:
+                continue
+            request = chip.inputs if direction == GPIOHANDLE_REQUEST_INPUT \
+                else chip.outputs
+            if request is None or offset not in request.index:
+                continue
+            self._set_request(chip, direction, None)
+            self._close_fd(request.fd)
+            remaining = [o for o in request.offsets if o != offset]
+            if remaining:
+                self._set_request(chip, direction,
+                                  self._new_request(chip, direction,
+                                                    remaining))
+
+    def _new_request(self, chip, flags, offsets):
+        req = gpiohandle_request()
+        req.flags = flags
+        req.lines = len(offsets)
+        req.consumer_label = b"nio"
+        for i, offset in enumerate(offsets):
+            req.lineoffsets[i] = offset
+            if flags == GPIOHANDLE_REQUEST_OUTPUT:
+                req.default_values[i] = chip.levels.get(offset, 0)
+        self._sys.ioctl(chip.fd, GPIO_GET_LINEHANDLE_IOCTL, req, True)
+        return _LineRequest(req.fd, list(offsets))
+
+    def _set_request(self, chip, flags, request):
+        if flags == GPIOHANDLE_REQUEST_INPUT:
+            chip.inputs = request
+        else:
+            chip.outputs = request
+
+    def _close_fd(self, fd):
+        try:
+            self._sys.close(fd)
+        except:
+            self.logger.warning(
+                "Failed to close GPIO descriptor {}".format(fd), exc_info=True)
+
+
+class _CdevEdgeSource():
+
+    """Edges of a line event request, timestamped by the kernel."""
+
+    events = select.EPOLLIN
+
+    # Most events taken from the kernel's queue per read
+    READ_EVENTS = 16
+
+    def __init__(self, fd, syscalls, on_close=None):
+        self.fd = fd
+        self._sys = syscalls
+        self._on_close = on_close
+        self._buf = bytearray(gpioevent_data.size * self.READ_EVENTS)
+        # Two 64 bit words per event, the timestamp first
+        self._words = memoryview(self._buf).cast("Q")
+
+    def read_events(self):
+        data = self._sys.read(self.fd, gpioevent_data.size * self.READ_EVENTS)
+        return [(timestamp / 1e9, event_id == GPIOEVENT_EVENT_RISING_EDGE)
+                for timestamp, event_id in gpioevent_data.iter_unpack(data)]
+
+    def count_into(self, counter, slot):
+        # Events are read into a preallocated buffer and their timestamps
+        # taken straight from it, no object is built per event.
+        events = self._sys.readv(self.fd, (self._buf,)) // gpioevent_data.size
+        words = self._words
+        for i in range(0, events * 2, 2):
+            counter.add(slot, words[i] / 1e9)
+
+    def close(self):
+        if self._on_close is not None:
+            self._on_close()
+        self._sys.close(self.fd)
+
+
+def default_backend(logger, max_handles=32, idle_timeout=60.0):
+    """Return the character device backend when the kernel provides it,
+    falling back to sysfs with a pin pool of the given settings."""
+    if CdevBackend.available():
+        return CdevBackend(logger)
+    return SysfsBackend(logger, max_handles, idle_timeout)
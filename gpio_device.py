@@ -1,24 +1,241 @@
-from enum import Enum
-from threading import Lock
-from nio.block.base import Block
-from nio.util.discovery import discoverable
-from nio.properties import IntProperty, VersionProperty, SelectProperty, \
-    ObjectProperty, PropertyHolder
+import os
+import select
+from contextlib import ExitStack
+from threading import Lock, Thread
+from nio.util.logging import get_nio_logger
+from .gpio_backends import default_backend
+from .metrics import metrics
 
 
-try:
-    from periphery import GPIO
-except:
-    # Let the block code load anyway so that som unit tests can run.
-    pass
+class GPIOManager():
 
-class GPIODevice():
+    """Process-wide owner of GPIO pins shared by every GPIO block.
+
+    Holds the GPIO backend and one lock per pin, so that operations on the
+    same pin are serialized across blocks while different pins are used in
+    parallel. Blocks get the shared manager through `GPIODevice`, which
+    holds a reference until it is closed; the pins are closed when the last
+    reference is released.
+
+    The manager also keeps `levels`, a shadow copy of the level last
+    written to each output pin, used to skip writes that would not change
+    the pin. It is only accessed with the pin's lock held.
+
+    Args:
+        logger: logger used by the backend
+        backend (GPIOBackend): backend to use instead of the default one,
+            the gpiochip character devices if present, otherwise sysfs
+        max_handles (int): most pins the default sysfs backend holds open
+        idle_timeout (float): seconds before the default sysfs backend
+            closes an unused pin, None keeps pins open
+
+    """
+
+    _shared = None
+    _refs_lock = Lock()
+
+    def __init__(self, logger, backend=None, max_handles=32,
+                 idle_timeout=60.0):
+        self.logger = logger
+        self.backend = backend if backend is not None \
+            else default_backend(logger, max_handles=max_handles,
+                                 idle_timeout=idle_timeout)
+        self.levels = {}
+        self._refs = 0
+        self._closed = False
+        self._pin_locks = {}
+        self._pin_locks_lock = Lock()
+
+    @classmethod
+    def shared(cls, **options):
+        """Return the process-wide manager with a new reference taken.
+
+        Args:
+            **options: `max_handles` and `idle_timeout` of the manager,
+                only used when the shared manager is created
+
+        """
+        with cls._refs_lock:
+            if cls._shared is None:
+                cls._shared = cls(get_nio_logger("GPIOManager"), **options)
+            cls._shared._refs += 1
+            return cls._shared
+
+    def retain(self):
+        """Take a reference to this manager."""
+        with self._refs_lock:
+            if self._closed:
+                raise RuntimeError("GPIO manager is closed")
+            self._refs += 1
+        return self
+
+    def release(self):
+        """Drop a reference, closing every pin once none are left."""
+        with self._refs_lock:
+            self._refs -= 1
+            if self._refs > 0:
+                return
+            if GPIOManager._shared is self:
+                GPIOManager._shared = None
+            self._closed = True
+        self.backend.close()
+
+    def pin_lock(self, pin):
+        """Return the lock serializing access to a pin."""
+        lock = self._pin_locks.get(pin)
+        if lock is None:
+            with self._pin_locks_lock:
+                lock = self._pin_locks.setdefault(pin, Lock())
+        return lock
+
+    def pin_locks(self, pins):
+        """Return a context manager holding the locks of several pins.
+
+        Locks are taken in pin order so that two callers locking
+        overlapping sets of pins cannot deadlock.
+
+        """
+        stack = ExitStack()
+        try:
+            for pin in sorted(set(pins)):
+                stack.enter_context(self.pin_lock(pin))
+        except:
+            stack.close()
+            raise
+        return stack
+
+
+class GPIOEdgeMonitor():
 
-    """Communicate with a device over GPIO."""
+    """Wait for edges on any number of pins with one thread.
+
+    The edge sources of all watched pins are registered in one epoll set,
+    so the thread sleeps in the kernel until an edge arrives on any of them
+    and costs nothing while the pins are idle. Callbacks are called on the
+    monitor thread as `callback(pin, value, timestamp)`. Pins added with
+    `add_counter` instead have their edges recorded with
+    `counter.add(slot, timestamp)` while holding `counter.lock`, without
+    building any per-edge objects.
+
+    Args:
+        logger: logger used to report callback failures
+
+    """
 
     def __init__(self, logger):
         self.logger = logger
-        self._gpio_lock = Lock()
+        self._epoll = select.epoll()
+        self._sources = {}
+        self._pins = {}
+        self._lock = Lock()
+        # Writing to the pipe wakes the thread up to stop
+        self._wake_r, self._wake_w = os.pipe()
+        self._epoll.register(self._wake_r, select.EPOLLIN)
+        self._stopped = False
+        self._thread = Thread(target=self._run, name="GPIOEdgeMonitor",
+                              daemon=True)
+        self._thread.start()
+
+    def add(self, pin, source, callback):
+        """Watch an edge source opened for a pin, replacing any previous.
+
+        A gpiochip line can only be held by one request, so callers remove
+        the pin before opening its new source.
+        """
+        self._add(pin, source, (callback, None, None))
+
+    def add_counter(self, pin, source, counter, slot):
+        """Count the edges of a source opened for a pin into a counter."""
+        self._add(pin, source, (None, counter, slot))
+
+    def _add(self, pin, source, sink):
+        self.remove(pin)
+        with self._lock:
+            self._sources[source.fd] = (pin, source) + sink
+            self._pins[pin] = source.fd
+            self._epoll.register(source.fd, source.events)
+
+    def remove(self, pin):
+        """Stop watching a pin and close its edge source."""
+        with self._lock:
+            fd = self._pins.pop(pin, None)
+            if fd is None:
+                return
+            source = self._sources.pop(fd)[1]
+            self._epoll.unregister(fd)
+        source.close()
+
+    def stop(self, timeout=1):
+        """Stop the thread and close every edge source."""
+        self._stopped = True
+        os.write(self._wake_w, b"\0")
+        self._thread.join(timeout)
+        for pin in list(self._pins):
+            self.remove(pin)
+        self._epoll.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _run(self):
+        while not self._stopped:
+            try:
+                events = self._epoll.poll()
+            except InterruptedError:
+                continue
+            for fd, _ in events:
+                if fd == self._wake_r:
+                    return
+                with self._lock:
+                    entry = self._sources.get(fd)
+                    if entry is None:
+                        continue
+                    pin, source, callback, counter, slot = entry
+                    try:
+                        if counter is not None:
+                            with counter.lock:
+                                source.count_into(counter, slot)
+                            continue
+                        edges = source.read_events()
+                    except:
+                        self.logger.warning(
+                            "Failed to read edges of GPIO pin {}".format(pin),
+                            exc_info=True)
+                        continue
+                metrics.count("gpio.edges", len(edges))
+                for timestamp, value in edges:
+                    try:
+                        callback(pin, value, timestamp)
+                    except:
+                        self.logger.exception(
+                            "GPIO interrupt callback failed for pin {}".format(
+                                pin))
+
+
+class GPIODevice():
+
+    """Communicate with a device over GPIO.
+
+    Pins are kept open between calls by a `GPIOManager` shared with every
+    other GPIO block in the process, unless a manager is given.
+
+    Writes of the level an output pin already has are skipped unless
+    forced. The last written level of a pin is forgotten as soon as the
+    pin is used as an input.
+
+    Args:
+        logger: logger of the owning block
+        manager (GPIOManager): manager to use instead of the shared one
+
+    """
+
+    def __init__(self, logger, manager=None):
+        self.logger = logger
+        if manager is None:
+            self._manager = GPIOManager.shared()
+        else:
+            self._manager = manager.retain()
+        self._backend = self._manager.backend
+        self._monitor = None
 
     def read(self, pin):
         """Read bool value from a pin.
@@ -30,58 +247,159 @@ class GPIODevice():
             bool: value of digital pin reading
 
         """
-        with self._gpio_lock:
-            gpio_pin = GPIO(pin, "in")
-            value = gpio_pin.read()
-            gpio_pin.close()
-            self.logger.debug(
-                "Read value from GPIO pin {}: {}".format(pin, value))
-        return bool(value)
-
-    def write(self, pin, value):
+        start = metrics.start()
+        with self._manager.pin_lock(pin):
+            start = metrics.observe_since("gpio.lock_wait", start)
+            self._manager.levels.pop(pin, None)
+            value = self._backend.read(pin)
+            metrics.observe_since("gpio.read", start)
+            self.logger.debug("Read value from GPIO pin %s: %s", pin, value)
+        return value
+
+    def write(self, pin, value, force=False):
         """Write bool value to a pin.
 
         Args:
             pin (int): the pin to write to
             value (bool): boolean value to write to pin
+            force (bool): write even if the pin already has the value
+
+        Return:
+            bool: whether the pin was written
 
         """
-        with self._gpio_lock:
-            gpio_pin = GPIO(pin, "preserve")
-            if value:
-                gpio_pin.direction = "high"
-            else:
-                gpio_pin.direction = "low"
-            gpio_pin.close()
-            self.logger.debug(
-                "Wrote value to GPIO pin {}: {}".format(pin, value))
-
-    def interrupt(self, callback, pin, interrupt_trigger=None, timeout=0):
+        value = bool(value)
+        levels = self._manager.levels
+        start = metrics.start()
+        with self._manager.pin_lock(pin):
+            start = metrics.observe_since("gpio.lock_wait", start)
+            if not force and levels.get(pin) is value:
+                metrics.count("gpio.writes_skipped")
+                return False
+            levels.pop(pin, None)
+            self._backend.write(pin, value)
+            levels[pin] = value
+            metrics.observe_since("gpio.write", start)
+            self.logger.debug("Wrote value to GPIO pin %s: %s", pin, value)
+        return True
+
+    def read_many(self, pins):
+        """Read bool values from several pins.
+
+        With the gpiochip backend the pins of each chip are read together
+        in one call.
+
+        Args:
+            pins (iterable): the pins to read from
+
+        Return:
+            dict: value of each pin, keyed by pin
+
+        """
+        pins = list(pins)
+        start = metrics.start()
+        with self._manager.pin_locks(pins):
+            start = metrics.observe_since("gpio.lock_wait", start)
+            for pin in pins:
+                self._manager.levels.pop(pin, None)
+            values = self._backend.read_many(pins)
+            metrics.observe_since("gpio.read_many", start)
+            metrics.count("gpio.pins_read", len(pins))
+            self.logger.debug("Read values from GPIO pins: %s", values)
+        return values
+
+    def write_many(self, values, force=False):
+        """Write bool values to several pins.
+
+        With the gpiochip backend the pins of each chip are written
+        together in one call.
+
+        Args:
+            values (dict): value to write, keyed by pin
+            force (bool): write pins even if they already have the value
+
+        Return:
+            int: number of pins written
+
+        """
+        levels = self._manager.levels
+        start = metrics.start()
+        with self._manager.pin_locks(values):
+            start = metrics.observe_since("gpio.lock_wait", start)
+            changed = {pin: bool(value) for pin, value in values.items()
+                       if force or levels.get(pin) is not bool(value)}
+            metrics.count("gpio.writes_skipped", len(values) - len(changed))
+            if not changed:
+                return 0
+            for pin in changed:
+                levels.pop(pin, None)
+            self._backend.write_many(changed)
+            levels.update(changed)
+            metrics.observe_since("gpio.write_many", start)
+            metrics.count("gpio.pins_written", len(changed))
+            self.logger.debug("Wrote values to GPIO pins: %s", changed)
+        return len(changed)
+
+    def interrupt(self, callback, pin, interrupt_trigger="both"):
         """Init interrupt callback function for pin.
 
+        The pin is watched by the device's `GPIOEdgeMonitor` thread, which
+        calls `callback(pin, value, timestamp)` for every edge until the
+        device is closed or `remove_interrupt` is called for the pin.
+
         Args:
             callback (function): function to call on interrupt
             pin (int): the pin to monitor for interrupts
+            interrupt_trigger (str): "rising", "falling" or "both"
+
+        """
+        with self._manager.pin_lock(pin):
+            source = self._open_edge(pin, interrupt_trigger)
+            self._monitor.add(pin, source, callback)
+            self.logger.debug("Set interrupt callback of GPIO pin %s", pin)
+
+    def count_pulses(self, pin, edge, counter, slot):
+        """Count the edges of a pin into a counter.
+
+        Like `interrupt`, but edges are recorded by the monitor thread with
+        `counter.add(slot, timestamp)` instead of a callback per edge.
+
+        Args:
+            pin (int): the pin to count edges of
+            edge (str): "rising", "falling" or "both"
+            counter: object with a `lock` and an `add(slot, timestamp)`
+            slot (int): index passed to `counter.add` for this pin
+
+        """
+        with self._manager.pin_lock(pin):
+            source = self._open_edge(pin, edge)
+            self._monitor.add_counter(pin, source, counter, slot)
+
+    def _open_edge(self, pin, edge):
+        """Open an edge source for a pin, with the pin's lock held.
 
+        A source already watching the pin is closed first, as a line of a
+        gpiochip character device can only be held by one request.
         """
-        with self._gpio_lock:
-            gpio_pin = GPIO(pin, "preserve")
-            if gpio_pin.supports_interrupts:
-                gpio_pin.direction = "in"
-                gpio_pin.edge = interrupt_trigger
-                if gpio_pin.poll(timeout):
-                    # Enter callback function
-                    pass
-                gpio_pin.edge = "none" #need to set to none inorder to reuse pin for anything else
-            else:
-                self.logger.error("GPIO pin {} does not support interrupts".format(pin))
-            
-            self.logger.debug(
-                "Set interrupt callback of GPIO pin {}".format(pin))
+        self._manager.levels.pop(pin, None)
+        if self._monitor is None:
+            self._monitor = GPIOEdgeMonitor(self.logger)
+        self._monitor.remove(pin)
+        return self._backend.open_edge(pin, edge)
 
+    def remove_interrupt(self, pin):
+        """Stop watching a pin for interrupts."""
+        with self._manager.pin_lock(pin):
+            if self._monitor is not None:
+                self._monitor.remove(pin)
 
     def close(self):
         try:
-            pass
+            if self._monitor is not None:
+                monitor, self._monitor = self._monitor, None
+                monitor.stop()
+            if self._manager is not None:
+                manager, self._manager = self._manager, None
+                manager.release()
         except:
             self.logger.warning("Failed to close GPIO", exc_info=True)
@@ -1,11 +1,16 @@
+from datetime import timedelta
 from enum import Enum
 from threading import Lock
 from nio.block.base import Block
+from nio.command import command
+from nio.modules.scheduler import Job
 from nio.signal.base import Signal
 from nio.util.discovery import discoverable
 from nio.properties import IntProperty, VersionProperty, SelectProperty, \
-    ObjectProperty, PropertyHolder
+    ObjectProperty, PropertyHolder, Property, FloatProperty, BoolProperty, \
+    ListProperty
 from .gpio_device import GPIODevice
+from .gpio_read_block import parse_pins
 
 
 class TriggerOptions(Enum):
@@ -21,34 +26,166 @@ class Trigger(PropertyHolder):
     # TODO: add ability to select base on pin number
 
 
+class PinDebounce(PropertyHolder):
+    pin = IntProperty(default=0, title="Pin Number")
+    window = FloatProperty(default=0, title="Debounce Window (seconds)")
+
+
+class Coalesce(PropertyHolder):
+    enabled = BoolProperty(default=False, title="Coalesce Edges")
+    interval = FloatProperty(default=1, title="Batch Interval (seconds)")
+    max_edges = IntProperty(default=0, title="Max Edges per Batch (0: none)")
+
+
 @discoverable
+@command("stats")
 class GPIOInterrupts(Block):
 
+    """Notify a signal for every edge on the configured pins.
+
+    Signals hold the `pin`, its `value` after the edge and the `timestamp`
+    of the edge in seconds. With the gpiochip backend the timestamp is
+    taken by the kernel when the edge happens, with sysfs it is the time
+    the edge was read.
+
+    Edges closer to the last reported edge of a pin than its debounce
+    window are dropped. When coalescing, edges are counted per pin and
+    notified together once per interval, or as soon as `max_edges` edges
+    are pending, as one signal per pin holding the `count` of edges, the
+    `first_timestamp` and `last_timestamp`, the last `value` and the
+    number of edges `debounced` in the batch.
+
+    """
+
     pin = IntProperty(default=0, title="Pin Number")
-    version = VersionProperty('0.1.0')
+    pins = Property(title="Pin List (e.g. 0-7, 12)", default="",
+                    allow_none=True)
+    version = VersionProperty('0.2.0')
     interrupt_trigger = ObjectProperty(Trigger,
                                   title="Trigger on which edge:",
                                   default=Trigger())
+    debounce = FloatProperty(default=0, title="Debounce Window (seconds)")
+    pin_debounce = ListProperty(PinDebounce, title="Per-Pin Debounce",
+                                default=[])
+    coalesce = ObjectProperty(Coalesce, title="Coalescing",
+                              default=Coalesce())
 
     def __init__(self):
         super().__init__()
         self._gpio = None
+        self._windows = {}
+        self._last_edge = {}
+        # pin -> [count, first timestamp, last timestamp, value, debounced]
+        self._batch = {}
+        self._batch_edges = 0
+        self._batch_lock = Lock()
+        self._flush_job = None
+        self._max_edges = 0
+        self._edges = 0
+        self._debounced = 0
+        self._folded = 0
+        self._batches = 0
 
     def configure(self, context):
         super().configure(context)
         self._gpio = GPIODevice(self.logger)
-        # TODO: allow more than one pin to be configured per block
-        self._gpio.interrupt(
-            self._callback, self.pin(), self.interrupt_trigger().default().value)
+        default = self.debounce()
+        overrides = {p.pin(): p.window() for p in self.pin_debounce()}
+        self._windows = {pin: overrides.get(pin, default)
+                         for pin in self._pins()}
+        self._max_edges = self.coalesce().max_edges()
+
+    def start(self):
+        super().start()
+        if self.coalesce().enabled():
+            self._flush_job = Job(
+                self._flush,
+                timedelta(seconds=self.coalesce().interval()), True)
+        trigger = self.interrupt_trigger().default().value
+        callback = self._coalesce if self.coalesce().enabled() \
+            else self._callback
+        for pin in self._pins():
+            self._gpio.interrupt(callback, pin, trigger)
 
     def stop(self):
         self._gpio.close()
+        if self._flush_job is not None:
+            self._flush_job.cancel()
+            self._flush_job = None
+            self._flush()
         super().stop()
 
+    def stats(self):
+        """Return counts of edges seen, dropped and folded into batches."""
+        return {"edges": self._edges,
+                "debounced": self._debounced,
+                "folded": self._folded,
+                "batches": self._batches}
+
     def process_signals(self, signals):
         pass
 
-    def _callback(self, channel):
-        self.logger.debug(
-            "Interrupt callback invoked by pin: {}".format(channel))
-        self.notify_signals(Signal({"pin": channel}))
+    def _pins(self):
+        pins = self.pins()
+        if pins is None or pins == "":
+            return [self.pin()]
+        return parse_pins(pins)
+
+    def _bounced(self, pin, timestamp):
+        """Count an edge and return whether it falls in the pin's debounce
+        window, otherwise starting a new window."""
+        self._edges += 1
+        window = self._windows.get(pin, 0)
+        if window > 0:
+            last = self._last_edge.get(pin)
+            if last is not None and 0 <= timestamp - last < window:
+                self._debounced += 1
+                return True
+            self._last_edge[pin] = timestamp
+        return False
+
+    def _callback(self, channel, value, timestamp):
+        if self._bounced(channel, timestamp):
+            return
+        self.logger.debug("Interrupt callback invoked by pin: %s", channel)
+        self.notify_signals([Signal({"pin": channel,
+                                     "value": value,
+                                     "timestamp": timestamp})])
+
+    def _coalesce(self, channel, value, timestamp):
+        with self._batch_lock:
+            entry = self._batch.get(channel)
+            if entry is None:
+                entry = self._batch[channel] = [0, None, None, value, 0]
+            if self._bounced(channel, timestamp):
+                entry[4] += 1
+                return
+            if entry[0] == 0:
+                entry[1] = timestamp
+            entry[0] += 1
+            entry[2] = timestamp
+            entry[3] = value
+            self._batch_edges += 1
+            full = 0 < self._max_edges <= self._batch_edges
+        if full:
+            self._flush()
+
+    def _flush(self):
+        with self._batch_lock:
+            batch, self._batch = self._batch, {}
+            self._batch_edges = 0
+        # Pins whose edges were all debounced have nothing to notify
+        batch = {pin: entry for pin, entry in batch.items() if entry[0]}
+        if not batch:
+            return
+        self._batches += 1
+        self._folded += sum(max(entry[0] - 1, 0) for entry in batch.values())
+        self.notify_signals([
+            Signal({"pin": pin,
+                    "value": value,
+                    "count": count,
+                    "first_timestamp": first,
+                    "last_timestamp": last,
+                    "debounced": debounced})
+            for pin, (count, first, last, value, debounced)
+            in sorted(batch.items())])
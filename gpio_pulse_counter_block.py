@@ -0,0 +1,160 @@
+import time
+from array import array
+from datetime import timedelta
+from enum import Enum
+from threading import Lock
+from nio.block.base import Block
+from nio.modules.scheduler import Job
+from nio.signal.base import Signal
+from nio.util.discovery import discoverable
+from nio.properties import IntProperty, VersionProperty, SelectProperty, \
+    Property, FloatProperty, BoolProperty
+from .gpio_device import GPIODevice
+from .gpio_read_block import parse_pins
+
+
+class EdgeOptions(Enum):
+    RISING = 'rising'
+    FALLING = 'falling'
+    BOTH = 'both'
+
+
+class PulseAccumulator():
+
+    """Edge counts and recent edge times of a fixed set of pins.
+
+    Each pin has a slot in flat arrays: a running edge count and a ring
+    buffer of its last `ring_size` edge timestamps. Recording an edge only
+    stores numbers into the arrays. `add` is called with `lock` held.
+
+    Args:
+        slots (int): number of pins
+        ring_size (int): edge timestamps kept per pin
+
+    """
+
+    def __init__(self, slots, ring_size=256):
+        self.lock = Lock()
+        self.ring_size = ring_size
+        self.counts = array("Q", bytes(8 * slots))
+        self.times = array("d", bytes(8 * slots * ring_size))
+        # number of edges counted at the last report of each slot
+        self._reported = array("Q", bytes(8 * slots))
+        self._report_time = array("d", [time.monotonic()] * slots)
+
+    def add(self, slot, timestamp):
+        count = self.counts[slot]
+        self.times[slot * self.ring_size + count % self.ring_size] = timestamp
+        self.counts[slot] = count + 1
+
+    def report(self, slot, reset=True):
+        """Return statistics of the edges of a slot since its last report.
+
+        Args:
+            slot (int): the slot to report
+            reset (bool): start the next report from now
+
+        Return:
+            dict: `count` and `total` edges, `frequency` in Hz over the
+                time since the last report, and `interval_min`,
+                `interval_mean` and `interval_max` between the edges still
+                held in the ring buffer, in seconds, or None
+
+        """
+        now = time.monotonic()
+        with self.lock:
+            total = self.counts[slot]
+            count = total - self._reported[slot]
+            # edge times since the last report, oldest first
+            held = min(count, self.ring_size)
+            base = slot * self.ring_size
+            times = [self.times[base + i % self.ring_size]
+                     for i in range(total - held, total)]
+            elapsed = now - self._report_time[slot]
+            if reset:
+                self._reported[slot] = total
+                self._report_time[slot] = now
+        intervals = [b - a for a, b in zip(times, times[1:])]
+        return {
+            "count": count,
+            "total": total,
+            "frequency": count / elapsed if elapsed > 0 else None,
+            "interval_min": min(intervals) if intervals else None,
+            "interval_mean":
+                sum(intervals) / len(intervals) if intervals else None,
+            "interval_max": max(intervals) if intervals else None,
+        }
+
+
+@discoverable
+class GPIOPulseCounter(Block):
+
+    """Count pulses on GPIO inputs in the background.
+
+    Edges are counted by the GPIO monitor thread as they happen, so no
+    pulse is missed between signals. Each incoming signal gets a `pulses`
+    attribute, and with a report interval a signal holding `pulses` is
+    notified periodically. `pulses` holds per pin the number of edges and
+    the frequency since the last report, the total count, and the minimum,
+    mean and maximum time between the edges kept in the pin's buffer.
+
+    """
+
+    pin = IntProperty(default=0, title="Pin Number")
+    pins = Property(title="Pin List (e.g. 0-7, 12)", default="",
+                    allow_none=True)
+    edge = SelectProperty(EdgeOptions, title="Count Edge",
+                          default=EdgeOptions.RISING)
+    report_interval = FloatProperty(
+        default=0, title="Report Interval (seconds, 0: none)")
+    ring_size = IntProperty(default=256, title="Edge Times Kept per Pin")
+    reset_on_report = BoolProperty(default=True, title="Reset on Report")
+    version = VersionProperty('0.1.0')
+
+    def __init__(self):
+        super().__init__()
+        self._gpio = None
+        self._pins = []
+        self._counter = None
+        self._job = None
+
+    def configure(self, context):
+        super().configure(context)
+        self._gpio = GPIODevice(self.logger)
+        pins = self.pins()
+        pins = [self.pin()] if pins is None or pins == "" \
+            else parse_pins(pins)
+        # A pin listed twice is counted once, a line can only be watched
+        # by one request
+        self._pins = list(dict.fromkeys(pins))
+        self._counter = PulseAccumulator(len(self._pins), self.ring_size())
+
+    def start(self):
+        super().start()
+        for slot, pin in enumerate(self._pins):
+            self._gpio.count_pulses(
+                pin, self.edge().value, self._counter, slot)
+        if self.report_interval() > 0:
+            self._job = Job(self._report,
+                            timedelta(seconds=self.report_interval()), True)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        self._gpio.close()
+        super().stop()
+
+    def process_signals(self, signals):
+        pulses = self._pulses()
+        for signal in signals:
+            signal.pulses = pulses
+        self.notify_signals(signals)
+
+    def _report(self):
+        self.notify_signals([Signal({"pulses": self._pulses()})])
+
+    def _pulses(self):
+        reset = self.reset_on_report()
+        return {pin: self._counter.report(slot, reset)
+                for slot, pin in enumerate(self._pins)}
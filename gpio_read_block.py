@@ -1,10 +1,12 @@
 from enum import Enum
 from threading import Lock
 from nio.block.base import Block
+from nio.signal.base import Signal
 from nio.util.discovery import discoverable
 from nio.properties import IntProperty, VersionProperty, SelectProperty, \
-    ObjectProperty, PropertyHolder
+    ObjectProperty, PropertyHolder, Property, FloatProperty
 from .gpio_device import GPIODevice
+from .gpio_sampler import GPIOSampler
 
 
 """
@@ -22,29 +24,179 @@ class PullUpDown(PropertyHolder):
     # TODO: add ability to select base on pin number
 """
 
+class PinsFormat(Enum):
+    DICT = 'dict'
+    MASK = 'mask'
+
+
+class SampleMode(Enum):
+    WINDOW = 'window'
+    CHANGES = 'changes'
+
+
+def parse_pins(pins):
+    """Return the pins of a pin list as a list of ints.
+
+    Args:
+        pins: an int, a list of ints, or a string of comma separated pins
+            and inclusive ranges such as "0-7, 12, 14-15"
+
+    """
+    if isinstance(pins, int):
+        return [pins]
+    if isinstance(pins, str):
+        result = []
+        for part in pins.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            first, sep, last = part.partition("-")
+            if sep:
+                first, last = int(first), int(last)
+                if last < first:
+                    raise ValueError("Invalid pin range: {}".format(part))
+                result.extend(range(first, last + 1))
+            else:
+                result.append(int(first))
+        return result
+    return [int(pin) for pin in pins]
+
+
 @discoverable
 class GPIORead(Block):
 
+    """Read GPIO pins and set their values on each signal.
+
+    With no pin list the value of `pin` is set as the signal `value`.
+    Otherwise `value` holds the pins of the list as a dict of pin to bool,
+    or as an int with bit `i` set to the value of the `i`-th pin of the
+    list. All pins needed by a batch of signals are read together once.
+
+    With a sample rate the block also samples its pins on its own, without
+    signal expressions, on a background `GPIOSampler`. In window mode a
+    signal is notified for every `window_size` samples holding the
+    `timestamps` and `samples` as bit masks of the pin list, along with the
+    number of `overruns`, ticks skipped because sampling fell behind. In
+    changes mode a signal is notified for each sample that differs from
+    the previous one, holding its `timestamp`, the `value` of every pin as
+    configured by the pin list output, and the `changed` pins.
+
+    """
+
     pin = IntProperty(default=0, title="Pin Number")
-    version = VersionProperty('0.1.0')
+    pins = Property(title="Pin List (e.g. 0-7, 12)", default="",
+                    allow_none=True)
+    pins_format = SelectProperty(PinsFormat, title="Pin List Output",
+                                 default=PinsFormat.DICT)
+    sample_rate = FloatProperty(default=0,
+                                title="Sample Rate (Hz, 0: on signals only)")
+    sample_mode = SelectProperty(SampleMode, title="Sample Output",
+                                 default=SampleMode.CHANGES)
+    window_size = IntProperty(default=100, title="Samples per Window")
+    version = VersionProperty('0.3.0')
 
     def __init__(self):
         super().__init__()
         self._gpio = None
+        self._sampler = None
+        self._sample_pins = []
 
     def configure(self, context):
         super().configure(context)
         self._gpio = GPIODevice(self.logger)
 
+    def start(self):
+        super().start()
+        if self.sample_rate() > 0:
+            pins = self.pins()
+            self._sample_pins = [self.pin()] if pins is None or pins == "" \
+                else parse_pins(pins)
+            if self.sample_mode() is SampleMode.WINDOW:
+                callbacks = {"on_window": self._sample_window}
+            else:
+                callbacks = {"on_change": self._sample_change}
+            self._sampler = GPIOSampler(
+                self._gpio, self._sample_pins, self.sample_rate(),
+                self.window_size(), self.logger, **callbacks).start()
+
     def stop(self):
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
         self._gpio.close()
         super().stop()
 
     def process_signals(self, signals):
+        requests = []
+        wanted = set()
         for signal in signals:
-            signal.value = self._read_gpio_pin(self.pin(signal))
+            pins = self._signal_pins(signal)
+            requests.append(pins)
+            if pins is not None:
+                wanted.update(pins if isinstance(pins, list) else (pins,))
+        values = self._read_gpio_pins(wanted)
+        mask = self.pins_format() is PinsFormat.MASK
+        for signal, pins in zip(signals, requests):
+            if pins is None:
+                signal.value = None
+            elif not isinstance(pins, list):
+                signal.value = values.get(pins)
+            elif mask:
+                signal.value = self._to_mask(pins, values)
+            else:
+                signal.value = {pin: values.get(pin) for pin in pins}
         self.notify_signals(signals)
 
+    def _signal_pins(self, signal):
+        """Return the pin list of a signal, or its single pin as an int."""
+        try:
+            pins = self.pins(signal)
+            if pins is None or pins == "":
+                return self.pin(signal)
+            return parse_pins(pins)
+        except:
+            self.logger.warning("Invalid gpio pins for signal: {}".format(
+                signal), exc_info=True)
+
+    def _read_gpio_pins(self, pins):
+        if not pins:
+            return {}
+        try:
+            return self._gpio.read_many(pins)
+        except:
+            # Read the pins one by one so a bad pin only loses its own value
+            self.logger.warning("Failed to read gpio pins: {}".format(
+                sorted(pins)), exc_info=True)
+            return {pin: self._read_gpio_pin(pin) for pin in pins}
+
+    def _sample_window(self, timestamps, samples, overruns):
+        self.notify_signals([Signal({"pins": self._sample_pins,
+                                     "timestamps": timestamps,
+                                     "samples": samples,
+                                     "overruns": overruns})])
+
+    def _sample_change(self, timestamp, sample, changed):
+        pins = self._sample_pins
+        if self.pins_format() is PinsFormat.MASK:
+            value = sample
+        else:
+            value = {pin: bool(sample >> i & 1) for i, pin in enumerate(pins)}
+        self.notify_signals([Signal({
+            "timestamp": timestamp,
+            "value": value,
+            "changed": [pin for i, pin in enumerate(pins)
+                        if changed >> i & 1]})])
+
+    @staticmethod
+    def _to_mask(pins, values):
+        if any(values.get(pin) is None for pin in pins):
+            return None
+        mask = 0
+        for bit, pin in enumerate(pins):
+            if values[pin]:
+                mask |= 1 << bit
+        return mask
+
     def _read_gpio_pin(self, pin):
         try:
             return self._gpio.read(pin)
@@ -0,0 +1,117 @@
+import time
+from array import array
+from threading import Event, Thread
+
+
+class GPIOSampler():
+
+    """Sample a set of pins at a fixed rate on its own thread.
+
+    Each sample is the value of all pins packed into one int, bit `i`
+    holding the `i`-th pin, and stored with its time in preallocated
+    arrays. Ticks are scheduled against absolute deadlines from the start,
+    so the rate does not drift; ticks missed because a read took too long
+    are skipped and counted as overruns instead of being run late in a
+    burst.
+
+    With `on_window` set, `on_window(timestamps, samples, overruns)` is
+    called with lists of the last `window_size` samples each time the
+    buffer fills. With `on_change` set, `on_change(timestamp, sample,
+    changed)` is called for every sample that differs from the previous
+    one, `changed` having the bits of the pins that changed set.
+
+    Args:
+        gpio (GPIODevice): device to read with
+        pins (list): the pins to sample, at most 64
+        rate (float): samples per second
+        window_size (int): samples per window
+        logger: logger of the owning block
+        on_window (function): called with each full window
+        on_change (function): called with each changed sample
+
+    """
+
+    def __init__(self, gpio, pins, rate, window_size, logger,
+                 on_window=None, on_change=None):
+        if not 0 < len(pins) <= 64:
+            raise ValueError("Can sample 1 to 64 pins, got {}".format(
+                len(pins)))
+        if not rate > 0:
+            raise ValueError("Sample rate must be positive, got {}".format(
+                rate))
+        if window_size < 1:
+            raise ValueError("Window size must be at least 1, got {}".format(
+                window_size))
+        self.gpio = gpio
+        self.pins = list(pins)
+        self.period = 1 / rate
+        self.window_size = window_size
+        self.logger = logger
+        self.on_window = on_window
+        self.on_change = on_change
+        self.overruns = 0
+        self._timestamps = array("d", bytes(8 * window_size))
+        self._samples = array("Q", bytes(8 * window_size))
+        self._stop = Event()
+        self._thread = Thread(target=self._run, daemon=True,
+                              name="GPIOSampler")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=1):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        pins = self.pins
+        bits = [1 << i for i in range(len(pins))]
+        index = 0
+        window_overruns = 0
+        previous = None
+        start = time.monotonic()
+        tick = 0
+        while not self._stop.is_set():
+            deadline = start + tick * self.period
+            delay = deadline - time.monotonic()
+            if delay > 0 and self._stop.wait(delay):
+                break
+            try:
+                values = self.gpio.read_many(pins)
+            except:
+                self.logger.warning("Failed to sample gpio pins: {}".format(
+                    pins), exc_info=True)
+                values = None
+            now = time.time()
+            if values is not None:
+                sample = 0
+                for pin, bit in zip(pins, bits):
+                    if values[pin]:
+                        sample |= bit
+                self._record(now, sample, previous, index, window_overruns)
+                previous = sample
+                index += 1
+                if index == self.window_size:
+                    index = 0
+                    window_overruns = 0
+            # Skip the ticks that have already passed
+            tick += 1
+            late = int((time.monotonic() - start) / self.period) - tick
+            if late > 0:
+                tick += late
+                self.overruns += late
+                window_overruns += late
+
+    def _record(self, now, sample, previous, index, overruns):
+        self._timestamps[index] = now
+        self._samples[index] = sample
+        try:
+            if self.on_change is not None and previous is not None and \
+                    sample != previous:
+                self.on_change(now, sample, sample ^ previous)
+            if self.on_window is not None and index == self.window_size - 1:
+                self.on_window(self._timestamps.tolist(),
+                               self._samples.tolist(), overruns)
+        except:
+            self.logger.exception("Failed to emit gpio samples")
@@ -0,0 +1,168 @@
+import os
+import time
+from array import array
+from threading import Event, Thread
+
+# Shortest step the waveform thread can be expected to meet, writes and
+# wake ups take a good part of a millisecond on the target
+MIN_STEP = 0.001
+# Most of each step spent spinning before the next deadline
+MAX_SPIN_SHARE = 0.25
+
+
+def parse_waveform(spec):
+    """Return the steps and repeat count described by a waveform spec.
+
+    Args:
+        spec: a list of `[level, seconds]` steps, a dict with `steps` and
+            an optional `repeat` count, or a dict with `frequency` in Hz,
+            an optional `duty` cycle (default 0.5) and `cycles` (default 1)
+
+    Return:
+        tuple: list of `(bool, float)` steps and the number of times to
+            run them
+
+    Raises:
+        ValueError: if the spec is invalid or has a step shorter than
+            `MIN_STEP`, other than an empty one
+
+    """
+    if isinstance(spec, dict) and "frequency" in spec:
+        frequency = float(spec["frequency"])
+        duty = float(spec.get("duty", 0.5))
+        if frequency <= 0 or not 0 <= duty <= 1:
+            raise ValueError("Invalid waveform: {}".format(spec))
+        period = 1 / frequency
+        steps = [(True, period * duty), (False, period * (1 - duty))]
+        steps = [step for step in steps if step[1] > 0]
+        repeat = int(spec.get("cycles", 1))
+    else:
+        repeat = 1
+        if isinstance(spec, dict):
+            repeat = int(spec.get("repeat", 1))
+            spec = spec["steps"]
+        steps = [(bool(level), float(duration)) for level, duration in spec]
+        if not steps or any(duration < 0 for _, duration in steps):
+            raise ValueError("Invalid waveform steps: {}".format(spec))
+    if any(0 < duration < MIN_STEP for _, duration in steps):
+        raise ValueError("Waveform steps shorter than {}s: {}".format(
+            MIN_STEP, spec))
+    return steps, repeat
+
+
+class WaveformRunner():
+
+    """Drive a pin through a sequence of timed levels on its own thread.
+
+    Every step is scheduled against an absolute deadline from the start so
+    that timing errors do not accumulate. The thread sleeps until shortly
+    before each deadline and spins for the rest, at most a quarter of each
+    step so that other threads still get the CPU. It can ask for real-time
+    scheduling, which is only granted to privileged processes and starves
+    every other thread while it spins. The pin handle stays open in the
+    GPIO pool for the whole waveform.
+
+    When the waveform ends or is cancelled `on_done(pin, stats)` is called
+    from the thread, `stats` holding the number of `steps` written, whether
+    it was `cancelled`, the `duration` in seconds and the `jitter` of the
+    writes against their deadlines: `mean`, `p99` and `max` in seconds.
+
+    Args:
+        gpio (GPIODevice): device to write with
+        pin (int): the pin to drive
+        steps (list): `(level, seconds)` steps
+        repeat (int): number of times to run the steps
+        on_done (function): called when the waveform stops
+        logger: logger of the owning block
+        spin (float): seconds before a deadline to stop sleeping
+        priority (int): SCHED_FIFO priority to ask for, 0 to not ask
+
+    """
+
+    def __init__(self, gpio, pin, steps, repeat, on_done, logger,
+                 spin=0.002, priority=0):
+        self.gpio = gpio
+        self.pin = pin
+        self.steps = steps
+        self.repeat = repeat
+        self.on_done = on_done
+        self.logger = logger
+        self.spin = spin
+        self.priority = priority
+        self._cancel = Event()
+        self._thread = Thread(target=self._run, daemon=True,
+                              name="GPIOWaveform-{}".format(pin))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def cancel(self, wait=True):
+        """Stop the waveform after the current step."""
+        self._cancel.set()
+        if wait and self._thread.is_alive():
+            self._thread.join()
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def _run(self):
+        self._raise_priority()
+        jitter = array("d")
+        start = deadline = time.perf_counter()
+        spin = 0
+        try:
+            for _ in range(self.repeat):
+                for level, duration in self.steps:
+                    if not self._wait_until(deadline, spin):
+                        break
+                    late = time.perf_counter() - deadline
+                    self.gpio.write(self.pin, level)
+                    jitter.append(late)
+                    deadline += duration
+                    spin = min(self.spin, duration * MAX_SPIN_SHARE)
+                else:
+                    continue
+                break
+            else:
+                # Hold the last level for its whole duration
+                self._wait_until(deadline, spin)
+        except:
+            self.logger.exception(
+                "Waveform on gpio pin {} failed".format(self.pin))
+        self.on_done(self.pin, self._stats(jitter, start))
+
+    def _wait_until(self, deadline, spin):
+        """Wait for a deadline, spinning for the last `spin` seconds,
+        return False if cancelled first."""
+        remaining = deadline - time.perf_counter()
+        if remaining > spin and self._cancel.wait(remaining - spin):
+            return False
+        while time.perf_counter() < deadline:
+            pass
+        return not self._cancel.is_set()
+
+    def _raise_priority(self):
+        if not self.priority or not hasattr(os, "sched_setscheduler"):
+            return
+        try:
+            # pid 0 is the calling thread on Linux
+            os.sched_setscheduler(0, os.SCHED_FIFO,
+                                  os.sched_param(self.priority))
+        except OSError:
+            self.logger.debug("No real-time priority for waveform thread")
+
+    def _stats(self, jitter, start):
+        ordered = sorted(jitter)
+        return {
+            "steps": len(jitter),
+            "cancelled": self._cancel.is_set(),
+            "duration": time.perf_counter() - start,
+            "jitter": {
+                "mean": sum(ordered) / len(ordered) if ordered else None,
+                "p99": ordered[min(len(ordered) - 1,
+                                   int(len(ordered) * 0.99))]
+                if ordered else None,
+                "max": ordered[-1] if ordered else None,
+            },
+        }
@@ -1,38 +1,166 @@
+from collections import OrderedDict
 from enum import Enum
+from functools import partial
 from threading import Lock
 from nio.block.base import Block
+from nio.command import command
+from nio.command.params.int import IntParameter
+from nio.signal.base import Signal
 from nio.util.discovery import discoverable
-from nio.properties import IntProperty, VersionProperty, Property
+from nio.properties import IntProperty, VersionProperty, Property, \
+    BoolProperty, FloatProperty, ObjectProperty, PropertyHolder
 from .gpio_device import GPIODevice
+from .gpio_waveform import WaveformRunner, parse_waveform
+
+
+class WaveformTiming(PropertyHolder):
+    spin = FloatProperty(default=0.002,
+                         title="Spin Before Each Step (seconds)")
+    priority = IntProperty(default=0,
+                           title="Real-Time Priority (0: none, 1-99)")
 
 
 @discoverable
+@command("stats")
+@command("cancel", IntParameter("pin", default=None, allow_none=True))
 class GPIOWrite(Block):
 
+    """Write a value to a GPIO pin for each signal.
+
+    A batch of signals is collapsed into the last value of each pin before
+    anything is written, and pins already at that value are left alone
+    unless writes are forced. The `stats` command reports how many writes
+    were made and how many were skipped either way.
+
+    A signal with a waveform instead starts driving its pin through the
+    waveform on a dedicated thread, replacing any waveform running on the
+    pin, until it ends, a value is written to the pin or it is cancelled
+    with the `cancel` command. A signal holding the `pin` and the
+    `waveform` statistics, including the timing jitter, is notified when
+    it stops. See `parse_waveform` for the waveform format, e.g.
+    `{{ [[True, 0.01], [False, 0.04]] }}` or
+    `{{ {"frequency": 50, "duty": 0.2, "cycles": 100} }}`.
+
+    The waveform thread sleeps until `spin` seconds before each step and
+    busy waits for the rest. A real-time `priority` makes steps more
+    punctual, but while the thread spins it keeps every other thread of
+    the process off the CPU of a single core board.
+
+    """
+
     pin = IntProperty(default=0, title="Pin Number")
     value = Property(title='Write Value', default="{{ False }}")
-    version = VersionProperty('0.1.0')
+    force = BoolProperty(default=False, title="Force Writes")
+    waveform = Property(title="Waveform", default=None, allow_none=True)
+    waveform_timing = ObjectProperty(WaveformTiming, title="Waveform Timing",
+                                     default=WaveformTiming())
+    version = VersionProperty('0.4.0')
 
     def __init__(self):
         super().__init__()
         self._gpio = None
+        self._written = 0
+        self._collapsed = 0
+        self._redundant = 0
+        self._waveforms = {}
+        self._waveforms_lock = Lock()
 
     def configure(self, context):
         super().configure(context)
         self._gpio = GPIODevice(self.logger)
 
     def stop(self):
+        self.cancel()
         self._gpio.close()
         super().stop()
 
     def process_signals(self, signals):
+        values = OrderedDict()
+        waveforms = {}
         for signal in signals:
-            self._write_gpio_pin(self.pin(signal), self.value(signal))
+            pin = self.pin(signal)
+            values.pop(pin, None)
+            waveforms.pop(pin, None)
+            waveform = self.waveform(signal)
+            if waveform:
+                waveforms[pin] = waveform
+            else:
+                values[pin] = self.value(signal)
+        self._collapsed += len(signals) - len(values) - len(waveforms)
+        if values:
+            self._cancel_waveforms(values)
+            self._write_gpio_pins(values)
+        for pin, waveform in waveforms.items():
+            self._start_waveform(pin, waveform)
         self.notify_signals(signals)
 
+    def cancel(self, pin=None):
+        """Cancel the waveform running on a pin, or all of them."""
+        with self._waveforms_lock:
+            pins = list(self._waveforms) if pin is None else [pin]
+        self._cancel_waveforms(pins)
+        return {"cancelled": pins}
+
+    def stats(self):
+        """Return counts of pin writes made and skipped."""
+        return {"written": self._written,
+                "skipped_collapsed": self._collapsed,
+                "skipped_redundant": self._redundant}
+
+    def _start_waveform(self, pin, waveform):
+        try:
+            steps, repeat = parse_waveform(waveform)
+        except:
+            self.logger.warning("Invalid waveform for gpio pin {}: {}".format(
+                pin, waveform), exc_info=True)
+            return
+        timing = self.waveform_timing()
+        runner = WaveformRunner(self._gpio, pin, steps, repeat, None,
+                                self.logger, spin=timing.spin(),
+                                priority=timing.priority())
+        runner.on_done = partial(self._waveform_done, runner)
+        with self._waveforms_lock:
+            previous = self._waveforms.get(pin)
+            self._waveforms[pin] = runner
+        if previous is not None:
+            previous.cancel()
+        runner.start()
+
+    def _cancel_waveforms(self, pins):
+        runners = []
+        with self._waveforms_lock:
+            for pin in pins:
+                runner = self._waveforms.pop(pin, None)
+                if runner is not None:
+                    runners.append(runner)
+        # Wait outside the lock, the runners take it when they finish
+        for runner in runners:
+            runner.cancel()
+
+    def _waveform_done(self, runner, pin, stats):
+        with self._waveforms_lock:
+            if self._waveforms.get(pin) is runner:
+                del self._waveforms[pin]
+        self.logger.debug(
+            "Waveform on gpio pin {} done: {}".format(pin, stats))
+        self.notify_signals([Signal({"pin": pin, "waveform": stats})])
+
+    def _write_gpio_pins(self, values):
+        try:
+            written = self._gpio.write_many(values, self.force())
+        except:
+            # Write the pins one by one so a bad pin only loses its own value
+            self.logger.warning(
+                "Failed to write values {} to gpio pins".format(dict(values)),
+                exc_info=True)
+            written = sum(1 for pin, value in values.items()
+                          if self._write_gpio_pin(pin, value))
+        self._written += written
+        self._redundant += len(values) - written
+
     def _write_gpio_pin(self, pin, value):
         try:
-            return self._gpio.write(pin, value)
+            return self._gpio.write(pin, value, self.force())
         except:
             self.logger.warning(
                 "Failed to write value {} to gpio pin: {}".format(value, pin),
@@ -0,0 +1,153 @@
+import time
+from bisect import bisect_left
+from threading import Lock
+
+
+# Upper bounds in seconds of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1,
+                   5, 15, 60)
+# Upper bounds in seconds of the buckets of sleep histograms
+SLEEP_BUCKETS = (1, 5, 10, 30, 60, 300, 900, 3600, 21600, 86400)
+
+
+class Histogram():
+
+    """Count observations into fixed buckets.
+
+    Observation `value` goes into the first bucket whose upper bound is at
+    least `value`, or into the last, unbounded, bucket. Besides the bucket
+    counts the total, sum and largest observation are kept.
+
+    Args:
+        bounds (tuple): ascending upper bounds of the buckets
+
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def to_dict(self):
+        """Return the histogram with its buckets keyed by upper bound."""
+        buckets = {"{:g}".format(bound): count
+                   for bound, count in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class Metrics():
+
+    """Counters and histograms shared by the devices of the process.
+
+    Collection is off until `enable` is called and stays on until every
+    caller of `enable` has called `disable`. While off every method returns
+    at once, so instrumented code only pays for a method call and an
+    attribute check. Durations are measured with `start` and `observe_since`
+    so that not even the clock is read while collection is off:
+
+        start = metrics.start()
+        do_something()
+        metrics.observe_since("something", start)
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._users = 0
+        self._lock = Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def enable(self):
+        """Start collecting, until the matching `disable`."""
+        with self._lock:
+            self._users += 1
+            self.enabled = True
+
+    def disable(self):
+        """Stop collecting once no one else needs the metrics."""
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            self.enabled = self._users > 0
+
+    def count(self, name, n=1):
+        """Add `n` to a counter."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def observe(self, name, value, bounds=LATENCY_BUCKETS):
+        """Add a value to a histogram, created with `bounds` if new."""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram(bounds)
+            histogram.observe(value)
+
+    def start(self):
+        """Return the time to measure a duration from, None if off."""
+        return time.perf_counter() if self.enabled else None
+
+    def observe_since(self, name, start, bounds=LATENCY_BUCKETS):
+        """Add the seconds since `start` to a histogram.
+
+        Args:
+            name (str): the histogram
+            start (float): time returned by `start` or `observe_since`,
+                nothing is observed if it is None
+            bounds (tuple): bucket bounds if the histogram is new
+
+        Return:
+            float: the current time, to measure the next step from, or None
+                if nothing was observed
+
+        """
+        if start is None or not self.enabled:
+            return None
+        now = time.perf_counter()
+        self.observe(name, now - start, bounds)
+        return now
+
+    def snapshot(self, reset=False):
+        """Return the counters and histograms, optionally clearing them.
+
+        Return:
+            dict: `counters` holding each counter by name and `histograms`
+                holding each histogram by name, as in `Histogram.to_dict`
+
+        """
+        with self._lock:
+            snapshot = {
+                "counters": dict(self._counters),
+                "histograms": {name: histogram.to_dict() for name, histogram
+                               in self._histograms.items()},
+            }
+            if reset:
+                self._counters = {}
+                self._histograms = {}
+        return snapshot
+
+
+# The metrics of every device in the process
+metrics = Metrics()
@@ -0,0 +1,61 @@
+from datetime import timedelta
+from nio.block.base import Block
+from nio.command import command
+from nio.modules.scheduler import Job
+from nio.signal.base import Signal
+from nio.util.discovery import discoverable
+from nio.properties import VersionProperty, FloatProperty, BoolProperty
+from .metrics import metrics as device_metrics
+
+
+@discoverable
+@command("metrics")
+class DeviceMetrics(Block):
+
+    """Report the metrics of the GPIO, SDI-12 and sleep devices.
+
+    Metrics are only collected while a `DeviceMetrics` block is running,
+    otherwise the devices skip them at next to no cost. Each incoming
+    signal gets a `metrics` attribute, and with a report interval a signal
+    holding `metrics` is notified periodically. `metrics` holds the
+    `counters` and the latency `histograms` of every device in the
+    process, as in `Metrics.snapshot`.
+
+    """
+
+    report_interval = FloatProperty(
+        default=60, title="Report Interval (seconds, 0: none)")
+    reset_on_report = BoolProperty(default=False, title="Reset on Report")
+    version = VersionProperty('0.1.0')
+
+    def __init__(self):
+        super().__init__()
+        self._job = None
+
+    def start(self):
+        super().start()
+        device_metrics.enable()
+        if self.report_interval() > 0:
+            self._job = Job(self._report,
+                            timedelta(seconds=self.report_interval()), True)
+
+    def stop(self):
+        if self._job is not None:
+            self._job.cancel()
+            self._job = None
+        device_metrics.disable()
+        super().stop()
+
+    def process_signals(self, signals):
+        snapshot = device_metrics.snapshot(self.reset_on_report())
+        for signal in signals:
+            signal.metrics = snapshot
+        self.notify_signals(signals)
+
+    def metrics(self):
+        """Return the metrics collected so far."""
+        return device_metrics.snapshot()
+
+    def _report(self):
+        self.notify_signals([Signal(
+            {"metrics": device_metrics.snapshot(self.reset_on_report())})])
@@ -6,6 +6,7 @@ from nio.properties import Property, IntProperty, StringProperty, \
 from subprocess import call, check_call, CalledProcessError
 import sys
 import time
+from .metrics import metrics, SLEEP_BUCKETS
 
 @discoverable
 class LowPowerSleepMode(Block):
@@ -25,7 +26,10 @@ class LowPowerSleepMode(Block):
                 check_call(['hwclock','--hctosys'])
             except CalledProcessError as err:
                 self.logger.warning("An error occured while resetting the clock: {}".format(err))
+                metrics.count("sleep.clock_failures")
         except:
             self.logger.exception("An error occurred while trying to sleep: {}".format(sys.exc_info()[0]))
+            metrics.count("sleep.failures")
         t = time.time() - t
+        metrics.observe("sleep.duration", t, SLEEP_BUCKETS)
         self.notify_signals([Signal({'sleeptime':t})])
@@ -0,0 +1,351 @@
+"""Stand-in for the sysfs GPIO interface used by `periphery.GPIO`.
+
+`FakeSysfs` builds a `/sys/class/gpio` style tree in a temporary directory
+and provides a `GPIO` class with the same interface as `periphery.GPIO`
+that operates on it, opening and writing real files the way the kernel
+interface would, so that the relative cost of GPIO operations can be
+measured without hardware.
+
+    with FakeSysfs() as sysfs:
+        with patch.object(gpio_backends, "GPIO", sysfs.GPIO, create=True):
+            ...
+
+`MockGPIOChips` stands in for the `/dev/gpiochipN` character devices as
+the `syscalls` of a `CdevBackend`, keeping the level of every line and
+counting ioctls. Line event requests are backed by real pipes, so edges
+injected with `inject_edge` wake up an epoll based monitor like the
+kernel would.
+
+`FakeGPIOEnvironment` puts both in place for code that creates its own
+`GPIODevice`, like the GPIO blocks, so they run end to end without
+hardware:
+
+    with FakeGPIOEnvironment() as env:
+        blk = GPIOInterrupts()
+        ...
+        env.chips.inject_edge(3, True)
+
+"""
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+
+class FakeSysfs():
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.root = None
+        self.opened = 0
+        self.closed = 0
+        sysfs = self
+
+        class GPIO(_FakeSysfsGPIO):
+            _sysfs = sysfs
+
+        self.GPIO = GPIO
+
+    def __enter__(self):
+        self.root = tempfile.mkdtemp(prefix="fake-sysfs-gpio-",
+                                     dir=self.parent)
+        return self
+
+    def __exit__(self, *args):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    @property
+    def open_handles(self):
+        return self.opened - self.closed
+
+    def pin_path(self, pin, name=None):
+        path = os.path.join(self.root, "gpio{}".format(pin))
+        return path if name is None else os.path.join(path, name)
+
+    def export(self, pin):
+        path = self.pin_path(pin)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+            for name, value in (("direction", "in"), ("value", "0"),
+                                ("edge", "none")):
+                with open(os.path.join(path, name), "w") as f:
+                    f.write(value + "\n")
+
+    def get_value(self, pin):
+        with open(self.pin_path(pin, "value")) as f:
+            return f.read().strip() == "1"
+
+    def set_value(self, pin, value):
+        """Drive an input pin from the outside."""
+        self.export(pin)
+        with open(self.pin_path(pin, "value"), "w") as f:
+            f.write("1\n" if value else "0\n")
+
+    def get_direction(self, pin):
+        with open(self.pin_path(pin, "direction")) as f:
+            return f.read().strip()
+
+
+class _FakeSysfsGPIO():
+
+    _sysfs = None
+
+    def __init__(self, pin, direction="preserve"):
+        self._pin = pin
+        self._sysfs.export(pin)
+        self._fd = os.open(self._sysfs.pin_path(pin, "value"), os.O_RDWR)
+        self._sysfs.opened += 1
+        if direction != "preserve":
+            self.direction = direction
+
+    @property
+    def pin(self):
+        return self._pin
+
+    @property
+    def fd(self):
+        return self._fd
+
+    @property
+    def supports_interrupts(self):
+        return True
+
+    def read(self):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        return os.read(self._fd, 2)[:1] == b"1"
+
+    def write(self, value):
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, b"1\n" if value else b"0\n")
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+            self._sysfs.closed += 1
+
+    @property
+    def direction(self):
+        return self._read_attr("direction")
+
+    @direction.setter
+    def direction(self, direction):
+        if direction not in ("in", "out", "high", "low"):
+            raise ValueError("Invalid direction: {}".format(direction))
+        self._write_attr("direction",
+                         "out" if direction in ("high", "low") else direction)
+        if direction in ("high", "low"):
+            self.write(direction == "high")
+
+    @property
+    def edge(self):
+        return self._read_attr("edge")
+
+    @edge.setter
+    def edge(self, edge):
+        if edge not in ("none", "rising", "falling", "both"):
+            raise ValueError("Invalid edge: {}".format(edge))
+        self._write_attr("edge", edge)
+
+    def _read_attr(self, name):
+        with open(self._sysfs.pin_path(self._pin, name)) as f:
+            return f.read().strip()
+
+    def _write_attr(self, name, value):
+        with open(self._sysfs.pin_path(self._pin, name), "w") as f:
+            f.write(value + "\n")
+
+
+class MockGPIOChips():
+
+    """System calls of `CdevBackend` answered from in-memory chips."""
+
+    def __init__(self, lines_per_chip=32):
+        from ..gpio_backends import GPIO_GET_LINEHANDLE_IOCTL, \
+            GPIO_GET_LINEEVENT_IOCTL, GPIOHANDLE_GET_LINE_VALUES_IOCTL, \
+            GPIOHANDLE_SET_LINE_VALUES_IOCTL, GPIOHANDLE_REQUEST_OUTPUT, \
+            GPIOEVENT_EVENT_RISING_EDGE, GPIOEVENT_EVENT_FALLING_EDGE, \
+            gpioevent_data
+        self._ops = {
+            GPIO_GET_LINEHANDLE_IOCTL: self._get_linehandle,
+            GPIO_GET_LINEEVENT_IOCTL: self._get_lineevent,
+            GPIOHANDLE_GET_LINE_VALUES_IOCTL: self._get_values,
+            GPIOHANDLE_SET_LINE_VALUES_IOCTL: self._set_values,
+        }
+        self._output_flag = GPIOHANDLE_REQUEST_OUTPUT
+        self._event_ids = (GPIOEVENT_EVENT_FALLING_EDGE,
+                           GPIOEVENT_EVENT_RISING_EDGE)
+        self._event = gpioevent_data
+        self.lines_per_chip = lines_per_chip
+        # (chip, offset) -> level and direction
+        self.levels = {}
+        self.directions = {}
+        # (chip, offset) -> fd of the request holding the line
+        self.held = {}
+        self.ioctls = 0
+        self._fds = {}
+        # well above any real descriptor, real ones are used for events
+        self._next_fd = 1 << 20
+
+    def open(self, path, flags):
+        chip = int(path.rsplit("gpiochip", 1)[1])
+        return self._new_fd(("chip", chip))
+
+    def close(self, fd):
+        kind = self._fds.pop(fd)
+        if kind[0] == "lines":
+            for line in kind[2]:
+                del self.held[line]
+        elif kind[0] == "event":
+            del self.held[kind[1]]
+            os.close(fd)
+            os.close(kind[2])
+
+    def read(self, fd, size):
+        return os.read(fd, size)
+
+    def readv(self, fd, buffers):
+        return os.readv(fd, buffers)
+
+    def ioctl(self, fd, request, arg, mutate=True):
+        self.ioctls += 1
+        self._ops[request](self._fds[fd], arg)
+        return 0
+
+    def set_level(self, pin, value):
+        """Drive an input line from the outside."""
+        self.levels[divmod(pin, self.lines_per_chip)] = 1 if value else 0
+
+    def inject_edge(self, pin, value, timestamp=None):
+        """Change the level of a watched line, queueing an edge event.
+
+        Args:
+            pin (int): the pin of the line
+            value (bool): level after the edge, True for a rising edge
+            timestamp (float): time of the edge in seconds, default now
+
+        """
+        line = divmod(pin, self.lines_per_chip)
+        self.levels[line] = 1 if value else 0
+        fd = self.held[line]
+        if timestamp is None:
+            timestamp = time.monotonic()
+        os.write(self._fds[fd][2], self._event.pack(
+            int(timestamp * 1e9), self._event_ids[bool(value)]))
+
+    def get_level(self, pin):
+        return bool(self.levels.get(divmod(pin, self.lines_per_chip), 0))
+
+    def get_direction(self, pin):
+        return self.directions.get(divmod(pin, self.lines_per_chip))
+
+    def _new_fd(self, kind):
+        fd = self._next_fd
+        self._next_fd += 1
+        self._fds[fd] = kind
+        return fd
+
+    def _get_linehandle(self, kind, req):
+        lines = [(kind[1], req.lineoffsets[i]) for i in range(req.lines)]
+        for line in lines:
+            if line in self.held:
+                raise OSError(16, "Device or resource busy")
+        output = bool(req.flags & self._output_flag)
+        req.fd = self._new_fd(("lines", kind[1], lines))
+        for i, line in enumerate(lines):
+            self.held[line] = req.fd
+            self.directions[line] = "out" if output else "in"
+            if output:
+                self.levels[line] = req.default_values[i]
+
+    def _get_lineevent(self, kind, req):
+        line = (kind[1], req.lineoffset)
+        if line in self.held:
+            raise OSError(16, "Device or resource busy")
+        r, w = os.pipe()
+        self._fds[r] = ("event", line, w)
+        self.held[line] = r
+        self.directions[line] = "in"
+        req.fd = r
+
+    def _get_values(self, kind, data):
+        lines = [kind[1]] if kind[0] == "event" else kind[2]
+        for i, line in enumerate(lines):
+            data.values[i] = self.levels.get(line, 0)
+
+    def _set_values(self, kind, data):
+        for i, line in enumerate(kind[2]):
+            if self.directions[line] != "out":
+                raise OSError(1, "Operation not permitted")
+            self.levels[line] = data.values[i]
+
+
+class FakeGPIOEnvironment():
+
+    """Stand-in GPIO for every `GPIODevice` created without a manager.
+
+    Inside the context the default backend of the shared `GPIOManager` is
+    a `CdevBackend` on `chips`, the `MockGPIOChips`, or with `cdev` False a
+    `SysfsBackend` on `sysfs`, the `FakeSysfs` tree. Only the chips can
+    inject edges. A shared manager left open by a previous test is
+    dropped on entry and on exit.
+
+    Args:
+        cdev (bool): use the gpiochip backend rather than sysfs
+        lines_per_chip (int): number of lines of each mock chip
+        sysfs_parent (str): directory to build the sysfs tree in, by
+            default the temporary directory
+
+    """
+
+    def __init__(self, cdev=True, lines_per_chip=32, sysfs_parent=None):
+        self.cdev = cdev
+        self.lines_per_chip = lines_per_chip
+        self.sysfs = FakeSysfs(sysfs_parent)
+        self.chips = None
+        self._patches = []
+
+    def __enter__(self):
+        from .. import gpio_backends, gpio_device
+        self.sysfs.__enter__()
+        self.chips = MockGPIOChips(self.lines_per_chip)
+        self._manager_class = gpio_device.GPIOManager
+        self._patches = [
+            patch.object(gpio_backends, "GPIO", self.sysfs.GPIO),
+            patch.object(gpio_device, "default_backend",
+                         self._default_backend),
+        ]
+        for patcher in self._patches:
+            patcher.start()
+        self._manager_class._shared = None
+        return self
+
+    def __exit__(self, *args):
+        for patcher in reversed(self._patches):
+            patcher.stop()
+        self._manager_class._shared = None
+        self.sysfs.__exit__(*args)
+
+    def backend(self, logger, **options):
+        """Return a new backend on the stand-in devices.
+
+        Args:
+            logger: the backend's logger
+            **options: other arguments of the backend, such as the
+                `max_handles` of `SysfsBackend`
+
+        """
+        from ..gpio_backends import CdevBackend, SysfsBackend
+        if self.cdev:
+            return CdevBackend(logger, lines_per_chip=self.lines_per_chip,
+                               syscalls=self.chips, **options)
+        return SysfsBackend(logger, **options)
+
+    def _default_backend(self, logger, max_handles=32, idle_timeout=60.0):
+        # Like `gpio_backends.default_backend`, pool settings are only
+        # used by sysfs
+        if self.cdev:
+            return self.backend(logger)
+        return self.backend(logger, max_handles=max_handles,
+                            idle_timeout=idle_timeout)
@@ -0,0 +1,273 @@
+"""Stand-in for SDI-12 probes on a serial port.
+
+`FakeSDI12Port` is a pyserial `loop://` port with simulated sensors on the
+line, and `FakeSDI12Pty` puts them behind a pseudo terminal whose `port`
+can be opened like the UART. Like the real bus the line echoes every
+command written to it, and each sensor answers the commands addressed to it
+after a turnaround delay, sending a service request when an `aM!`
+measurement is done. Either can be handed to `SDI12`, `SDI12AquaCheck` or
+`SDI12Bus` in place of a port name:
+
+    port = FakeSDI12Port([FakeSDI12Sensor("0", values=[30.5, 31.0])])
+    probe = SDI12AquaCheck(port)
+
+    pty = FakeSDI12Pty([FakeSDI12Sensor("0")], jitter=0.02, drop_rate=0.01)
+    probe = SDI12AquaCheck(pty.port)
+
+A noisy or slow bus is simulated with the `SDI12Line` options: no echo,
+random extra delay before each response, and bytes dropped at random. A
+sensor can send bad CRCs with `crc_error_rate`.
+
+"""
+import math
+import os
+import random
+import select
+import threading
+import tty
+from serial.urlhandler.protocol_loop import Serial
+from ..aquacheck_block import sdi12CRC
+
+
+class FakeSDI12Sensor():
+
+    """A probe answering the SDI-12 commands used by `SDI12AquaCheck`.
+
+    Args:
+        address (str): the sensor address
+        values (list): values of every measurement, or a dict of them per
+            measurement number
+        measurement_time (float): seconds a measurement takes, rounded up
+            in the time advertised
+        values_per_set (int): values sent per `aDn!` data set
+        continuous (bool): whether `aRn!` measurements are supported
+        crc_error_rate (float): chance of a wrong CRC on each response
+            that carries one
+        seed: seed of the random CRC errors
+
+    """
+
+    def __init__(self, address, values=(1.0,), measurement_time=0,
+                 values_per_set=3, continuous=False, crc_error_rate=0,
+                 seed=None):
+        self.address = address
+        self.values = values
+        self.measurement_time = measurement_time
+        self.values_per_set = values_per_set
+        self.continuous = continuous
+        self.crc_error_rate = crc_error_rate
+        self.commands = []
+        self.crc_errors = 0
+        self._random = random.Random(seed)
+        self._data = []
+        self._crc = False
+
+    def measurement(self, number):
+        values = self.values
+        if isinstance(values, dict):
+            values = values[number]
+        return ["{:+g}".format(value) for value in values]
+
+    def respond(self, command):
+        """Return the response to a command and the time of a service
+        request to send after it, if any.
+        """
+        self.commands.append(command)
+        body = command[1:-1]
+        if body == "":
+            return self.address, None
+        if body == "I":
+            return self.address + "13FAKESDI 001", None
+        kind, number = body[0], body[1:]
+        crc = kind in "MCR" and number.startswith("C")
+        if crc:
+            number = number[1:]
+        if kind not in "MCDR" or number and not number.isdigit():
+            return None, None
+        number = int(number or 0)
+        if kind in "MC":
+            self._data = self.measurement(number)
+            self._crc = crc
+            wait = int(math.ceil(self.measurement_time))
+            if kind == "M":
+                response = "{}{:03d}{}".format(
+                    self.address, wait, min(len(self._data), 9))
+                # No service request for a measurement ready at once
+                return response, self.measurement_time or None
+            return "{}{:03d}{:02d}".format(
+                self.address, wait, len(self._data)), None
+        if kind == "D":
+            start = number * self.values_per_set
+            data = self._data[start:start + self.values_per_set]
+            return self._frame("".join(data), self._crc), None
+        if kind == "R":
+            if not self.continuous:
+                return self.address, None
+            return self._frame("".join(self.measurement(number)), crc), None
+        return None, None
+
+    def _frame(self, data, crc):
+        response = self.address + data
+        if not crc:
+            return response
+        checksum = sdi12CRC(response)
+        if self.crc_error_rate and \
+                self._random.random() < self.crc_error_rate:
+            self.crc_errors += 1
+            # Flip a bit of the last character, it stays printable
+            checksum = checksum[:2] + chr(ord(checksum[2]) ^ 1)
+        return response + checksum
+
+
+class SDI12Line():
+
+    """The sensors' side of an SDI-12 bus.
+
+    Bytes written by the data recorder are passed to `feed`, and everything
+    the sensors put on the line is passed to `send` as bytes, from a timer
+    thread for responses.
+
+    Args:
+        sensors (list): the `FakeSDI12Sensor` on the bus
+        send (function): called with the bytes to put on the line
+        turnaround (float): seconds between a command and its response
+        echo (bool): whether commands are echoed, as on a bus whose RX is
+            wired to TX
+        jitter (float): most seconds of random delay added to each
+            response
+        drop_rate (float): chance of losing each byte of a response
+        seed: seed of the random delays and drops
+
+    """
+
+    def __init__(self, sensors, send, turnaround=0.01, echo=True, jitter=0,
+                 drop_rate=0, seed=None):
+        self.sensors = {sensor.address: sensor for sensor in sensors}
+        self.send = send
+        self.turnaround = turnaround
+        self.echo = echo
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.dropped = 0
+        self._random = random.Random(seed)
+        self._command = bytearray()
+
+    def feed(self, data):
+        """Take bytes written by the data recorder."""
+        data = bytes(data)
+        if self.echo:
+            self.send(data)
+        for byte in data:
+            if byte == 0:
+                # the break that wakes the sensors up
+                self._command.clear()
+                continue
+            self._command.append(byte)
+            if byte == ord("!"):
+                self._answer(self._command.decode(errors="replace"))
+                self._command.clear()
+
+    def _answer(self, command):
+        sensor = self.sensors.get(command[:1])
+        if sensor is None:
+            return
+        response, request_after = sensor.respond(command)
+        delay = self.turnaround
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if response is not None:
+            self._send_later(delay, response)
+        if request_after is not None:
+            self._send_later(delay + request_after, sensor.address)
+
+    def _send_later(self, delay, response):
+        data = (response + "\r\n").encode()
+        if self.drop_rate:
+            kept = bytes(byte for byte in data
+                         if self._random.random() >= self.drop_rate)
+            self.dropped += len(data) - len(kept)
+            data = kept
+        timer = threading.Timer(delay, self.send, (data,))
+        timer.daemon = True
+        timer.start()
+
+
+class FakeSDI12Port(Serial):
+
+    """A loop back serial port with sensors answering commands on it.
+
+    Args:
+        sensors (list): the `FakeSDI12Sensor` on the bus
+        turnaround (float): seconds between a command and its response
+        **options: other `SDI12Line` options
+
+    """
+
+    def __init__(self, sensors, turnaround=0.01, **options):
+        super().__init__(None)
+        self.line = SDI12Line(sensors, self._send, turnaround, **options)
+        self.sensors = self.line.sensors
+        self.port = "loop://"
+
+    def write(self, data):
+        self.line.feed(data)
+        return len(data)
+
+    def _send(self, data):
+        if self.is_open:
+            Serial.write(self, data)
+
+
+class FakeSDI12Pty():
+
+    """Sensors answering commands behind a pseudo terminal.
+
+    `port` is the path of the terminal's slave side, to be opened like the
+    UART of a real bus, so the whole serial driver path is exercised. A
+    thread reads the commands from the master side until `close`.
+
+    Args:
+        sensors (list): the `FakeSDI12Sensor` on the bus
+        turnaround (float): seconds between a command and its response
+        **options: other `SDI12Line` options
+
+    """
+
+    def __init__(self, sensors, turnaround=0.01, **options):
+        self._master, self._slave = os.openpty()
+        # No echo or line editing until the serial driver configures it
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self.line = SDI12Line(sensors, self._send, turnaround, **options)
+        self.sensors = self.line.sensors
+        self._wake_r, self._wake_w = os.pipe()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="FakeSDI12Pty")
+        self._thread.start()
+
+    def close(self):
+        # Responses still pending must not write to a reused descriptor
+        with self._lock:
+            self._closed = True
+        os.write(self._wake_w, b"\0")
+        self._thread.join(1)
+        for fd in (self._master, self._slave, self._wake_r, self._wake_w):
+            os.close(fd)
+
+    def _run(self):
+        while not self._closed:
+            ready, _, _ = select.select([self._master, self._wake_r], [], [])
+            if self._wake_r in ready:
+                return
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return
+            self.line.feed(data)
+
+    def _send(self, data):
+        with self._lock:
+            if not self._closed:
+                os.write(self._master, data)
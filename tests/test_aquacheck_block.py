@@ -0,0 +1,564 @@
+import asyncio
+import time
+import warnings
+from threading import Event, Timer
+from unittest.mock import ANY, patch
+import serial
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+from nio.testing.test_case import NIOTestCase
+from ..aquacheck_block import AquaCheck, AsyncSDI12AquaCheck, CirBuffer, CirBufferOverflow, OverflowPolicy, \
+    ReadMode, RetryPolicy, SDI12, SDI12AquaCheck, SDI12Bus, SDI12CRCError, \
+    SDI12DeadlineExpired, SDI12ResponseError, \
+    parseDataResponse, sdi12CRC
+from .fake_sdi12 import FakeSDI12Port, FakeSDI12Pty, FakeSDI12Sensor
+
+# Data responses recorded from probes on the bus, whether they carry a CRC
+#  and the values in them
+RESPONSES = [
+    # AquaCheck moisture, sets 0 and 1
+    ("0+30.7812+31.0431+29.9908\r\n", "0", False,
+     ["+30.7812", "+31.0431", "+29.9908"]),
+    ("0+27.1650+25.0046+24.8120\r\n", "0", False,
+     ["+27.1650", "+25.0046", "+24.8120"]),
+    # AquaCheck temperature, negative values
+    ("1+12.5000-0.2500+9.1250\r\n", "1", False,
+     ["+12.5000", "-0.2500", "+9.1250"]),
+    # integers, leading break read as a null, values without leading digit
+    ("\x00a+3-12+.5\r\n", "a", False, ["+3", "-12", "+.5"]),
+    # no data (yet)
+    ("0\r\n", "0", False, []),
+    # with CRC
+    ("0+3.14OqZ\r\n", "0", True, ["+3.14"]),
+]
+
+
+class TestCirBuffer(NIOTestCase):
+
+    def test_bulk_reads(self):
+        buf = CirBuffer(8)
+        buf.write(b"0+1.5\r\n")
+        self.assertEqual(buf.available(), 7)
+        self.assertEqual(buf.peek(), b"0")
+        self.assertEqual(buf.read(), b"0")
+        self.assertEqual(buf.read(2), b"+1")
+        self.assertEqual(buf.read_until(b"\r\n"), b".5\r\n")
+        self.assertEqual(buf.read(), -1)
+        self.assertEqual(buf.readline(), -1)
+
+    def test_wrap_around(self):
+        """Data and terminators wrapping the end of the buffer are found."""
+        buf = CirBuffer(8)
+        buf.write(b"abcdef")
+        buf.read(5)
+        buf.write(b"gh\r\nij")
+        self.assertEqual(buf.read_until(b"\r\n"), b"fgh\r\n")
+        self.assertEqual(buf.get(), b"ij")
+        buf.write(b"klmnop\r")
+        buf.read(6)
+        buf.write(b"\nq")
+        self.assertEqual(buf.readline(), b"\r\n")
+
+    def test_drop_newest(self):
+        buf = CirBuffer(4)
+        self.assertEqual(buf.write(b"abcdef"), 4)
+        self.assertEqual(buf.available(), -1)
+        self.assertEqual(buf.overflowCount, 2)
+        self.assertEqual(buf.get(), b"abcd")
+
+    def test_drop_oldest(self):
+        buf = CirBuffer(4, OverflowPolicy.DROP_OLDEST)
+        buf.write(b"abc")
+        buf.write(b"de")
+        self.assertEqual(buf.overflowCount, 1)
+        self.assertEqual(buf.get(), b"bcde")
+        buf.write(b"0123456")
+        self.assertEqual(buf.get(), b"3456")
+
+    def test_raise(self):
+        buf = CirBuffer(4, OverflowPolicy.RAISE)
+        buf.write(b"abc")
+        with self.assertRaises(CirBufferOverflow):
+            buf.write(b"de")
+        self.assertEqual(buf.get(), b"abc")
+
+
+class TestSDI12Listen(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # loop:// hands back whatever is written, like the echo on the bus
+        self.uart = serial.serial_for_url("loop://", do_not_open=True)
+        self.sdi = SDI12(self.uart)
+        self.sdi.begin()
+        self.addCleanup(self.sdi.end)
+
+    def test_stops_at_terminator(self):
+        """A complete response ends the read without waiting for timeout."""
+        self.uart.write(b"\x000M0!00032\r\n")
+        start = time.monotonic()
+        self.assertTrue(self.sdi.listen(1, cmd="0M0!"))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.sdi.readString(), "00032\r\n")
+
+    def test_echo_stripped_with_buffered_data(self):
+        """The echo is stripped even if earlier data is still buffered."""
+        self.uart.write(b"0\r\n")
+        self.sdi.listen(0.1)
+        self.uart.write(b"0D0!0+1.5\r\n")
+        self.sdi.listen(1, cmd="0D0!")
+        self.assertEqual(self.sdi.readString(), "0\r\n0+1.5\r\n")
+
+    def test_incomplete_response(self):
+        """An unterminated response is kept once characters stop coming."""
+        self.uart.write(b"0D0!0+1.")
+        self.assertFalse(self.sdi.listen(1, cmd="0D0!"))
+        self.assertEqual(self.sdi.readString(), "0+1.")
+
+    def test_wait_for_service_request(self):
+        """Waiting ends when the service request arrives."""
+        Timer(0.2, self.uart.write, (b"noise\r\n\x000\r\n",)).start()
+        waited = self.sdi.waitForServiceRequest("0", 2)
+        self.assertGreaterEqual(waited, 0.2)
+        self.assertLess(waited, 1)
+        self.assertIsNone(self.sdi.waitForServiceRequest("0", 0.1))
+
+
+class TestSDI12AquaCheck(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        uart = serial.serial_for_url("loop://", do_not_open=True)
+        self.aq = SDI12AquaCheck(uart)
+        self.addCleanup(self.aq.aquaCheckSDI12.end)
+        self.commands = []
+
+    def respond(self, responses):
+        """Answer commands from a dict instead of a sensor, lists holding
+        the answers to successive commands."""
+        sdi = self.aq.aquaCheckSDI12
+
+        def send(cmd):
+            self.commands.append((cmd, time.monotonic()))
+            response = responses[cmd]
+            if isinstance(response, list):
+                response = response.pop(0)
+            sdi._rxBuffer.write(response.encode())
+            yield from ()   # answered at once, nothing to wait for
+        sdi._sendCommand = send
+
+    def test_poll_bus(self):
+        """Probes measure concurrently and are read once ready."""
+        self.respond({
+            "1C0!": "100103\r\n", "1D0!": "1+1.5-2\r\n", "1D1!": "1+3\r\n",
+            "2C0!": "200002\r\n", "2D0!": "2+4.25+5\r\n",
+            "3C0!": "3\r\n"})
+        start = time.monotonic()
+        results = self.aq.pollBus(0, ["1", "2", "3"])
+        self.assertLess(time.monotonic() - start, 1.5)
+        self.assertDictEqual(results, {
+            "1": [1.5, -2.0, 3.0], "2": [4.25, 5.0], "3": None})
+        # the probe with no measurement time is read while the other waits
+        self.assertListEqual([cmd for cmd, _ in self.commands], [
+            "1C0!", "2C0!", "3C0!", "3C0!", "2D0!", "1D0!", "1D1!"])
+        self.assertGreaterEqual(self.commands[-2][1] - start, 1)
+
+    def test_crc_error_repeats_data_set(self):
+        """Only the data set failing its CRC is asked for again."""
+        responses = iter(["0+3.14OqZ\r\n", "0+2.7" + sdi12CRC("0+2.71") +
+                          "\r\n", "0+2.71" + sdi12CRC("0+2.71") + "\r\n"])
+        self.respond({"0MC0!": "00002\r\n"})
+        send = self.aq.aquaCheckSDI12._sendCommand
+
+        def sendData(cmd):
+            if "D" in cmd:
+                self.commands.append((cmd, time.monotonic()))
+                self.aq.aquaCheckSDI12._rxBuffer.write(
+                    next(responses).encode())
+            else:
+                yield from send(cmd)
+        self.aq.aquaCheckSDI12._sendCommand = sendData
+        self.assertEqual(self.aq.pollProbe(0, crc=True), 0)
+        self.assertListEqual(self.aq.moistureData, [3.14, 2.71])
+        self.assertEqual(self.aq.moistureRaw, "0+3.14+2.71")
+        self.assertListEqual([cmd for cmd, _ in self.commands],
+                             ["0MC0!", "0D0!", "0D1!", "0D1!"])
+
+    def test_continuous_detected(self):
+        """Probes supporting aR! are read without measuring."""
+        self.respond({
+            "0I!": "013AQUACHCKSDI-12 100\r\n", "0R0!": "0+1.25+2.5\r\n",
+            "1I!": "113AQUACHCKSDI-12 100\r\n", "1R0!": "1\r\n",
+            "1M0!": "10001\r\n", "1D0!": "1+7\r\n"})
+        self.assertEqual(self.aq.readProbe(0, "0", ReadMode.AUTO), 0)
+        self.assertListEqual(self.aq.moistureData, [1.25, 2.5])
+        self.assertEqual(self.aq.readProbe(0, "0", ReadMode.AUTO), 0)
+        self.assertEqual(self.aq.readProbe(0, "1", ReadMode.AUTO), 0)
+        self.assertListEqual(self.aq.moistureData, [7.0])
+        self.assertDictEqual(self.aq.continuous, {"0": True, "1": False})
+        self.assertListEqual([cmd for cmd, _ in self.commands], [
+            "0I!", "0R0!", "0R0!", "1I!", "1R0!", "1M0!", "1D0!"])
+
+    def test_acquire_pipelined(self):
+        """Each probe starts its next reading type as soon as it can."""
+        self.respond({
+            "1C0!": "100101\r\n", "1C1!": "100101\r\n",
+            "1D0!": ["1+10\r\n", "1+11\r\n"],
+            "2C0!": "200001\r\n", "2C1!": "200101\r\n",
+            "2D0!": ["2+20\r\n", "2+21\r\n"]})
+        start = time.monotonic()
+        results = self.aq.acquire([0, 1], ["1", "2"])
+        self.assertLess(time.monotonic() - start, 2.5)
+        self.assertDictEqual(results, {
+            "1": {0: [10.0], 1: [11.0]}, "2": {0: [20.0], 1: [21.0]}})
+        self.assertListEqual([cmd for cmd, _ in self.commands], [
+            "1C0!", "2C0!", "2D0!", "2C1!", "1D0!", "1C1!", "2D0!", "1D0!"])
+        self.assertEqual(self.aq.setTiming["2"][1]["advertised"], 1)
+        self.assertGreaterEqual(self.aq.setTiming["2"][1]["actual"], 1)
+
+    def test_retry_policy(self):
+        """Silent probes get fewer attempts than garbled ones, spaced by the
+        backoff."""
+        self.respond({"1C0!": "", "2C0!": "2\r\n"})
+        policy = RetryPolicy(attempts=3, silentAttempts=1, backoff=0.05)
+        results = self.aq.acquire([0], ["1", "2"], retryPolicy=policy)
+        self.assertDictEqual(results, {"1": {0: None}, "2": {0: None}})
+        commands = [cmd for cmd, _ in self.commands]
+        self.assertListEqual(commands, ["1C0!", "2C0!", "2C0!", "2C0!"])
+        self.assertGreaterEqual(
+            self.commands[-1][1] - self.commands[1][1], 0.15)
+
+    def test_backoff(self):
+        """The backoff doubles after each attempt, up to backoffMax."""
+        self.aq.retryPolicy = RetryPolicy(backoff=0.1, backoffMax=0.3)
+        self.assertListEqual([self.aq._backoff(attempt)
+                              for attempt in range(1, 5)],
+                             [0.1, 0.2, 0.3, 0.3])
+        self.aq.retryPolicy = RetryPolicy()
+        self.assertEqual(self.aq._backoff(3), 0)
+
+    def test_poll_deadline(self):
+        """Nothing is retried or collected once the deadline has passed."""
+        self.respond({"1C0!": "100201\r\n", "2C0!": "2\r\n"})
+        policy = RetryPolicy(attempts=10, backoff=0.2, deadline=0.5)
+        start = time.monotonic()
+        results = self.aq.acquire([0], ["1", "2"], retryPolicy=policy)
+        self.assertLess(time.monotonic() - start, 0.7)
+        self.assertDictEqual(results, {"1": {0: None}, "2": {0: None}})
+        self.assertNotIn("1D0!", [cmd for cmd, _ in self.commands])
+
+    def test_poll_probe_deadline(self):
+        """A single probe poll gives up once the deadline has passed."""
+        self.respond({"0M0!": "0\r\n"})
+        self.aq.retryPolicy = RetryPolicy(attempts=10, backoff=0.2,
+                                          deadline=0.5)
+        start = time.monotonic()
+        self.assertEqual(self.aq.pollProbe(0), -1)
+        self.assertLess(time.monotonic() - start, 0.7)
+        self.assertLess(len(self.commands), 10)
+        self.assertIsNone(self.aq._deadline)
+
+    def test_circuit_breaker(self):
+        """A probe failing every poll is skipped until a recovery poll."""
+        self.respond({"1M0!": ["", "", "", "10001\r\n"], "1D0!": "1+7\r\n"})
+        policy = RetryPolicy(attempts=1, silentAttempts=1, breakerFailures=2,
+                             breakerCooldown=0.2)
+        for _ in range(3):
+            self.aq.acquire([0], ["1"], retryPolicy=policy)
+        self.assertEqual(len(self.commands), 2)
+        time.sleep(0.2)
+        # the recovery poll fails, the probe is skipped for another cooldown
+        self.aq.acquire([0], ["1"])
+        self.aq.acquire([0], ["1"])
+        self.assertEqual(len(self.commands), 3)
+        time.sleep(0.2)
+        self.assertDictEqual(self.aq.acquire([0], ["1"]), {"1": {0: [7.0]}})
+        self.assertDictEqual(self.aq.breakers, {})
+
+
+@patch(AquaCheck.__module__ + ".SDI12AquaCheck")
+class TestAquaCheck(NIOBlockTestCase):
+
+    def test_reading_types(self, probe):
+        """Moisture and temperature are notified together with timings."""
+        probe.return_value.acquire.return_value = \
+            {"0": {0: [30.5, 31.0], 1: [12.25, 12.5]}}
+        probe.return_value.setTiming = {"0": {
+            0: {"advertised": 2, "actual": 1.5},
+            1: {"advertised": 1, "actual": 0.9}}}
+        blk = AquaCheck()
+        self.configure_block(blk, {"readTemperature": True})
+        blk.start()
+        blk.process_signals([Signal()])
+        blk.stop()
+        probe.return_value.acquire.assert_called_once_with(
+            [0, 1], ["0"], mode=blk.readMode(), retryPolicy=ANY)
+        signal = self.last_notified[DEFAULT_TERMINAL][0].to_dict()
+        self.assertIsInstance(signal.pop("timestamp"), float)
+        self.assertDictEqual(signal, {
+                "default": [30.5, 31.0],
+                "temperature": [12.25, 12.5],
+                "timing": {
+                    "default": {"advertised": 2, "actual": 1.5},
+                    "temperature": {"advertised": 1, "actual": 0.9}}})
+
+    def test_cached_readings(self, probe):
+        """Signals are answered from readings younger than the max age."""
+        probe.return_value.acquire.return_value = {"0": {0: [30.5]}}
+        probe.return_value.setTiming = {"0": {0: {}}}
+        blk = AquaCheck()
+        self.configure_block(blk, {"maxAge": 60})
+        blk.start()
+        blk.process_signals([Signal(), Signal()])
+        blk.process_signals([Signal()])
+        self.assertEqual(probe.return_value.acquire.call_count, 1)
+        self.assert_num_signals_notified(3)
+        blk._reading = (blk._reading[0] - 61, blk._reading[1])
+        blk.process_signals([Signal()])
+        self.assertEqual(probe.return_value.acquire.call_count, 2)
+        blk.stop()
+
+    def test_background_poll_cache(self, probe):
+        """With a poll interval and no max age, signals use any reading."""
+        probe.return_value.acquire.return_value = {"0": {0: [30.5]}}
+        probe.return_value.setTiming = {"0": {0: {}}}
+        blk = AquaCheck()
+        self.configure_block(blk, {"pollInterval": 3600})
+        blk.start()
+        blk.process_signals([Signal()])
+        blk._reading = (blk._reading[0] - 7200, blk._reading[1])
+        blk.process_signals([Signal()])
+        blk.stop()
+        self.assertEqual(probe.return_value.acquire.call_count, 1)
+        self.assert_num_signals_notified(2)
+
+    def test_every_probe_failed(self, probe):
+        """A bus on which no probe answered has no data, however many
+        probes it has."""
+        probe.return_value.acquire.return_value = \
+            {"1": {0: None}, "2": {0: None}}
+        probe.return_value.setTiming = {"1": {0: {}}, "2": {0: {}}}
+        blk = AquaCheck()
+        self.configure_block(blk, {"addresses": "1, 2"})
+        blk.start()
+        blk.process_signals([Signal()])
+        self.assert_num_signals_notified(0)
+        blk.stop()
+        blk = AquaCheck()
+        self.configure_block(blk, {"buses": [
+            {"port": "/dev/ttymxc1", "addresses": "1, 2"}]})
+        blk.start()
+        blk.process_signals([Signal()])
+        blk.stop()
+        signal = self.last_notified[DEFAULT_TERMINAL][0].to_dict()
+        self.assertDictEqual(signal["/dev/ttymxc1"], {"status": "no data"})
+
+    def test_concurrent_requests_share_poll(self, probe):
+        """Requests arriving during a poll wait for it instead of polling."""
+        def acquire(*args, **kwargs):
+            time.sleep(0.2)
+            return {"0": {0: [30.5]}}
+        probe.return_value.acquire.side_effect = acquire
+        probe.return_value.setTiming = {"0": {0: {}}}
+        blk = AquaCheck()
+        self.configure_block(blk, {})
+        blk.start()
+        Timer(0.05, blk.process_signals, ([Signal()],)).start()
+        blk.process_signals([Signal()])
+        time.sleep(0.1)
+        blk.stop()
+        self.assertEqual(probe.return_value.acquire.call_count, 1)
+        self.assert_num_signals_notified(2)
+
+    def test_buses_polled_in_parallel(self, probe):
+        """Each bus is polled on its own thread, results keyed by port."""
+        ports = {
+            "/dev/ttymxc1": FakeSDI12Port([
+                FakeSDI12Sensor("0", [30.5], measurement_time=0.5)]),
+            "/dev/ttymxc2": FakeSDI12Port([
+                FakeSDI12Sensor("1", [12.0], measurement_time=0.5),
+                FakeSDI12Sensor("2", [13.0], measurement_time=0.5)]),
+            "/dev/ttymxc3": FakeSDI12Port([])}
+        probe.side_effect = lambda port, **kwargs: SDI12AquaCheck(
+            ports[port], **kwargs)
+        blk = AquaCheck()
+        self.configure_block(blk, {"buses": [
+            {"port": "/dev/ttymxc1", "addresses": "0"},
+            {"port": "/dev/ttymxc2", "addresses": "1, 2"},
+            {"port": "/dev/ttymxc3", "addresses": "0"}]})
+        blk.start()
+        start = time.monotonic()
+        blk.process_signals([Signal()])
+        elapsed = time.monotonic() - start
+        stats = blk.stats()
+        blk.stop()
+        # the bus without probes times out after 2 seconds, one at a time
+        # the buses would take 3.5
+        self.assertLess(elapsed, 2.5)
+        self.assertListEqual(sorted(stats), sorted(ports))
+        signal = self.last_notified[DEFAULT_TERMINAL][0]
+        self.assertEqual(signal.to_dict()["/dev/ttymxc1"]["default"], [30.5])
+        self.assertEqual(signal.to_dict()["/dev/ttymxc1"]["status"], "ok")
+        self.assertDictEqual(signal.to_dict()["/dev/ttymxc2"]["default"],
+                             {"1": [12.0], "2": [13.0]})
+        self.assertDictEqual(signal.to_dict()["/dev/ttymxc3"],
+                             {"status": "no data"})
+
+
+class TestAsyncSDI12AquaCheck(NIOTestCase):
+
+    def test_buses_polled_on_one_loop(self):
+        """Probes on separate buses are polled concurrently."""
+        probes = [AsyncSDI12AquaCheck(FakeSDI12Port([
+            FakeSDI12Sensor("0", [bus, -1.5], measurement_time=0.5)]))
+            for bus in range(10)]
+        for probe in probes:
+            self.addCleanup(probe.aquaCheckSDI12.end)
+
+        async def poll():
+            return await asyncio.gather(
+                *(probe.pollProbe(0, crc=True) for probe in probes))
+        start = time.monotonic()
+        self.assertListEqual(asyncio.run(poll()), [0] * 10)
+        self.assertLess(time.monotonic() - start, 2)
+        self.assertListEqual(probes[3].moistureData, [3.0, -1.5])
+        self.assertLess(probes[3].measurementTiming["actual"], 1)
+
+    def test_same_api_as_sync(self):
+        """Every way of reading probes is a coroutine, with the results of
+        SDI12AquaCheck."""
+        probe = AsyncSDI12AquaCheck(FakeSDI12Port([
+            FakeSDI12Sensor("0", [1.5, -2.0], continuous=True),
+            FakeSDI12Sensor("1", {0: [12.0], 1: [21.5]},
+                            measurement_time=0.2)]))
+        self.addCleanup(probe.aquaCheckSDI12.end)
+
+        async def read():
+            return [
+                await probe.identify("0"),
+                await probe.supportsContinuous("0"),
+                await probe.readProbe(0, "0", ReadMode.AUTO),
+                await probe.pollBus(0, ["0", "1"]),
+                await probe.acquire([0, 1], ["1"], crc=True,
+                                    retryPolicy=RetryPolicy(deadline=5))]
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            self.assertListEqual(asyncio.run(read()), [
+                "13FAKESDI 001", True, 0,
+                {"0": [1.5, -2.0], "1": [12.0]},
+                {"1": {0: [12.0], 1: [21.5]}}])
+        self.assertListEqual(probe.moistureData, [12.0])
+        self.assertIsNone(probe._deadline)
+
+
+@patch(SDI12Bus.__module__ + ".SDI12AquaCheck")
+class TestSDI12Bus(NIOTestCase):
+
+    def test_shared_per_port(self, probe):
+        bus = SDI12Bus.shared("/dev/ttymxc1")
+        self.assertIs(SDI12Bus.shared("/dev/ttymxc1"), bus)
+        self.assertIsNot(SDI12Bus.shared("/dev/ttymxc2"), bus)
+        SDI12Bus.shared("/dev/ttymxc2").release()
+        bus.release()
+        self.assertEqual(probe.return_value.aquaCheckSDI12.end.call_count, 0)
+        bus.release()
+        self.assertEqual(probe.return_value.aquaCheckSDI12.end.call_count, 1)
+        self.assertIsNot(SDI12Bus.shared("/dev/ttymxc1"), bus)
+
+    def test_priorities_and_deadlines(self, probe):
+        """Queued transactions run by priority, expired ones are dropped."""
+        bus = SDI12Bus("/dev/ttymxc1")
+        self.addCleanup(bus.close)
+        order = []
+        started = Event()
+        busy = bus.submit(lambda probe: started.set() or time.sleep(0.2))
+        started.wait(1)
+        futures = [
+            bus.submit(lambda probe: order.append("low"), priority=5),
+            bus.submit(lambda probe: order.append("late"), deadline=0.05),
+            bus.submit(lambda probe: order.append("high"), priority=-1),
+            bus.submit(lambda probe: order.append("normal"))]
+        self.assertEqual(bus.stats()["depth"], 4)
+        for future in [busy] + futures:
+            try:
+                future.result()
+            except SDI12DeadlineExpired:
+                pass
+        self.assertListEqual(order, ["high", "normal", "low"])
+        self.assertIsInstance(futures[1].exception(), SDI12DeadlineExpired)
+        stats = bus.stats()
+        self.assertEqual(stats["completed"], 4)
+        self.assertEqual(stats["expired"], 1)
+        self.assertGreaterEqual(stats["wait_max"], 0.2)
+
+
+class TestSDI12Parser(NIOTestCase):
+
+    def test_corpus(self):
+        for response, address, crc, values in RESPONSES:
+            self.assertListEqual(
+                parseDataResponse(response, address, crc), values)
+
+    def test_bad_responses(self):
+        self.assertEqual(sdi12CRC("0+3.14"), "OqZ")
+        with self.assertRaises(SDI12CRCError):
+            parseDataResponse("0+3.15OqZ\r\n", "0", crc=True)
+        for response in ("0+1.5+2", "1+1.5\r\n", "0+1.5\x00+2\r\n",
+                         "0+1.5+\r\n"):
+            with self.assertRaises(SDI12ResponseError):
+                parseDataResponse(response, "0")
+
+
+class TestSimulatedSensors(NIOTestCase):
+
+    def test_pty(self):
+        """Probes behind a pseudo terminal are read through the driver."""
+        pty = FakeSDI12Pty([
+            FakeSDI12Sensor("0", [30.5, 31.0, 29.8, 12.25]),
+            FakeSDI12Sensor("1", [12.0], measurement_time=0.2)])
+        self.addCleanup(pty.close)
+        aq = SDI12AquaCheck(pty.port, sendMarking=False)
+        self.addCleanup(aq.aquaCheckSDI12.end)
+        self.assertDictEqual(aq.acquire([0], ["0", "1"], crc=True), {
+            "0": {0: [30.5, 31.0, 29.8, 12.25]}, "1": {0: [12.0]}})
+        self.assertEqual(aq.pollProbe(0, "1"), 0)
+        self.assertListEqual(aq.moistureData, [12.0])
+
+    def test_noisy_bus(self):
+        """Without echo and with CRC errors the values still come through,
+        the data sets failing their CRC asked for again."""
+        sensor = FakeSDI12Sensor("0", [1.5, -2.0], crc_error_rate=0.5,
+                                 seed=3)
+        aq = SDI12AquaCheck(FakeSDI12Port([sensor], echo=False, jitter=0.02,
+                                          seed=3))
+        self.addCleanup(aq.aquaCheckSDI12.end)
+        for _ in range(3):
+            self.assertDictEqual(
+                aq.acquire([0], ["0"], crc=True,
+                           retryPolicy=RetryPolicy(attempts=10)),
+                {"0": {0: [1.5, -2.0]}})
+        self.assertGreater(sensor.crc_errors, 0)
+        self.assertEqual(sensor.commands.count("0MC0!"), 3)
+
+    def test_full_data_set(self):
+        """Data sets of the longest length the spec allows fit the buffer."""
+        values = [-1234.56, 1234.56, 9876.54, -9876.54, 1111.11, -2222.22,
+                  3333.33, -4444.44, 5555.55]
+        sensors = [FakeSDI12Sensor("0", values, values_per_set=9),
+                   FakeSDI12Sensor("1", values, values_per_set=9)]
+        aq = SDI12AquaCheck(FakeSDI12Port(sensors))
+        self.addCleanup(aq.aquaCheckSDI12.end)
+        self.assertDictEqual(aq.acquire([0], ["0", "1"], crc=True), {
+            "0": {0: values}, "1": {0: values}})
+        self.assertEqual(aq.aquaCheckSDI12._rxBuffer.overflowCount, 0)
+
+    def test_dropped_bytes(self):
+        """A probe whose responses are lost reports no values."""
+        port = FakeSDI12Port([FakeSDI12Sensor("0")], drop_rate=1)
+        aq = SDI12AquaCheck(port)
+        self.addCleanup(aq.aquaCheckSDI12.end)
+        self.assertDictEqual(
+            aq.acquire([0], ["0"], retryPolicy=RetryPolicy(silentAttempts=1)),
+            {"0": {0: None}})
+        self.assertGreater(port.line.dropped, 0)
@@ -0,0 +1,293 @@
+from threading import Event, Thread
+from time import sleep
+from unittest.mock import MagicMock, patch
+from nio.testing.test_case import NIOTestCase
+from .. import gpio_backends, gpio_device
+from ..gpio_backends import CdevBackend, SysfsBackend
+from ..gpio_device import GPIODevice, GPIOManager
+from ..gpio_pulse_counter_block import PulseAccumulator
+from .fake_gpio import FakeSysfs, MockGPIOChips
+
+
+class TestGPIODevice(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sysfs = FakeSysfs().__enter__()
+        patcher = patch.object(gpio_backends, "GPIO", self.sysfs.GPIO,
+                               create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(CdevBackend, "available", return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.sysfs.__exit__)
+
+    def _sysfs_device(self, **kwargs):
+        backend = SysfsBackend(MagicMock(), **kwargs)
+        return GPIODevice(MagicMock(), GPIOManager(MagicMock(), backend))
+
+    def test_read_reuses_open_pin(self):
+        """A pin is opened once and kept open across reads."""
+        gpio = self._sysfs_device()
+        self.sysfs.set_value(3, True)
+        self.assertTrue(gpio.read(3))
+        self.sysfs.set_value(3, False)
+        self.assertFalse(gpio.read(3))
+        self.assertEqual(self.sysfs.opened, 1)
+        self.assertEqual(self.sysfs.open_handles, 1)
+        gpio.close()
+        self.assertEqual(self.sysfs.open_handles, 0)
+
+    def test_write_sets_direction_once(self):
+        """The first write makes the pin an output, later ones only write."""
+        gpio = self._sysfs_device()
+        gpio.write(4, True)
+        self.assertEqual(self.sysfs.get_direction(4), "out")
+        self.assertTrue(self.sysfs.get_value(4))
+        gpio.write(4, False)
+        self.assertFalse(self.sysfs.get_value(4))
+        self.assertEqual(self.sysfs.opened, 1)
+        # reading the pin turns it back into an input
+        gpio.read(4)
+        self.assertEqual(self.sysfs.get_direction(4), "in")
+        gpio.close()
+
+    def test_handle_cap(self):
+        """Least recently used pins are closed when the pool is full."""
+        gpio = self._sysfs_device(max_handles=2)
+        for pin in (1, 2, 1, 3):
+            gpio.read(pin)
+        self.assertEqual(self.sysfs.open_handles, 2)
+        self.assertIn(1, gpio._backend.pool)
+        self.assertNotIn(2, gpio._backend.pool)
+        gpio.close()
+
+    def test_pooling_disabled(self):
+        """With no handles allowed each operation opens and closes the pin."""
+        gpio = self._sysfs_device(max_handles=0)
+        gpio.read(1)
+        gpio.write(1, True)
+        self.assertEqual(self.sysfs.opened, 2)
+        self.assertEqual(self.sysfs.open_handles, 0)
+
+    @patch("time.monotonic")
+    def test_idle_eviction(self, monotonic):
+        """Handles unused for longer than the idle timeout are closed."""
+        monotonic.return_value = 100
+        gpio = self._sysfs_device(idle_timeout=10)
+        gpio.read(1)
+        gpio.read(2)
+        monotonic.return_value = 111
+        gpio.read(3)
+        self.assertEqual(len(gpio._backend.pool), 1)
+        self.assertIn(3, gpio._backend.pool)
+        monotonic.return_value = 122
+        gpio._backend.pool.evict_idle()
+        self.assertEqual(len(gpio._backend.pool), 0)
+        gpio.close()
+
+    def test_idle_handles_closed_unused(self):
+        """Idle handles are closed without any later use of the pool."""
+        gpio = self._sysfs_device(idle_timeout=0.1)
+        gpio.read(1)
+        self.assertEqual(self.sysfs.open_handles, 1)
+        sleep(0.5)
+        self.assertEqual(self.sysfs.open_handles, 0)
+        # the thread only runs while handles are open
+        self.assertIsNone(gpio._backend.pool._reaper)
+        gpio.close()
+
+    @patch("{}.get_nio_logger".format(gpio_device.__name__))
+    def test_shared_pool_options(self, get_logger):
+        """Pool settings given to the shared manager reach the backend."""
+        gpio = GPIODevice(MagicMock(), GPIOManager.shared(
+            max_handles=4, idle_timeout=5))
+        # the device took its own reference
+        GPIOManager._shared.release()
+        pool = gpio._backend.pool
+        self.assertEqual((pool.max_handles, pool.idle_timeout), (4, 5))
+        gpio.close()
+        self.assertIsNone(GPIOManager._shared)
+
+    @patch("{}.get_nio_logger".format(gpio_device.__name__))
+    def test_shared_manager(self, get_logger):
+        """Devices share one manager that closes pins with the last device."""
+        first = GPIODevice(MagicMock())
+        second = GPIODevice(MagicMock())
+        self.assertIs(first._manager, second._manager)
+        first.read(1)
+        second.read(1)
+        self.assertEqual(self.sysfs.opened, 1)
+        first.close()
+        self.assertEqual(self.sysfs.open_handles, 1)
+        second.close()
+        self.assertEqual(self.sysfs.open_handles, 0)
+        self.assertIsNone(GPIOManager._shared)
+
+    def test_per_pin_locks(self):
+        """A held pin does not block other pins, only the same pin."""
+        manager = GPIOManager(MagicMock(), SysfsBackend(MagicMock()))
+        gpio = GPIODevice(MagicMock(), manager)
+        read_other = Event()
+        read_same = Event()
+        with manager.pin_lock(1):
+            Thread(target=lambda: (gpio.read(2), read_other.set())).start()
+            Thread(target=lambda: (gpio.read(1), read_same.set())).start()
+            self.assertTrue(read_other.wait(1))
+            self.assertFalse(read_same.wait(0.1))
+        self.assertTrue(read_same.wait(1))
+        gpio.close()
+
+
+class TestCdevBackend(NIOTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.chips = MockGPIOChips()
+        backend = CdevBackend(MagicMock(), syscalls=self.chips)
+        self.gpio = GPIODevice(MagicMock(),
+                               GPIOManager(MagicMock(), backend))
+
+    def test_read_many_one_ioctl_per_chip(self):
+        """Pins of a chip are read together once they are requested."""
+        for pin in (1, 5, 33):
+            self.chips.set_level(pin, True)
+        self.assertDictEqual(self.gpio.read_many([1, 2, 5, 33]),
+                             {1: True, 2: False, 5: True, 33: True})
+        self.chips.ioctls = 0
+        self.chips.set_level(2, True)
+        self.assertDictEqual(self.gpio.read_many([1, 2, 5, 33]),
+                             {1: True, 2: True, 5: True, 33: True})
+        # one read per chip, no new line requests
+        self.assertEqual(self.chips.ioctls, 2)
+
+    def test_write_many(self):
+        """Writes drive outputs and keep levels of other requested lines."""
+        self.gpio.write_many({3: True, 4: False})
+        self.assertEqual(self.chips.get_direction(3), "out")
+        self.chips.ioctls = 0
+        self.gpio.write(4, True)
+        self.assertEqual(self.chips.ioctls, 1)
+        self.assertTrue(self.chips.get_level(3))
+        self.assertTrue(self.chips.get_level(4))
+        self.gpio.write(9, True)
+        self.assertTrue(self.chips.get_level(3))
+        self.assertTrue(self.chips.get_level(9))
+
+    def test_direction_change(self):
+        """A line moves between the input and output requests."""
+        self.gpio.write_many({3: True, 4: True})
+        self.chips.set_level(4, False)
+        self.assertFalse(self.gpio.read(4))
+        self.assertEqual(self.chips.get_direction(4), "in")
+        self.assertEqual(self.chips.get_direction(3), "out")
+        self.gpio.write(4, True)
+        self.assertEqual(self.chips.get_direction(4), "out")
+        self.assertTrue(self.chips.get_level(4))
+
+    def test_close_releases_lines(self):
+        self.gpio.read_many([1, 40])
+        self.gpio.write(2, True)
+        self.gpio.close()
+        self.assertDictEqual(self.chips.held, {})
+        self.assertDictEqual(self.chips._fds, {})
+
+    def test_interrupts(self):
+        """Edges on watched pins are reported with their kernel timestamp."""
+        edges = []
+        received = Event()
+
+        def callback(pin, value, timestamp):
+            edges.append((pin, value, timestamp))
+            if len(edges) == 3:
+                received.set()
+
+        self.gpio.interrupt(callback, 7, "both")
+        self.gpio.interrupt(callback, 40, "rising")
+        self.chips.inject_edge(7, True, 1.5)
+        self.chips.inject_edge(40, True, 2.5)
+        self.chips.inject_edge(7, False, 3.5)
+        self.assertTrue(received.wait(1))
+        self.assertListEqual(sorted(edges), [(7, False, 3.5), (7, True, 1.5),
+                                             (40, True, 2.5)])
+        self.gpio.remove_interrupt(40)
+        self.assertNotIn((1, 8), self.chips.held)
+        self.gpio.close()
+        self.assertDictEqual(self.chips.held, {})
+
+    def test_interrupt_replaced(self):
+        """Watching a watched pin again replaces its event request."""
+        first, second = MagicMock(), MagicMock()
+        received = Event()
+        second.side_effect = lambda *args: received.set()
+        self.gpio.interrupt(first, 7, "both")
+        self.gpio.interrupt(second, 7, "rising")
+        self.chips.inject_edge(7, True, 1.5)
+        self.assertTrue(received.wait(1))
+        second.assert_called_once_with(7, True, 1.5)
+        first.assert_not_called()
+        counter = PulseAccumulator(1)
+        self.gpio.count_pulses(7, "rising", counter, 0)
+        self.gpio.close()
+        self.assertDictEqual(self.chips.held, {})
+
+    def test_read_watched_pin(self):
+        """Watched pins are read through their event request, and a failed
+        widening keeps the lines already held."""
+        self.gpio.read(1)
+        self.gpio.interrupt(MagicMock(), 3, "both")
+        self.chips.set_level(3, True)
+        self.assertDictEqual(self.gpio.read_many([2, 3]),
+                             {2: False, 3: True})
+        self.assertIn((0, 1), self.chips.held)
+        self.chips.held[(0, 5)] = -1
+        with self.assertRaises(OSError):
+            self.gpio.read_many([1, 5])
+        del self.chips.held[(0, 5)]
+        self.assertIn((0, 1), self.chips.held)
+        self.assertIn((0, 2), self.chips.held)
+        self.gpio.remove_interrupt(3)
+        self.gpio.read(3)
+        self.assertEqual(self.chips.held[(0, 3)], self.chips.held[(0, 1)])
+        self.gpio.close()
+        self.assertDictEqual(self.chips.held, {})
+
+    def test_count_pulses(self):
+        """Edges are recorded into a counter without callbacks."""
+        counter = PulseAccumulator(2, ring_size=4)
+        self.gpio.count_pulses(7, "rising", counter, 0)
+        self.gpio.count_pulses(8, "rising", counter, 1)
+        for i in range(6):
+            self.chips.inject_edge(7, True, 10 + i * 0.5)
+        self.chips.inject_edge(8, True, 1)
+        for _ in range(100):
+            if counter.counts[0] == 6 and counter.counts[1] == 1:
+                break
+            sleep(0.01)
+        report = counter.report(0)
+        self.assertEqual(report["count"], 6)
+        self.assertEqual(report["total"], 6)
+        # only the last 4 edge times are kept
+        self.assertEqual(report["interval_min"], 0.5)
+        self.assertEqual(report["interval_max"], 0.5)
+        self.assertEqual(counter.report(0)["count"], 0)
+        self.assertEqual(counter.report(1)["count"], 1)
+        self.gpio.close()
+
+    def test_redundant_writes_skipped(self):
+        """Writes of the level a pin already has are skipped."""
+        self.assertTrue(self.gpio.write(3, True))
+        self.chips.ioctls = 0
+        self.assertFalse(self.gpio.write(3, 1))
+        self.assertEqual(self.gpio.write_many({3: True, 4: False}), 1)
+        # only pin 4 is written: check its line is free, widen the
+        # request and set the levels
+        self.assertEqual(self.chips.ioctls, 3)
+        self.assertTrue(self.gpio.write(3, True, force=True))
+        self.assertEqual(self.gpio.write_many({3: True, 4: False}, True), 2)
+        # reading the pin makes it an input, the next write must happen
+        self.gpio.read(3)
+        self.assertTrue(self.gpio.write(3, True))
+        self.assertEqual(self.chips.get_direction(3), "out")
+        self.gpio.close()
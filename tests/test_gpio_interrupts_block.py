@@ -0,0 +1,114 @@
+from time import sleep
+from unittest.mock import patch
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..gpio_interrupts_block import GPIOInterrupts
+from .fake_gpio import FakeGPIOEnvironment
+
+
+@patch(GPIOInterrupts.__module__ + ".GPIODevice")
+class TestGPIOInterrupts(NIOBlockTestCase):
+
+    def test_edges_notified(self, device):
+        """Every edge is notified and pins are watched from start."""
+        blk = GPIOInterrupts()
+        self.configure_block(blk, {"pins": "3-4"})
+        blk.start()
+        self.assertEqual(device.return_value.interrupt.call_count, 2)
+        blk._callback(3, True, 1.0)
+        blk._callback(4, False, 1.5)
+        blk.stop()
+        self.assert_num_signals_notified(2)
+        self.assertDictEqual(
+            self.last_notified[DEFAULT_TERMINAL][1].to_dict(),
+            {"pin": 4, "value": False, "timestamp": 1.5})
+
+    def test_debounce(self, device):
+        """Edges within a pin's debounce window are dropped."""
+        blk = GPIOInterrupts()
+        self.configure_block(blk, {
+            "pins": "3-4",
+            "debounce": 0.01,
+            "pin_debounce": [{"pin": 4, "window": 0}]})
+        blk.start()
+        for timestamp in (1.0, 1.005, 1.009, 1.02):
+            blk._callback(3, True, timestamp)
+            blk._callback(4, True, timestamp)
+        blk.stop()
+        self.assert_num_signals_notified(6)
+        self.assertDictEqual(blk.stats(), {
+            "edges": 8, "debounced": 2, "folded": 0, "batches": 0})
+
+    def test_coalesce(self, device):
+        """Edges are counted per pin and notified together."""
+        blk = GPIOInterrupts()
+        self.configure_block(blk, {
+            "pins": "3-4",
+            "debounce": 0.01,
+            "coalesce": {"enabled": True, "interval": 60, "max_edges": 4}})
+        blk.start()
+        blk._coalesce(3, True, 1.0)
+        blk._coalesce(3, False, 1.001)
+        blk._coalesce(3, False, 1.5)
+        blk._coalesce(4, True, 1.6)
+        self.assert_num_signals_notified(0)
+        blk._coalesce(4, False, 1.7)
+        self.assert_num_signals_notified(2)
+        self.assertDictEqual(
+            self.last_notified[DEFAULT_TERMINAL][0].to_dict(),
+            {"pin": 3, "value": False, "count": 2, "first_timestamp": 1.0,
+             "last_timestamp": 1.5, "debounced": 1})
+        self.assertDictEqual(
+            self.last_notified[DEFAULT_TERMINAL][1].to_dict(),
+            {"pin": 4, "value": False, "count": 2, "first_timestamp": 1.6,
+             "last_timestamp": 1.7, "debounced": 0})
+        blk._coalesce(4, True, 1.8)
+        blk.stop()
+        # pending edges are notified on stop
+        self.assert_num_signals_notified(3)
+        self.assertEqual(blk.stats()["folded"], 2)
+
+    def test_coalesce_debounced_only(self, device):
+        """Pins with only debounced edges in a batch are not notified."""
+        blk = GPIOInterrupts()
+        self.configure_block(blk, {
+            "pins": "3-4",
+            "debounce": 0.01,
+            "coalesce": {"enabled": True, "interval": 60}})
+        blk.start()
+        blk._coalesce(3, True, 1.0)
+        blk._flush()
+        self.assert_num_signals_notified(1)
+        blk._coalesce(3, False, 1.005)
+        blk._flush()
+        self.assert_num_signals_notified(1)
+        blk._coalesce(3, True, 1.008)
+        blk._coalesce(4, True, 1.008)
+        blk.stop()
+        self.assert_num_signals_notified(2)
+        self.assertEqual(
+            self.last_notified[DEFAULT_TERMINAL][1].to_dict()["pin"], 4)
+        self.assertEqual(blk.stats()["batches"], 2)
+
+
+class TestGPIOInterruptsFakeChips(NIOBlockTestCase):
+
+    def test_injected_edges(self):
+        """Edges injected into the stand-in chips are notified."""
+        with FakeGPIOEnvironment() as env:
+            blk = GPIOInterrupts()
+            self.configure_block(blk, {"pins": "3-4"})
+            blk.start()
+            env.chips.inject_edge(3, True, timestamp=1.0)
+            env.chips.inject_edge(4, False, timestamp=1.5)
+            for _ in range(100):
+                if len(self.last_notified[DEFAULT_TERMINAL]) == 2:
+                    break
+                sleep(0.01)
+            blk.stop()
+        signals = sorted((signal.to_dict() for signal
+                          in self.last_notified[DEFAULT_TERMINAL]),
+                         key=lambda signal: signal["pin"])
+        self.assertListEqual(signals, [
+            {"pin": 3, "value": True, "timestamp": 1.0},
+            {"pin": 4, "value": False, "timestamp": 1.5}])
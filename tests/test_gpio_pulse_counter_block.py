@@ -0,0 +1,92 @@
+from datetime import timedelta
+from time import sleep
+from unittest.mock import patch
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..gpio_pulse_counter_block import GPIOPulseCounter
+from .fake_gpio import FakeGPIOEnvironment
+
+
+@patch(GPIOPulseCounter.__module__ + ".time")
+class TestGPIOPulseCounter(NIOBlockTestCase):
+
+    def wait_for_counts(self, blk, counts):
+        for _ in range(100):
+            if list(blk._counter.counts) == counts:
+                return
+            sleep(0.01)
+        self.fail("Counted {} edges, not {}".format(
+            list(blk._counter.counts), counts))
+
+    def test_pulses_counted(self, time):
+        """Edges on each pin are counted into the signals processed."""
+        time.monotonic.return_value = 100.0
+        with FakeGPIOEnvironment() as env:
+            blk = GPIOPulseCounter()
+            self.configure_block(blk, {"pins": "3-4"})
+            blk.start()
+            for i in range(5):
+                env.chips.inject_edge(3, True, timestamp=1 + i * 0.25)
+            env.chips.inject_edge(4, True, timestamp=2.0)
+            self.wait_for_counts(blk, [5, 1])
+            time.monotonic.return_value = 102.0
+            blk.process_signals([Signal({"name": "first"})])
+            time.monotonic.return_value = 104.0
+            blk.process_signals([Signal({"name": "second"})])
+            blk.stop()
+        first, second = [signal.to_dict()
+                         for signal in self.last_notified[DEFAULT_TERMINAL]]
+        self.assertEqual(first["name"], "first")
+        self.assertDictEqual(first["pulses"], {
+            3: {"count": 5, "total": 5, "frequency": 2.5,
+                "interval_min": 0.25, "interval_mean": 0.25,
+                "interval_max": 0.25},
+            4: {"count": 1, "total": 1, "frequency": 0.5,
+                "interval_min": None, "interval_mean": None,
+                "interval_max": None}})
+        # counts and frequency start over from the last signal
+        self.assertEqual(second["pulses"][3]["count"], 0)
+        self.assertEqual(second["pulses"][3]["total"], 5)
+        self.assertEqual(second["pulses"][3]["frequency"], 0)
+
+    def test_periodic_report(self, time):
+        """Reports are notified on their own, counting without reset."""
+        time.monotonic.return_value = 100.0
+        with FakeGPIOEnvironment() as env, \
+                patch(GPIOPulseCounter.__module__ + ".Job") as job:
+            blk = GPIOPulseCounter()
+            self.configure_block(blk, {
+                "pin": 7, "edge": "falling", "report_interval": 0.5,
+                "reset_on_report": False})
+            blk.start()
+            job.assert_called_once_with(
+                blk._report, timedelta(seconds=0.5), True)
+            env.chips.inject_edge(7, False, timestamp=1.0)
+            self.wait_for_counts(blk, [1])
+            time.monotonic.return_value = 101.0
+            blk._report()
+            time.monotonic.return_value = 102.0
+            blk._report()
+            blk.stop()
+            job.return_value.cancel.assert_called_once_with()
+        reports = [signal.to_dict()["pulses"][7]
+                   for signal in self.last_notified[DEFAULT_TERMINAL]]
+        self.assertListEqual([report["count"] for report in reports], [1, 1])
+        self.assertListEqual([report["frequency"] for report in reports],
+                             [1, 0.5])
+
+    def test_duplicate_pins(self, time):
+        """A pin listed twice is watched and reported once."""
+        time.monotonic.return_value = 100.0
+        with FakeGPIOEnvironment() as env:
+            blk = GPIOPulseCounter()
+            self.configure_block(blk, {"pins": "3, 3-4"})
+            blk.start()
+            env.chips.inject_edge(3, True, timestamp=1.0)
+            self.wait_for_counts(blk, [1, 0])
+            blk.process_signals([Signal()])
+            blk.stop()
+        pulses = self.last_notified[DEFAULT_TERMINAL][0].to_dict()["pulses"]
+        self.assertListEqual(sorted(pulses), [3, 4])
+        self.assertEqual(pulses[3]["count"], 1)
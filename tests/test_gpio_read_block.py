@@ -0,0 +1,105 @@
+from time import sleep
+from unittest.mock import MagicMock, patch
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..gpio_read_block import GPIORead, parse_pins
+from ..gpio_sampler import GPIOSampler
+
+
+class TestGPIORead(NIOBlockTestCase):
+
+    def test_parse_pins(self):
+        self.assertEqual(parse_pins(3), [3])
+        self.assertEqual(parse_pins([1, "2"]), [1, 2])
+        self.assertEqual(parse_pins("0-3, 8,10-11"), [0, 1, 2, 3, 8, 10, 11])
+        with self.assertRaises(ValueError):
+            parse_pins("5-2")
+
+    @patch(GPIORead.__module__ + ".GPIODevice")
+    def test_single_pin(self, device):
+        """Without a pin list the pin value is set on each signal."""
+        device.return_value.read_many.return_value = {0: True}
+        blk = GPIORead()
+        self.configure_block(blk, {})
+        blk.start()
+        blk.process_signals([Signal(), Signal()])
+        blk.stop()
+        device.return_value.read_many.assert_called_once_with({0})
+        self.assert_num_signals_notified(2)
+        self.assertTrue(self.last_notified[DEFAULT_TERMINAL][0].value)
+
+    @patch(GPIORead.__module__ + ".GPIODevice")
+    def test_pin_lists_read_once(self, device):
+        """Pins of all signals in a batch are read together."""
+        device.return_value.read_many.return_value = \
+            {0: True, 1: False, 2: True, 5: True}
+        blk = GPIORead()
+        self.configure_block(blk, {"pins": "{{ $pins }}"})
+        blk.start()
+        blk.process_signals([Signal({"pins": "0-2"}),
+                             Signal({"pins": [5, 0]})])
+        blk.stop()
+        device.return_value.read_many.assert_called_once_with({0, 1, 2, 5})
+        self.assertDictEqual(self.last_notified[DEFAULT_TERMINAL][0].value,
+                             {0: True, 1: False, 2: True})
+        self.assertDictEqual(self.last_notified[DEFAULT_TERMINAL][1].value,
+                             {5: True, 0: True})
+
+    @patch(GPIORead.__module__ + ".GPIODevice")
+    def test_mask_format(self, device):
+        """Pin lists can be reported as a bit mask in list order."""
+        device.return_value.read_many.return_value = \
+            {0: True, 1: False, 2: True}
+        blk = GPIORead()
+        self.configure_block(blk, {"pins": "0-2", "pins_format": "mask"})
+        blk.start()
+        blk.process_signals([Signal()])
+        blk.stop()
+        self.assertEqual(self.last_notified[DEFAULT_TERMINAL][0].value, 0b101)
+
+    def test_sampler_windows(self):
+        """Samples are packed per pin and emitted a window at a time."""
+        gpio = MagicMock()
+        gpio.read_many.side_effect = lambda pins: {2: True, 3: False}
+        windows = []
+        sampler = GPIOSampler(gpio, [2, 3], 1000, 5, MagicMock(),
+                              on_window=lambda *args: windows.append(args))
+        sampler.start()
+        for _ in range(100):
+            if windows:
+                break
+            sleep(0.01)
+        sampler.stop()
+        timestamps, samples, overruns = windows[0]
+        self.assertEqual(len(timestamps), 5)
+        self.assertListEqual(samples, [0b01] * 5)
+
+    @patch(GPIORead.__module__ + ".GPIODevice")
+    def test_sampler_settings(self, device):
+        """Settings the sampler thread cannot run with are rejected."""
+        for rate, window_size in ((0, 5), (-1, 5), (10, 0)):
+            with self.assertRaises(ValueError):
+                GPIOSampler(MagicMock(), [1], rate, window_size, MagicMock())
+        blk = GPIORead()
+        self.configure_block(blk, {"sample_rate": 10, "window_size": 0})
+        with self.assertRaises(ValueError):
+            blk.start()
+        blk.stop()
+
+    def test_sampler_changes(self):
+        """Only samples that differ from the previous one are emitted."""
+        gpio = MagicMock()
+        levels = iter([False, False, True, True, False] + [False] * 1000)
+        gpio.read_many.side_effect = lambda pins: {7: next(levels)}
+        changes = []
+        sampler = GPIOSampler(gpio, [7], 1000, 100, MagicMock(),
+                              on_change=lambda *args: changes.append(args))
+        sampler.start()
+        for _ in range(100):
+            if len(changes) == 2:
+                break
+            sleep(0.01)
+        sampler.stop()
+        self.assertListEqual([change[1:] for change in changes],
+                             [(1, 1), (0, 1)])
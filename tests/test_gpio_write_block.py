@@ -0,0 +1,64 @@
+from time import sleep
+from unittest.mock import call, patch
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..gpio_waveform import parse_waveform
+from ..gpio_write_block import GPIOWrite
+
+
+class TestGPIOWrite(NIOBlockTestCase):
+
+    @patch(GPIOWrite.__module__ + ".GPIODevice")
+    def test_batch_collapsed(self, device):
+        """Only the last value of each pin in a batch is written."""
+        device.return_value.write_many.return_value = 1
+        blk = GPIOWrite()
+        self.configure_block(blk, {"pin": "{{ $pin }}", "value": "{{ $on }}"})
+        blk.start()
+        blk.process_signals([Signal({"pin": 1, "on": True}),
+                             Signal({"pin": 2, "on": True}),
+                             Signal({"pin": 1, "on": False})])
+        blk.stop()
+        device.return_value.write_many.assert_called_once_with(
+            {2: True, 1: False}, False)
+        self.assert_num_signals_notified(3)
+        self.assertDictEqual(blk.stats(), {"written": 1,
+                                           "skipped_collapsed": 1,
+                                           "skipped_redundant": 1})
+
+    def test_parse_waveform(self):
+        self.assertEqual(parse_waveform([[1, 0.5], [0, 0.25]]),
+                         ([(True, 0.5), (False, 0.25)], 1))
+        self.assertEqual(parse_waveform({"steps": [[True, 1]], "repeat": 3}),
+                         ([(True, 1.0)], 3))
+        self.assertEqual(
+            parse_waveform({"frequency": 2, "duty": 0.25, "cycles": 4}),
+            ([(True, 0.125), (False, 0.375)], 4))
+        with self.assertRaises(ValueError):
+            parse_waveform({"frequency": 0})
+        # steps too short for the waveform thread to meet
+        with self.assertRaises(ValueError):
+            parse_waveform({"frequency": 1000})
+        with self.assertRaises(ValueError):
+            parse_waveform([[True, 0.0005], [False, 0.01]])
+
+    @patch(GPIOWrite.__module__ + ".GPIODevice")
+    def test_waveform(self, device):
+        """A waveform drives its pin and reports when it is done."""
+        blk = GPIOWrite()
+        self.configure_block(blk, {
+            "pin": 5, "waveform": "{{ [[True, 0.01], [False, 0.01]] }}"})
+        blk.start()
+        blk.process_signals([Signal()])
+        for _ in range(100):
+            if len(self.last_notified[DEFAULT_TERMINAL]) == 2:
+                break
+            sleep(0.01)
+        blk.stop()
+        self.assertListEqual(device.return_value.write.call_args_list,
+                             [call(5, True), call(5, False)])
+        self.assert_num_signals_notified(2)
+        stats = self.last_notified[DEFAULT_TERMINAL][1].waveform
+        self.assertEqual(stats["steps"], 2)
+        self.assertFalse(stats["cancelled"])
@@ -0,0 +1,78 @@
+from unittest.mock import MagicMock
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+from nio.testing.test_case import NIOTestCase
+from ..gpio_device import GPIODevice, GPIOManager
+from ..metrics import Histogram, Metrics, metrics
+from ..metrics_block import DeviceMetrics
+
+
+class TestMetrics(NIOTestCase):
+
+    def test_histogram_buckets(self):
+        """Values go into the first bucket bounding them."""
+        histogram = Histogram((1, 5))
+        for value in (0.5, 1, 3, 7, 9):
+            histogram.observe(value)
+        self.assertDictEqual(histogram.to_dict(), {
+            "count": 5, "sum": 20.5, "mean": 4.1, "max": 9,
+            "buckets": {"1": 2, "5": 1, "inf": 2}})
+
+    def test_disabled(self):
+        """Nothing is collected until every user has disabled them."""
+        registry = Metrics()
+        registry.count("a")
+        self.assertIsNone(registry.start())
+        registry.enable()
+        registry.enable()
+        registry.count("a", 2)
+        registry.observe_since("b", registry.start())
+        registry.disable()
+        registry.count("a")
+        registry.disable()
+        registry.count("a")
+        snapshot = registry.snapshot(reset=True)
+        self.assertDictEqual(snapshot["counters"], {"a": 3})
+        self.assertEqual(snapshot["histograms"]["b"]["count"], 1)
+        self.assertDictEqual(registry.snapshot(),
+                             {"counters": {}, "histograms": {}})
+
+    def test_gpio_ops(self):
+        """GPIO reads, writes and lock waits are timed."""
+        backend = MagicMock()
+        gpio = GPIODevice(MagicMock(), GPIOManager(MagicMock(), backend))
+        metrics.enable()
+        self.addCleanup(metrics.disable)
+        metrics.snapshot(reset=True)
+        gpio.read(1)
+        gpio.write(2, True)
+        gpio.write(2, True)
+        gpio.write_many({2: True, 3: True})
+        gpio.close()
+        snapshot = metrics.snapshot(reset=True)
+        self.assertDictEqual(snapshot["counters"], {
+            "gpio.writes_skipped": 2, "gpio.pins_written": 1})
+        histograms = snapshot["histograms"]
+        self.assertEqual(histograms["gpio.read"]["count"], 1)
+        self.assertEqual(histograms["gpio.write"]["count"], 1)
+        self.assertEqual(histograms["gpio.write_many"]["count"], 1)
+        self.assertEqual(histograms["gpio.lock_wait"]["count"], 4)
+
+
+class TestDeviceMetrics(NIOBlockTestCase):
+
+    def test_metrics_signals(self):
+        """Signals get the metrics, collected only while the block runs."""
+        blk = DeviceMetrics()
+        self.configure_block(blk, {"report_interval": 0,
+                                   "reset_on_report": True})
+        blk.start()
+        metrics.count("test.events", 3)
+        blk.process_signals([Signal()])
+        blk.stop()
+        metrics.count("test.events")
+        self.assertFalse(metrics.enabled)
+        self.assertEqual(self.last_notified[DEFAULT_TERMINAL][0]
+                         .metrics["counters"]["test.events"], 3)
+        self.assertDictEqual(metrics.snapshot()["counters"], {})
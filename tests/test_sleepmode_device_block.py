@@ -0,0 +1,24 @@
+from unittest.mock import patch
+from nio.block.terminals import DEFAULT_TERMINAL
+from nio.signal.base import Signal
+from nio.testing.block_test_case import NIOBlockTestCase
+from ..sleepmode_device_block import LowPowerSleepMode
+
+
+@patch(LowPowerSleepMode.__module__ + ".check_call")
+@patch(LowPowerSleepMode.__module__ + ".call")
+class TestLowPowerSleepMode(NIOBlockTestCase):
+
+    def test_sleep(self, call, check_call):
+        """The board sleeps on the RTC and the clock is reset after."""
+        blk = LowPowerSleepMode()
+        self.configure_block(blk, {"rtcdevice": "rtc0", "sleeptime": 30})
+        blk.start()
+        blk.process_signals([Signal()])
+        blk.stop()
+        call.assert_called_once_with(
+            ['rtcwake', '-m', 'mem', '-d', 'rtc0', '-s', '30'])
+        check_call.assert_called_once_with(['hwclock', '--hctosys'])
+        self.assert_num_signals_notified(1)
+        self.assertIsInstance(
+            self.last_notified[DEFAULT_TERMINAL][0].sleeptime, float)